@@ -0,0 +1,201 @@
+# Account state cache
+#
+# CachedExchange wraps any Exchange (see exchange.py) and keeps balances and known orders in memory, so that
+# /state, bought and sold transitions and many strategies sharing an account don't all ask Binance for the
+# same things.
+#
+#   balances    filled by get_account, get_asset_balance and by the outboundAccountPosition events of the user
+#               data stream. Trusted for balance_ttl seconds (stream_balance_ttl while the stream is up, since
+#               every balance change is pushed). Dropped as soon as one of our orders is placed, canceled or
+#               filled, since that changes free and locked amounts.
+#   orders      filled by order responses, get_order and execution reports. Orders that are done (filled,
+#               canceled...) can't change and are kept until there are too many of them, open orders are trusted
+#               for order_ttl seconds.
+#
+# hits and misses count how many calls were answered from memory.
+
+import collections
+import threading
+import time
+
+from exchange import Exchange
+from order_stream import FINAL_STATUSES, execution_report_to_order
+
+
+class CachedExchange(Exchange):
+    DEFAULT_BALANCE_TTL = 2.0
+    DEFAULT_STREAM_BALANCE_TTL = 60.0
+    DEFAULT_ORDER_TTL = 1.0
+    # Orders that are done, kept for later get_order calls
+    MAX_FINAL_ORDERS = 1000
+
+    def __init__(self, exchange, balance_ttl=DEFAULT_BALANCE_TTL, stream_balance_ttl=DEFAULT_STREAM_BALANCE_TTL,
+                 order_ttl=DEFAULT_ORDER_TTL):
+        self.exchange = exchange
+        self.blocking = exchange.blocking
+        self.balance_ttl = balance_ttl
+        self.stream_balance_ttl = stream_balance_ttl
+        self.order_ttl = order_ttl
+        self.lock = threading.Lock()
+        # Whether balance events are coming from the user data stream, see order_stream
+        self.tracker = None
+
+        self.balances = {}                          # asset -> (balance, time.monotonic() when stored)
+        self.open_orders = {}                       # orderId -> (order, time.monotonic() when stored)
+        self.final_orders = collections.OrderedDict()   # orderId -> order
+
+        self.hits = {'balance': 0, 'order': 0}
+        self.misses = {'balance': 0, 'order': 0}
+
+    def stats(self):
+        # e.g. "balance 120/130 hits, order 45/47 hits"
+        return ', '.join(kind + " " + str(self.hits[kind]) + "/" + str(self.hits[kind] + self.misses[kind])
+                         + " hits" for kind in ('balance', 'order'))
+
+    # Balances
+
+    def store_balance(self, balance):
+        with self.lock:
+            self.balances[balance['asset']] = (balance, time.monotonic())
+
+    def invalidate_balances(self):
+        with self.lock:
+            self.balances.clear()
+
+    def cached_balance(self, asset):
+        connected = self.tracker is not None and self.tracker.connected
+        max_age = self.stream_balance_ttl if connected else self.balance_ttl
+        with self.lock:
+            entry = self.balances.get(asset)
+        if entry is None or time.monotonic() - entry[1] > max_age:
+            return None
+        return entry[0]
+
+    # Orders
+
+    def store_order(self, order):
+        order_id = int(order['orderId'])
+        with self.lock:
+            previous = self.open_orders.pop(order_id, None)
+            if order['status'] in FINAL_STATUSES:
+                self.final_orders[order_id] = order
+                if len(self.final_orders) > self.MAX_FINAL_ORDERS:
+                    self.final_orders.popitem(last=False)
+            else:
+                self.open_orders[order_id] = (order, time.monotonic())
+        # A fill (even partial) or a cancel we hear about moves money around
+        if previous is not None and (previous[0]['status'] != order['status']
+                                     or previous[0]['executedQty'] != order['executedQty']):
+            self.invalidate_balances()
+
+    def cached_order(self, order_id):
+        order_id = int(order_id)
+        with self.lock:
+            order = self.final_orders.get(order_id)
+            if order is not None:
+                return order
+            entry = self.open_orders.get(order_id)
+        if entry is None or time.monotonic() - entry[1] > self.order_ttl:
+            return None
+        return entry[0]
+
+    # Stream events
+
+    def on_event(self, event):
+        event_type = event.get('e')
+        if event_type == 'executionReport':
+            order = execution_report_to_order(event)
+            self.store_order(order)
+            if order['status'] != 'NEW':
+                # Balances are pushed right after, until then they must be asked
+                self.invalidate_balances()
+        elif event_type == 'outboundAccountPosition':
+            for balance in event['B']:
+                self.store_balance({'asset': balance['a'], 'free': balance['f'], 'locked': balance['l']})
+        elif event_type == 'outboundAccountInfo':
+            # Older format, all the balances at once
+            for balance in event['B']:
+                self.store_balance({'asset': balance['a'], 'free': balance['f'], 'locked': balance['l']})
+        elif event_type == 'error':
+            # Events may have been lost
+            self.invalidate_balances()
+
+    # Exchange interface
+
+    def get_account(self):
+        account = self.exchange.get_account()
+        for balance in account.get('balances', []):
+            self.store_balance(balance)
+        return account
+
+    def get_asset_balance(self, asset):
+        balance = self.cached_balance(asset)
+        if balance is not None:
+            self.hits['balance'] += 1
+            return balance
+        self.misses['balance'] += 1
+        balance = self.exchange.get_asset_balance(asset=asset)
+        if balance is not None:
+            self.store_balance(balance)
+        return balance
+
+    def get_symbol_ticker(self, symbol):
+        return self.exchange.get_symbol_ticker(symbol=symbol)
+
+    def get_order(self, symbol, orderId):
+        order = self.cached_order(orderId)
+        if order is not None and order['symbol'] == symbol:
+            self.hits['order'] += 1
+            return order
+        self.misses['order'] += 1
+        order = self.exchange.get_order(symbol=symbol, orderId=orderId)
+        self.store_order(order)
+        return order
+
+    def get_open_orders(self):
+        orders = self.exchange.get_open_orders()
+        for order in orders:
+            self.store_order(order)
+        return orders
+
+    def get_symbol_info(self, symbol):
+        # Cached by the order builder, see order_builder.py
+        return self.exchange.get_symbol_info(symbol=symbol)
+
+    def order_limit_buy(self, symbol, quantity, price):
+        return self.placed(self.exchange.order_limit_buy(symbol=symbol, quantity=quantity, price=price))
+
+    def order_limit_sell(self, symbol, quantity, price):
+        return self.placed(self.exchange.order_limit_sell(symbol=symbol, quantity=quantity, price=price))
+
+    def cancel_order(self, symbol, orderId):
+        return self.placed(self.exchange.cancel_order(symbol=symbol, orderId=orderId))
+
+    def cancel_replace_order(self, symbol, orderId, side, quantity, price):
+        canceled, new_order = self.exchange.cancel_replace_order(symbol=symbol, orderId=orderId, side=side,
+                                                                 quantity=quantity, price=price)
+        return self.placed(canceled), self.placed(new_order)
+
+    def placed(self, order):
+        # Placing or canceling locks or releases funds
+        self.invalidate_balances()
+        self.store_order(order)
+        return order
+
+    def order_stream(self, tracker):
+        self.tracker = tracker
+        if self.on_event not in tracker.event_listeners:
+            tracker.add_event_listener(self.on_event)
+        return self.exchange.order_stream(tracker)
+
+    def used_weight(self):
+        return self.exchange.used_weight()
+
+    def keep_alive(self):
+        return self.exchange.keep_alive()
+
+    def market_stream(self, cache, symbols):
+        return self.exchange.market_stream(cache, symbols)
+
+    def time(self):
+        return self.exchange.time()
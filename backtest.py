@@ -0,0 +1,288 @@
+# Offline backtesting of the grid strategy
+#
+# Replays historical LTCUSDT prices through the same state machine used by TraderBot: buy at market, then sell
+# at last bought price + sell increment, then buy at last sold price - buy decrement, and so on.
+# The first buy is filled at once, at the close of the first bar, like the bot's market buy. The next orders are
+# limit orders: an order placed during a bar can be filled from the following bar on, when the bar low (for buys)
+# or the bar high (for sells) reaches the order price. Quantities are computed like the bot does
+# (all the USDT balance minus 1$, all the LTC balance, rounded down to 5 decimals).
+#
+# Fill detection is vectorized with NumPy: Python loops once per fill, never once per bar.
+#
+# Accepted input:
+#     • Binance kline dumps (CSV without header: open_time, open, high, low, close, ...)
+#     • CSV with header, with a time column (open_time, timestamp or time) and either low/high/close or price
+#       columns (trades have a single price)
+#     • Parquet files with the same columns as the CSV with header (needs pyarrow)
+#     • kline store directories, e.g. klines/LTCUSDT-1m, see klines.py
+#
+# Usage:
+#     python backtest.py prices.csv [--sell-increment 1.0] [--buy-decrement 1.0] [--usdt 1000] [--fee 0.001]
+
+import argparse
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+import config
+
+
+TIME_COLUMNS = ('open_time', 'timestamp', 'time')
+
+# Fill search starts with small windows and doubles them, so that a fill close to the order costs little
+# and a fill far away costs a few big NumPy calls
+FIRST_WINDOW = 256
+
+
+class Prices:
+    # Historical prices as NumPy arrays, time is in milliseconds
+
+    def __init__(self, times, low, high, close):
+        self.time = np.ascontiguousarray(times, dtype=np.int64)
+        self.low = np.ascontiguousarray(low, dtype=np.float64)
+        self.high = np.ascontiguousarray(high, dtype=np.float64)
+        self.close = np.ascontiguousarray(close, dtype=np.float64)
+
+        # Newer Binance dumps use microseconds
+        if len(self.time) and self.time[0] > 10 ** 14:
+            self.time //= 1000
+
+    def __len__(self):
+        return len(self.close)
+
+
+def load_prices(path):
+    if os.path.isdir(path):
+        # Kline store, see klines.py
+        from klines import open_store
+        return open_store(path).prices()
+    if path.endswith('.parquet'):
+        return load_parquet(path)
+    return load_csv(path)
+
+
+def load_csv(path):
+    with open(path) as csv_file:
+        header = csv_file.readline().strip().split(',')
+
+    try:
+        float(header[0])
+    except ValueError:
+        # CSV with header
+        columns = [name.strip().lower() for name in header]
+        data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2,
+                          usecols=[columns.index(name) for name in price_columns(columns)])
+    else:
+        # Binance kline dump: open_time, open, high, low, close, ...
+        data = np.loadtxt(path, delimiter=',', ndmin=2, usecols=(0, 3, 2, 4))
+
+    if data.shape[1] == 2:
+        return Prices(data[:, 0], data[:, 1], data[:, 1], data[:, 1])
+    return Prices(data[:, 0], data[:, 1], data[:, 2], data[:, 3])
+
+
+def load_parquet(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("pyarrow is needed to read Parquet files")
+
+    table = pq.read_table(path)
+    columns = [name.lower() for name in table.column_names]
+    data = [table.column(columns.index(name)).to_numpy() for name in price_columns(columns)]
+    if len(data) == 2:
+        return Prices(data[0], data[1], data[1], data[1])
+    return Prices(*data)
+
+
+def price_columns(columns):
+    # Returns the names of the columns to load: time, low, high, close or time, price
+    time_column = next((name for name in TIME_COLUMNS if name in columns), None)
+    if time_column is None:
+        raise ValueError("No time column found, expected one of: " + ', '.join(TIME_COLUMNS))
+    if all(name in columns for name in ('low', 'high', 'close')):
+        return [time_column, 'low', 'high', 'close']
+    if 'price' in columns:
+        return [time_column, 'price']
+    raise ValueError("No price columns found, expected low, high and close or price")
+
+
+def find_fill(series, start, price, above):
+    # Index of the first bar from start on whose series value reaches price, -1 if there isn't any
+    n = len(series)
+    window = FIRST_WINDOW
+    while start < n:
+        chunk = series[start:start + window]
+        if above:
+            reached = chunk >= price
+        else:
+            reached = chunk <= price
+        index = reached.argmax()
+        if reached[index]:
+            return start + index
+        start += window
+        window *= 2
+    return -1
+
+
+def round_quantity(quantity):
+    # Same rounding as the bot, 5 decimals with a little margin
+    return float("{:0.0{}f}".format(quantity - 0.00001, 5))
+
+
+class BacktestResult:
+
+    def __init__(self, prices, sell_increment, buy_decrement, initial_usdt):
+        self.prices = prices
+        self.sell_increment = sell_increment
+        self.buy_decrement = buy_decrement
+        self.initial_usdt = initial_usdt
+        self.usdt = initial_usdt
+        self.ltc = 0.0
+
+        # One row per fill
+        self.fill_indexes = []
+        self.fill_sides = []
+        self.fill_prices = []
+
+        self.time_in_position = 0       # ms spent holding LTC
+        self.open_order = None          # (side, price) of the order left open at the end
+
+    @property
+    def trades(self):
+        return len(self.fill_indexes)
+
+    @property
+    def round_trips(self):
+        return self.fill_sides.count('SELL')
+
+    @property
+    def final_equity(self):
+        # LTC is valued at the last close
+        return self.usdt + self.ltc * self.prices.close[-1]
+
+    @property
+    def pnl(self):
+        return self.final_equity - self.initial_usdt
+
+    @property
+    def pnl_percent(self):
+        return self.pnl / self.initial_usdt * 100
+
+    @property
+    def time_in_position_percent(self):
+        span = self.prices.time[-1] - self.prices.time[0]
+        if span <= 0:
+            return 0.0
+        return self.time_in_position / span * 100
+
+    def report(self):
+        start = datetime.utcfromtimestamp(self.prices.time[0] / 1000)
+        end = datetime.utcfromtimestamp(self.prices.time[-1] / 1000)
+        return ("Bars: " + str(len(self.prices)) + " (" + str(start) + " -> " + str(end) + ")\n"
+                + "Sell increment: +$" + str(self.sell_increment)
+                + ", buy decrement: -$" + str(self.buy_decrement) + "\n"
+                + "Trades: " + str(self.trades) + " (" + str(self.round_trips) + " round trips)\n"
+                + "Final balance: $" + "{:.2f}".format(self.usdt) + " + LTC " + "{:.5f}".format(self.ltc) + "\n"
+                + "PnL: " + "{:+.2f}".format(self.pnl) + "$ (" + "{:+.2f}".format(self.pnl_percent) + "%)\n"
+                + "Time in position: " + "{:.1f}".format(self.time_in_position_percent) + "%")
+
+
+def run_backtest(prices, sell_increment, buy_decrement, initial_usdt=1000.0, fee=0.001):
+    result = BacktestResult(prices, sell_increment, buy_decrement, initial_usdt)
+    if len(prices) < 2:
+        return result
+
+    usdt = initial_usdt
+    ltc = 0.0
+    bought_time = None
+
+    # First buy order at market price, filled on the first bar, then the usual BUY_PLACED -> BOUGHT ->
+    # SELL_PLACED -> SOLD cycle
+    side = 'BUY'
+    price = prices.close[0]
+    index = 0
+    while True:
+        if side == 'BUY':
+            if price <= 0:
+                break
+            quantity = round_quantity((usdt - 1) / price)
+            if quantity <= 0:
+                # Not enough money to keep trading
+                break
+            if index == 0:
+                fill = 0
+            else:
+                fill = find_fill(prices.low, index, price, above=False)
+        else:
+            quantity = round_quantity(ltc)
+            if quantity <= 0:
+                break
+            fill = find_fill(prices.high, index, price, above=True)
+
+        if fill < 0:
+            result.open_order = (side, price)
+            break
+
+        result.fill_indexes.append(fill)
+        result.fill_sides.append(side)
+        result.fill_prices.append(price)
+
+        if side == 'BUY':
+            usdt -= quantity * price
+            ltc += quantity * (1 - fee)
+            bought_time = prices.time[fill]
+            side = 'SELL'
+            price = price + sell_increment
+        else:
+            ltc -= quantity
+            usdt += quantity * price * (1 - fee)
+            result.time_in_position += prices.time[fill] - bought_time
+            bought_time = None
+            side = 'BUY'
+            price = price - buy_decrement
+        index = fill + 1
+
+    if bought_time is not None:
+        result.time_in_position += prices.time[-1] - bought_time
+
+    result.usdt = usdt
+    result.ltc = ltc
+    return result
+
+
+def load_settings():
+    # Same settings file used by the bot, see config.py
+    settings = config.load_settings('settings')
+    return settings['sell_increment'], settings['buy_decrement']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the grid strategy on historical prices")
+    parser.add_argument('prices', help="CSV or Parquet file, or kline store directory, with historical prices")
+    parser.add_argument('--sell-increment', type=float, help="The settings file one by default")
+    parser.add_argument('--buy-decrement', type=float, help="The settings file one by default")
+    parser.add_argument('--usdt', type=float, default=1000.0, help="Initial USDT balance")
+    parser.add_argument('--fee', type=float, default=0.001, help="Trading fee, 0.001 is 0.1%%")
+    args = parser.parse_args()
+    if args.sell_increment is None or args.buy_decrement is None:
+        sell_increment, buy_decrement = load_settings()
+        if args.sell_increment is None:
+            args.sell_increment = sell_increment
+        if args.buy_decrement is None:
+            args.buy_decrement = buy_decrement
+
+    start = time.perf_counter()
+    prices = load_prices(args.prices)
+    loaded = time.perf_counter()
+    result = run_backtest(prices, args.sell_increment, args.buy_decrement, args.usdt, args.fee)
+    end = time.perf_counter()
+
+    print(result.report())
+    print("Loading: " + "{:.2f}".format(loaded - start) + " s, simulation: " + "{:.3f}".format(end - loaded) + " s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+# Benchmark of the trading state machine
+#
+# Drives TraderBot's main loop dispatch (buy placed -> bought -> sell placed -> sold -> buy placed...) against a
+# SimulatedExchange and a fake Telegram, with no sleeping between ticks, and measures:
+#   ticks per second        iterations of the main loop, median of the runs
+#   transition latency      duration of the ticks that changed state (e.g. BOUGHT -> SELL_PLACED), and of the
+#                           idle ones (an open order checked and still open)
+#   allocations per cycle   with tracemalloc, in a separate run since tracing slows everything down: peak memory
+#                           allocated during a buy + sell cycle and memory still held after it
+# Everything runs in the bot process as it is, journal and ledger included (in a temporary directory).
+#
+# Results are saved as JSON, --compare prints the differences with an earlier result (e.g. of another commit).
+#
+# Usage:
+#     python benchmark.py [--ticks 20000] [--runs 3] [--output result.json] [--compare old_result.json]
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import bot
+from backtest import load_settings
+from engine import Notifier
+from exchange import PriceFeed, SimulatedExchange
+from journal import Journal
+
+
+class FakeTelegramBot:
+    # Stand-in for telegram.Bot, messages are only counted
+
+    def __init__(self):
+        self.sent = 0
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+class FakeDispatcher:
+
+    def add_handler(self, handler):
+        pass
+
+
+class FakeUpdater:
+
+    def __init__(self):
+        self.bot = FakeTelegramBot()
+        self.dispatcher = FakeDispatcher()
+
+
+def make_prices(ticks, price, amplitude, seed):
+    # Slow waves with some noise, so that the grid goes through many buy and sell cycles
+    generator = random.Random(seed)
+    prices = []
+    for tick in range(ticks + 1):
+        prices.append(round(price + amplitude * math.sin(tick / 40.0) + generator.gauss(0, amplitude / 20), 2))
+    return prices
+
+
+def make_bot(prices, sell_increment, buy_decrement, usdt, directory):
+    bot.TraderBot.debug = False
+    bot.TraderBot.journal_path = os.path.join(directory, 'journal')
+    bot.TraderBot.ledger_path = os.path.join(directory, 'ledger')
+    bot.TraderBot.metrics_port = None
+    bot.TraderBot.log_path = None
+    Notifier.debug = False
+    Journal.debug = False
+    exchange = SimulatedExchange(PriceFeed(prices), balances={'USDT': usdt})
+    updater = FakeUpdater()
+    trader_bot = bot.TraderBot(updater=updater, exchange=exchange)
+    trader_bot.sell_increment = sell_increment
+    trader_bot.buy_decrement = buy_decrement
+    return trader_bot, exchange, updater
+
+
+def close_bot(trader_bot):
+    trader_bot.stop_order_stream()
+    trader_bot.stop_market_stream()
+    if trader_bot.journal is not None:
+        trader_bot.journal.close()
+    if trader_bot.ledger is not None:
+        trader_bot.ledger.close()
+
+
+def state_names():
+    names = {}
+    for name in ('INIT', 'WAITING', 'BUY_PLACED', 'BOUGHT', 'SELL_PLACED', 'SOLD'):
+        names[getattr(bot.TraderBot, name)] = name
+    return names
+
+
+async def drive(trader_bot, exchange, on_tick=None, record=True):
+    # Runs the price feed through the bot. Returns the number of ticks, the tick durations by transition (unless
+    # record is False, they'd show up in the allocations) and the time spent ticking.
+    names = state_names()
+    durations = {}
+    await trader_bot.start_trading()
+    ticks = 0
+    elapsed = 0.0
+    while exchange.advance():
+        state = trader_bot.trading_state
+        start = time.perf_counter()
+        await trader_bot.tick()
+        duration = time.perf_counter() - start
+        elapsed += duration
+        ticks += 1
+        new_state = trader_bot.trading_state
+        if record:
+            if new_state == state:
+                transition = names[state] + ' (idle)'
+            else:
+                transition = names[state] + ' -> ' + names[new_state]
+            durations.setdefault(transition, []).append(duration)
+        if on_tick is not None:
+            on_tick(state, new_state)
+    return ticks, durations, elapsed
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def speed_run(prices, args, directory):
+    trader_bot, exchange, updater = make_bot(prices, args.sell_increment, args.buy_decrement, args.usdt, directory)
+    try:
+        ticks, durations, elapsed = asyncio.run(drive(trader_bot, exchange))
+    finally:
+        close_bot(trader_bot)
+    cycles = len(durations.get('SELL_PLACED -> SOLD', []))
+    return {'ticks': ticks,
+            'ticks_per_second': ticks / elapsed,
+            'cycles': cycles,
+            'exchange_calls_per_tick': exchange.calls / ticks,
+            'messages': updater.bot.sent,
+            'durations': durations}
+
+
+def memory_run(prices, args, directory):
+    # A cycle starts when a sell is filled and ends at the next sell filled. Peak is reset at every cycle.
+    trader_bot, exchange, _ = make_bot(prices, args.sell_increment, args.buy_decrement, args.usdt, directory)
+    sold = bot.TraderBot.SOLD
+    peaks = []
+    retained = []
+
+    def on_tick(state, new_state):
+        if new_state == sold and state != sold:
+            current, peak = tracemalloc.get_traced_memory()
+            if retained:
+                peaks.append(peak - retained[-1])
+            retained.append(current)
+            tracemalloc.reset_peak()
+
+    tracemalloc.start()
+    try:
+        asyncio.run(drive(trader_bot, exchange, on_tick, record=False))
+    finally:
+        tracemalloc.stop()
+        close_bot(trader_bot)
+    cycles = len(retained) - 1
+    if cycles < 1:
+        return {'cycles': 0, 'peak_bytes_per_cycle': None, 'retained_bytes_per_cycle': None}
+    return {'cycles': cycles,
+            'peak_bytes_per_cycle': int(statistics.mean(peaks)),
+            'retained_bytes_per_cycle': int((retained[-1] - retained[0]) / cycles)}
+
+
+def git_commit():
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5)
+        return output.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(args):
+    prices = make_prices(args.ticks, args.price, args.amplitude, args.seed)
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for run in range(args.runs):
+            runs.append(speed_run(prices, args, os.path.join(directory, 'run' + str(run))))
+        memory = memory_run(make_prices(args.memory_ticks, args.price, args.amplitude, args.seed), args,
+                            os.path.join(directory, 'memory'))
+
+    durations = {}
+    for run in runs:
+        for transition, values in run['durations'].items():
+            durations.setdefault(transition, []).extend(values)
+    transitions = {}
+    for transition, values in sorted(durations.items()):
+        transitions[transition] = {'count': len(values),
+                                   'mean_us': statistics.mean(values) * 1e6,
+                                   'p50_us': percentile(values, 50) * 1e6,
+                                   'p99_us': percentile(values, 99) * 1e6}
+    return {'commit': git_commit(),
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'settings': {'ticks': args.ticks, 'runs': args.runs, 'memory_ticks': args.memory_ticks,
+                         'sell_increment': args.sell_increment, 'buy_decrement': args.buy_decrement,
+                         'usdt': args.usdt, 'price': args.price, 'amplitude': args.amplitude, 'seed': args.seed},
+            'ticks_per_second': statistics.median(run['ticks_per_second'] for run in runs),
+            'cycles': runs[0]['cycles'],
+            'exchange_calls_per_tick': runs[0]['exchange_calls_per_tick'],
+            'messages': runs[0]['messages'],
+            'transitions': transitions,
+            'memory': memory}
+
+
+def report(result):
+    lines = ["Commit " + str(result['commit']) + ", Python " + result['python'],
+             "Ticks per second: " + "{:.0f}".format(result['ticks_per_second'])
+             + " (" + str(result['settings']['ticks']) + " ticks, median of " + str(result['settings']['runs'])
+             + " runs)",
+             "Cycles: " + str(result['cycles']) + ", exchange calls per tick: "
+             + "{:.3f}".format(result['exchange_calls_per_tick']) + ", messages: " + str(result['messages']),
+             "",
+             "{:<28}{:>8}{:>12}{:>12}{:>12}".format("Transition", "count", "mean us", "p50 us", "p99 us")]
+    for transition, stats in result['transitions'].items():
+        lines.append("{:<28}{:>8}{:>12.1f}{:>12.1f}{:>12.1f}".format(transition, stats['count'], stats['mean_us'],
+                                                                     stats['p50_us'], stats['p99_us']))
+    memory = result['memory']
+    lines.append("")
+    if memory['cycles']:
+        lines.append("Allocations per cycle (" + str(memory['cycles']) + " cycles): peak "
+                     + str(memory['peak_bytes_per_cycle']) + " bytes, retained "
+                     + str(memory['retained_bytes_per_cycle']) + " bytes")
+    else:
+        lines.append("Allocations per cycle: no complete cycle, try more --memory-ticks")
+    return '\n'.join(lines)
+
+
+def change(old, new, higher_is_better):
+    # Relative change, signed so that positive is an improvement
+    if old is None or new is None or old == 0:
+        return "-"
+    percent = (new - old) / abs(old) * 100
+    if not higher_is_better:
+        percent = -percent or 0.0
+    return "{:+.1f}%".format(percent)
+
+
+def compare(old, new):
+    # Positive percentages are improvements
+    rows = [("ticks per second", old['ticks_per_second'], new['ticks_per_second'], True),
+            ("exchange calls per tick", old['exchange_calls_per_tick'], new['exchange_calls_per_tick'], False),
+            ("peak bytes per cycle", old['memory']['peak_bytes_per_cycle'], new['memory']['peak_bytes_per_cycle'],
+             False),
+            ("retained bytes per cycle", old['memory']['retained_bytes_per_cycle'],
+             new['memory']['retained_bytes_per_cycle'], False)]
+    for transition in sorted(set(old['transitions']) & set(new['transitions'])):
+        rows.append((transition + " p50 us", old['transitions'][transition]['p50_us'],
+                     new['transitions'][transition]['p50_us'], False))
+    lines = ["Compared with commit " + str(old.get('commit')) + " (positive is better)",
+             "{:<36}{:>14}{:>14}{:>10}".format("", "old", "new", "change")]
+    for name, old_value, new_value, higher_is_better in rows:
+        lines.append("{:<36}{:>14}{:>14}{:>10}".format(name, format_value(old_value), format_value(new_value),
+                                                        change(old_value, new_value, higher_is_better)))
+    if old['settings'] != new['settings']:
+        lines.append("Warning: the two results were run with different settings")
+    return '\n'.join(lines)
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "{:.2f}".format(value)
+    return str(value)
+
+
+def main():
+    sell_increment, buy_decrement = load_settings()
+
+    parser = argparse.ArgumentParser(description="Benchmark the trading state machine on a simulated exchange")
+    parser.add_argument('--ticks', type=int, default=20000, help="Price updates per run")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--memory-ticks', type=int, default=5000, help="Price updates of the tracemalloc run")
+    parser.add_argument('--sell-increment', type=float, default=sell_increment)
+    parser.add_argument('--buy-decrement', type=float, default=buy_decrement)
+    parser.add_argument('--usdt', type=float, default=1000.0, help="Initial USDT balance")
+    parser.add_argument('--price', type=float, default=60.0, help="Middle of the simulated prices")
+    parser.add_argument('--amplitude', type=float, default=3.0, help="Amplitude of the simulated price waves")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Saves the result to this JSON file")
+    parser.add_argument('--compare', help="JSON result of an earlier run to compare with")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print(report(result))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(result, output_file, indent=2)
+        print("\nSaved to " + args.output)
+    if args.compare:
+        with open(args.compare) as compare_file:
+            old = json.load(compare_file)
+        print("\n" + compare(old, result))
+
+
+if __name__ == '__main__':
+    main()
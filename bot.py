@@ -7,60 +7,86 @@
 #     state - Check current state and settings
 #     settings - Change trading parameters
 #     current_price - Check current market price
+#     optimize - Find the best settings on historical prices
+#     perf - Check latency and performance metrics
+#     pnl - Check realized profit and fees, e.g. /pnl 7d
+#     digest - Summarize fills every minute instead of one message each, /digest on or /digest off
 
 # TODOS:
 
 import telegram
 import logging
 from telegram import (ReplyKeyboardMarkup, ReplyKeyboardRemove)
-from telegram.error import TelegramError
-from binance.client import Client
 from binance.exceptions import BinanceAPIException
 from requests.exceptions import ConnectionError
 from binance.enums import *
 from telegram.ext import (Updater, CommandHandler, ConversationHandler, MessageHandler, Filters)
 from datetime import datetime
 import time
-import configparser
+import os
+import asyncio
+import threading
+from exchange import BinanceExchange
+from account_cache import CachedExchange
+from scheduler import ScheduledExchange
+from strategy import GridStrategy
+from engine import Engine, Notifier, Timers
+from journal import Journal
+import structured_log
+from market_data import PriceCache
+from volatility import VolatilityTracker
+from paper import PaperMarket
+from config import ConfigWatcher, ConfigError, LIVE_KEYS
+from ledger import TradeLedger, parse_period, format_summary
+from metrics import Metrics, MetricsServer, InstrumentedExchange
+from backtest import load_prices
+from optimize import DEFAULT_RANGE, parse_range, sweep
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 
 
-class TraderBot:
-    token = 'telegram_bot_token'
-    # TODO: set admin ID
-    admin_id = '12345678'
+def markdown_escape(text):
+    # For text that isn't Markdown, e.g. error messages with setting names in them
+    for character in ('_', '*', '`', '['):
+        text = text.replace(character, '\\' + character)
+    return text
 
-    # Trading states
-    INIT = 0            # Binance client is not set, key and secret need to be sent
-    WAITING = 1         # Client is set and verified but trading is not activated
-    BUY_PLACED = 2      # A buy order has been scheduled but it isn't filled yet        ###  STATES WITH
-    BOUGHT = 3          # Buy order completed and a sell order is yet to be scheduled    ##  AUTOMATED
-    SELL_PLACED = 4     # A sell order has been scheduled but it isn't filled yet        ##  TRADING
-    SOLD = 5            # Sell order completed and a buy order is yet to be scheduled   ###  ACTIVATED
 
-    trading_state = INIT
+class TraderBot(GridStrategy):
+    # The LTCUSDT grid strategy, controlled through Telegram
 
-    # Trading parameters in USDT
-    sell_increment = None
-    buy_decrement = None
+    # Telegram bot token and chat ID of the user, from the settings file
+    token = None
+    admin_id = None
 
     # Last prices
     last_bought_price = None
     last_sold_price = None
 
-    # element 0: older order
-    # element 1: newer order
-    last_two_orders = [None, None]
-
-    debug = True
-    updater = Updater(token=token)
-    dispatcher = updater.dispatcher
+    updater = None
+    dispatcher = None
     sell_scheduled = False
     buy_scheduled = False
     api_key = None
     api_secret = None
-    binance_client = None
+    # Exchange adapter, see exchange.py. The factory is called with API key and secret, and metrics.
+    exchange_factory = BinanceExchange
+    # Seconds between chances for the exchange to keep its connections warm, see http_pool.py
+    keep_alive_interval = 5.0
+    order_stream = None
+    market_stream = None
+    # Settings file, reloaded when it changes, see config.py
+    settings_path = 'settings'
+    # Trading state journal, see journal.py. None to run without one.
+    journal_path = 'journal'
+    # Orders and fills, see ledger.py. None to run without one.
+    ledger_path = 'ledger'
+    # Fills of paper trading, apart from the real ones
+    paper_ledger_path = 'paper/ledger'
+    # JSON lines log, rotated and compressed, see structured_log.py. None to log on the console only.
+    log_path = 'logs/bot.log'
+    # Prometheus metrics on localhost, see metrics.py. None to turn the endpoint off.
+    metrics_port = MetricsServer.DEFAULT_PORT
 
     # /start conversation states
     GET_START_CONFIRMATION = 0
@@ -77,18 +103,70 @@ class TraderBot:
     # /stop_trading conversation states
     GET_STOP_TRADING_CONFIRMATION = 0
 
-    # Scheduled action variables
-    sell_increment_changed = False
-    buy_decrement_changed = False
-
-    def __init__(self):
+    # True while an /optimize sweep is running in background
+    optimization_running = False
+
+    def __init__(self, updater=None, exchange=None):
+        # updater and exchange can be replaced by fakes to run the bot offline (tests, benchmarks...)
+        structured_log.setup(self.log_path)
+
+        # Loads settings, the file is then watched by the main loop
+        self.settings_watcher = ConfigWatcher(self.settings_path)
+        settings = self.settings_watcher.settings
+        self.token = settings['token']
+        self.admin_id = settings['admin_id']
+        if self.admin_id is None or (updater is None and self.token is None):
+            raise ConfigError("token and admin_id must be set in " + self.settings_path)
+        self.updater = updater or Updater(token=self.token)
+        self.dispatcher = self.updater.dispatcher
+
+        # Latencies, ticks, fills and errors are measured, see metrics.py
+        self.metrics = Metrics()
+        self.metrics.add_collector(self.collect_metrics)
+
+        # Paper trading: orders go to a fill simulator on the live prices, balances are virtual, see paper.py. Only
+        # public data is asked to Binance, no API keys needed.
+        self.paper = settings['paper'] and exchange is None
+        ledger_path = self.ledger_path
+        if self.paper:
+            exchange = PaperMarket(self.exchange_factory('', '', metrics=self.metrics)).account(
+                {'USDT': settings['paper_balance']})
+            ledger_path = self.paper_ledger_path
+
+        # Balances and orders are kept in memory, see account_cache.py
+        if exchange is not None:
+            exchange = CachedExchange(InstrumentedExchange(exchange, self.metrics))
+
+        GridStrategy.__init__(self, exchange=exchange,
+                              sell_increment=settings['sell_increment'],
+                              buy_decrement=settings['buy_decrement'],
+                              metrics=self.metrics,
+                              market_data=PriceCache(),
+                              ledger=TradeLedger(ledger_path) if ledger_path is not None else None)
+        # Adaptive mode needs the symbol, see make_volatility
+        self.set_volatility(self.make_volatility(settings))
         self.log("Bot started")
 
-        # Loads settings
-        config = configparser.ConfigParser()
-        config.read('settings')
-        self.sell_increment = float(config['SETTINGS']['sell_increment'])
-        self.buy_decrement = float(config['SETTINGS']['buy_decrement'])
+        # After a crash, trading picks up where it left off as soon as the exchange is set again. Paper orders
+        # don't survive a restart.
+        if self.journal_path is not None and not self.paper:
+            self.journal = Journal(self.journal_path)
+            record = self.journal.recover().get(self.name)
+            if record is not None and record['state'] in (self.BUY_PLACED, self.BOUGHT, self.SELL_PLACED, self.SOLD):
+                self.restore(record)
+            self.journal.start()
+
+        # The main loop runs on an asyncio loop, notifications are sent in background, see engine.py
+        self.engine = Engine()
+        self.engine.watch(self.order_tracker)
+        self.notifier = Notifier(self.updater.bot, self.admin_id, metrics=self.metrics)
+
+        # An exchange given from outside is already connected, no need for API key and secret
+        if exchange is not None:
+            self.start_order_stream()
+            self.start_market_stream()
+        if self.paper:
+            self.trading_state = self.WAITING
 
         # Conversation handler for /start command
         # TODO: find why fallback doesn't work (if you don't use chat filters it works, but they're too important
@@ -150,6 +228,26 @@ class TraderBot:
         current_price_command_handler = CommandHandler('current_price', self.current_price_command, filters=Filters.chat(self.admin_id))
         self.dispatcher.add_handler(current_price_command_handler)
 
+        # /optimize command handler
+        optimize_command_handler = CommandHandler('optimize', self.optimize_command,
+                                                  filters=Filters.chat(self.admin_id),
+                                                  pass_args=True)
+        self.dispatcher.add_handler(optimize_command_handler)
+
+        # /pnl command handler
+        pnl_command_handler = CommandHandler('pnl', self.pnl_command, filters=Filters.chat(self.admin_id),
+                                             pass_args=True)
+        self.dispatcher.add_handler(pnl_command_handler)
+
+        # /digest command handler
+        digest_command_handler = CommandHandler('digest', self.digest_command, filters=Filters.chat(self.admin_id),
+                                                pass_args=True)
+        self.dispatcher.add_handler(digest_command_handler)
+
+        # /perf command handler
+        perf_command_handler = CommandHandler('perf', self.perf_command, filters=Filters.chat(self.admin_id))
+        self.dispatcher.add_handler(perf_command_handler)
+
         # Sends start up message
         self.start_up()
 
@@ -157,47 +255,53 @@ class TraderBot:
     def start_command(self, bot, update):
         self.log("/start command received")
 
+        if self.paper:
+            message = ("*Paper trading*: my orders are simulated on the live prices, with a virtual balance, no API "
+                       + "keys needed. Send me /start\\_trading to start.")
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
+            return ConversationHandler.END
+
         if self.trading_state == self.INIT:
             message = ("We are going to initialize and authorize me.\n"
                        + "To start, send me your Binance *API key*:")
-            bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
             return self.SET_API_KEY
 
         elif self.trading_state == self.WAITING:
             reply_keyboard = [['Yes', 'No']]
             message = ("To initialize me again you'll have to *re-enter API key and secret*, are you sure?")
-            bot.send_message(chat_id=self.admin_id, text=message,
-                             reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message,
+                               reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
             return self.GET_START_CONFIRMATION
 
         else:
             message = ("To initialize me again and re-enter API key and secret you have to stop "
                        + "the automated trading first with the /stop_trading command.")
-            bot.send_message(chat_id=self.admin_id, text=message)
+            self.notifier.send(message)
             return ConversationHandler.END
 
     def get_start_confirmation(self, bot, update):
         if update.message.text == 'Yes':
             self.log("Start command confirmed")
             message = "Alright, send me your *Binance API key*:"
-            bot.send_message(chat_id=self.admin_id, text=message,
-                             reply_markup=ReplyKeyboardRemove(),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message,
+                               reply_markup=ReplyKeyboardRemove(),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
             return self.SET_API_KEY
         else:
             self.log("Start command canceled")
             message = "Alrigth, action canceled."
-            bot.send_message(chat_id=self.admin_id, text=message,
-                             reply_markup=ReplyKeyboardRemove(),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message,
+                               reply_markup=ReplyKeyboardRemove(),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
             return ConversationHandler.END
 
 
     def set_api_key(self, bot, update):
         self.api_key = update.message.text
         message = ("Good. Now send me your *Binance API secret*:")
-        bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+        self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
         self.log("API key has been set")
         return self.SET_API_SECRET
 
@@ -205,42 +309,52 @@ class TraderBot:
     def set_api_secret(self, bot, update):
         self.api_secret = update.message.text
         self.log("API secret has been set")
-        binance_client = Client(self.api_key, self.api_secret)
+        # Calls that still go to Binance are rate limited, see scheduler.py
+        exchange = CachedExchange(ScheduledExchange(InstrumentedExchange(
+            self.exchange_factory(self.api_key, self.api_secret, metrics=self.metrics), self.metrics)))
         try:
-            binance_client.get_account()
+            exchange.get_account()
         except BinanceAPIException as e:
             message = ("*Error from Binance!* API key or API secret are probably *wrong*.")
-            bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
             message = "Try again with the /start command."
-            bot.send_message(chat_id=self.admin_id, text=message)
+            self.notifier.send(message)
 
-            self.log("Error from Binance: " + str(e))
+            self.log("Error from Binance: %s", e)
+            self.stop_order_stream()
+            self.stop_market_stream()
             self.api_key = None
             self.api_secret = None
-            self.binance_client = None
+            self.exchange = None
             self.trading_state = self.INIT
         except Exception as e:
             message = ("*Error!* Something went wrong!")
-            bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
             message = "Try again with the /start command."
-            bot.send_message(chat_id=self.admin_id, text=message)
-            self.log("Exception while trying Binance client: " + str(e))
+            self.notifier.send(message)
+            self.log("Exception while trying Binance client: %s", e)
+            self.stop_order_stream()
+            self.stop_market_stream()
             self.api_key = None
             self.api_secret = None
-            self.binance_client = None
+            self.exchange = None
             self.trading_state = self.INIT
         else:
             # API is alright!
-            self.binance_client = binance_client
+            self.exchange = exchange
+            self.start_order_stream()
+            self.start_market_stream()
             message = ("Good! Your API key and secret have been validated, *I'm ready and connected to Binance*.")
-            bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
             message = ("If you want to start the automated trading, send me the /start_trading command.\n"
                        + "At any moment, if you want to take a look at my current state, send me the /state command.\n"
                        + "If you want to change the automated trading parameters and settings, send me the "
                        + "/settings command.")
-            bot.send_message(chat_id=self.admin_id, text=message)
+            self.notifier.send(message)
             self.log("Api works fine.")
             self.trading_state = self.WAITING
+            if self.recovered is not None:
+                self.engine.submit(self.resume())
         finally:
             return ConversationHandler.END
 
@@ -251,9 +365,9 @@ class TraderBot:
                    + "and the *decrement* (in USDT) necessary to automatically buy. _All numbers sent to "
                    + "me must be just numbers, without symbols of any kind_. "
                    + "Decimal numbers are allowed.")
-        bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+        self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
         message = ("Send me the *sell increment*:")
-        bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+        self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
         return self.SET_SELL_INCREMENT
 
     def set_sell_increment(self, bot, update):
@@ -262,17 +376,18 @@ class TraderBot:
             sell_increment = abs(float(update.message.text))
         except Exception as e:
             message = ("*Wrong format!* Send me just a number, without symbols of any kind.")
-            bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
             message = "To try again send me the /settings command."
-            bot.send_message(chat_id=self.admin_id, text=message)
+            self.notifier.send(message)
 
             self.log("sell_increment in wrong format")
             return ConversationHandler.END
         else:
-            self.sell_increment = sell_increment
-            message = ("Sell increment has been successfully set to *+$" + str(self.sell_increment) + "*"
+            # Saved along with the buy decrement
+            self.new_sell_increment = sell_increment
+            message = ("Sell increment has been successfully set to *+$" + str(sell_increment) + "*"
                        + "\nNow send me the *buy decrement*:")
-            bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
             self.log("sell_increment set")
             return self.SET_BUY_DECREMENT
 
@@ -282,75 +397,125 @@ class TraderBot:
             buy_decrement = abs(float(update.message.text))
         except Exception as e:
             message = ("*Wrong format*! Send me just a number, without symbols of any kind.")
-            bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
             message  = "To try again send me the /settings command."
-            bot.send_message(chat_id=self.admin_id, text=message)
+            self.notifier.send(message)
             self.log("buy_decrement in wrong format")
             return ConversationHandler.END
         else:
-            self.buy_decrement = buy_decrement
-
-            # Saves settings to file
-            config = configparser.ConfigParser()
-            config['SETTINGS'] = {}
-            config['SETTINGS']['sell_increment'] = str(self.sell_increment)
-            config['SETTINGS']['buy_decrement'] = str(self.buy_decrement)
-            with open('settings', 'w') as settings_file:
-                config.write(settings_file)
+            # Saved to the settings file and applied by the main loop, the next tick follows right away
+            try:
+                self.engine.submit(self.update_settings(sell_increment=self.new_sell_increment,
+                                                        buy_decrement=buy_decrement)).result()
+            except (ConfigError, OSError) as e:
+                self.log("Settings not saved: %s", e)
+                message = ("*I couldn't change the settings*: " + markdown_escape(str(e))
+                           + "\nTo try again send me the /settings command.")
+                self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
+                return ConversationHandler.END
 
             message = ("Buy decrement has been successfully set to *-$" + str(self.buy_decrement) + "*"
                        + "\nThese new settings will be applied to any open order (if possible) "
                        + "and to any new order from now on.")
-            bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
             self.log("buy_decrement set")
-            self.sell_increment_changed = True
-            self.buy_decrement_changed = True
             return ConversationHandler.END
 
+    async def update_settings(self, **values):
+        # From /settings, on the main loop
+        self.apply_settings(self.settings_watcher.save(**values))
+
+    def reload_settings(self):
+        # Applies the changes made to the settings file, if any. Returns whether there were.
+        try:
+            changes = self.settings_watcher.check()
+        except ConfigError as e:
+            self.log("Settings file not valid, keeping the running settings: %s", e)
+            message = ("*The settings file isn't valid*, I'm keeping the current settings: "
+                       + markdown_escape(str(e)))
+            self.notify(message)
+            return False
+        if not changes:
+            return False
+        restart = self.apply_settings(changes)
+        message = "*Settings reloaded*:"
+        for name in sorted(set(changes) & LIVE_KEYS):
+            message += "\n• " + name.replace('_', ' ') + ": " + str(changes[name][1])
+        if restart:
+            message += "\n" + ', '.join(name.replace('_', ' ') for name in restart) + " will be used after a restart."
+        self.notify(message)
+        return True
+
+    def apply_settings(self, changes):
+        # changes as given by config.diff, only what changed is touched: e.g. a new sell increment re-prices an
+        # open sell, but not an open buy (see GridStrategy.set_increments). Returns the settings that need a restart.
+        for name in sorted(changes):
+            if name in LIVE_KEYS:
+                self.log("Setting %s changed from %s to %s", name, changes[name][0], changes[name][1])
+            else:
+                self.log("Setting %s changed, used after a restart", name)
+        settings = self.settings_watcher.settings
+        if 'sell_increment' in changes or 'buy_decrement' in changes:
+            self.set_increments(settings['sell_increment'], settings['buy_decrement'])
+        if 'adaptive' in changes:
+            self.set_volatility(self.make_volatility(settings))
+        elif self.volatility is not None and ('volatility_multiplier' in changes or 'adaptive_cap' in changes):
+            # The bars seen so far are kept
+            self.volatility.multiplier = settings['volatility_multiplier']
+            self.volatility.cap = settings['adaptive_cap']
+        return sorted(set(changes) - LIVE_KEYS)
+
+    def make_volatility(self, settings):
+        # Adaptive mode is optional: the increments follow the volatility, see volatility.py
+        if not settings['adaptive']:
+            return None
+        return VolatilityTracker(self.symbol, multiplier=settings['volatility_multiplier'],
+                                 cap=settings['adaptive_cap'], clock=self.exchange_clock)
+
 
     def state_command(self, bot, update):
         self.log("/state command received")
-        state = self.trading_state
-        if (state == self.INIT) or (state == self.WAITING):
-            order_info = "  unknown"
-        else:
-            last_order = self.binance_client.get_order(symbol='LTCUSDT', orderId=str(self.get_last_order()))
-            order_info = self.order_info_to_str(last_order)
+        message = self.engine.submit(self.state_message()).result()
+        self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
+
 
-        if self.binance_client == None:
+    def adaptive_info(self):
+        if self.volatility is None:
+            return ""
+        return ("\n• *Adaptive mode*: next sell +$" + str(self.next_sell_increment()) + ", next buy -$"
+                + str(self.next_buy_decrement()) + " (up to " + "{:g}".format(self.volatility.cap)
+                + " times the settings)")
+
+    async def state_message(self):
+        # Last order and balances are fetched at the same time
+        state = self.trading_state
+        order_info = "  unknown"
+        if self.exchange == None:
             account_info = "  unknown"
         else:
-            usdt_balance = self.binance_client.get_asset_balance(asset='USDT')
-            ltc_balance = self.binance_client.get_asset_balance(asset='LTC')
-            account_info = ("  • USDT balance:\n"
-                            + "    • free: " + usdt_balance['free'] + "\n"
-                            + "    • locked: " + usdt_balance['locked'] + "\n"
-                            + "  • LTC balance:\n"
-                            + "    • free: " + ltc_balance['free'] + "\n"
-                            + "    • locked: " + ltc_balance['locked'])
-
-        message = ("• *Current state*: " + self.state_to_str() + ".\n"
+            balances = asyncio.gather(self.call(self.exchange.get_asset_balance, asset=self.quote_asset),
+                                      self.call(self.exchange.get_asset_balance, asset=self.base_asset))
+            if (state == self.INIT) or (state == self.WAITING):
+                quote_balance, base_balance = await balances
+            else:
+                (quote_balance, base_balance), last_order = await asyncio.gather(
+                    balances, self.get_order(self.get_last_order()))
+                order_info = self.order_info_to_str(last_order)
+            account_info = ("  • " + self.quote_asset + " balance:\n"
+                            + "    • free: " + quote_balance['free'] + "\n"
+                            + "    • locked: " + quote_balance['locked'] + "\n"
+                            + "  • " + self.base_asset + " balance:\n"
+                            + "    • free: " + base_balance['free'] + "\n"
+                            + "    • locked: " + base_balance['locked'])
+
+        message = ("• *Paper trading*, orders are simulated\n" if self.paper else "")
+        message += ("• *Current state*: " + self.state_to_str() + ".\n"
                    + "• *Sell increment*: +$" + str(self.sell_increment)
                    + "\n• *Buy decrement*: -$" + str(self.buy_decrement)
+                   + self.adaptive_info()
                    + "\n• *Account balance*:\n" + account_info
                    + "\n• *Last order*:\n" + order_info)
-        bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
-
-
-    def state_to_str(self):
-        state = self.trading_state
-        if state == self.INIT:
-            return "Trading OFF, not connected to Binance"
-        elif state == self.WAITING:
-            return "Trading OFF, connected to Binance"
-        elif state == self.BUY_PLACED:
-            return "Trading ON, buy order placed and yet to be filled"
-        elif state == self.BOUGHT:
-            return "Trading ON, buy order filled"
-        elif state == self.SELL_PLACED:
-            return "Trading ON, sell order placed and yet to be filled"
-        elif state == self.SOLD:
-            return "Trading ON, sell order filled"
+        return message
 
 
     def start_trading_command(self, bot, update):
@@ -362,13 +527,13 @@ class TraderBot:
         if state == self.INIT:
             message = ("To start the automated trading, you first have to initialize me and send me the Binance API "
                        + "key and API secret.\nTo to that, send me the /start command.")
-            bot.send_message(chat_id=self.admin_id, text=message)
+            self.notifier.send(message)
             self.log("/start_trading denied, INIT state")
             return ConversationHandler.END
 
         elif state != self.WAITING:
             message = ("Trading is already activated!")
-            bot.send_message(chat_id=self.admin_id, text=message)
+            self.notifier.send(message)
             self.log("/start_trading denied, already activated")
             return ConversationHandler.END
 
@@ -380,9 +545,9 @@ class TraderBot:
                        + "To start the automated trading, I am going to place a buy order at current market price.\n"
                        + "*Do you wish to continue*?")
             reply_keyboard = [['Yes', 'No']]
-            bot.send_message(chat_id=self.admin_id, text=message,
-                             reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message,
+                               reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
             self.log("Asked for /start_trading confirmation")
             return self.GET_START_TRADING_CONFIRMATION
 
@@ -391,60 +556,19 @@ class TraderBot:
         if update.message.text == 'Yes':
             self.log("/start_trading confirmed")
             message = "Alright, *trading started*!\nI'm going to put the first buy order and see if it goes through."
-            bot.send_message(chat_id=self.admin_id, text=message,
-                             reply_markup=ReplyKeyboardRemove(),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message,
+                               reply_markup=ReplyKeyboardRemove(),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
 
-            # Start automated trading with first sell order
-            try:
-                self.log("I'm going to place a buy order")
-                usdt_balance = float(self.binance_client.get_asset_balance(asset='USDT')['free'])
-                self.log("Current USDT balance is: " + str(usdt_balance))
-                rounded_usdt_balance = usdt_balance - 1 # I'll leave 1 dollar on the balance just to have a little margin
-                self.log("USDT balance - 1 is: " + str(rounded_usdt_balance))
-                current_ltc_price = float(self.binance_client.get_symbol_ticker(symbol='LTCUSDT')['price'])
-                self.log("Current LTC price is: " + str(current_ltc_price))
-                ltc_to_buy = rounded_usdt_balance / (current_ltc_price + 0.5) # 0.5 added to make sure order goes through
-                self.log("I want to buy rounded_usdt_balance/(current_ltc_price + 0.5) Litecoins: " + str(ltc_to_buy))
-                ltc_to_buy = "{:0.0{}f}".format(ltc_to_buy - 0.00001, 5) # rounding LTC here too, for margin
-                self.log("I will actually send a request for buying LTC: " + str(ltc_to_buy))
-                try:
-                    last_placed_order = self.binance_client.order_limit_buy(symbol='LTCUSDT',
-                                                                            quantity=ltc_to_buy,
-                                                                            price=str(current_ltc_price))
-                    self.set_last_order(last_placed_order['orderId'])
-                    self.log("The order went fine, here it is:\n\t" + str(last_placed_order))
-                    if last_placed_order['status'] == 'FILLED':
-                        self.trading_state = self.BOUGHT
-                        self.log("State changed to BOUGHT")
-                        message = ("*Buy order successfully placed and filled*:\n"
-                                   + self.order_info_to_str(last_placed_order))
-                        bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
-                    else:
-                        self.trading_state = self.BUY_PLACED
-                        self.log("State changed to BUY_PLACED")
-                        message = ("*Buy order sucessfully placed*:\n"
-                                   + self.order_info_to_str(last_placed_order))
-                        bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
-                except Exception as e:
-                    self.log("Exception while placing order: " + str(e))
-                    message = ("*Error while placing order*!\nError message: " + str(e) +
-                               "\n\n*Automated trading stopped*.")
-                    bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
-                    self.trading_state = self.WAITING
-
-            except BinanceAPIException as e:
-                self.log("BinanceAPIExcpetion: " + str(e))
-                message = ("*Error from Binance*!\nError message: " + str(e) + "\n\n*Automated trading stopped*.")
-                bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
-                self.trading_state = self.WAITING
+            # Start automated trading with first buy order, on the main loop
+            self.engine.submit(self.start_trading())
 
         else:
             self.log("/start_trading canceled, automated trading NOT started")
             message = "Alright, automated trading *not activated*."
-            bot.send_message(chat_id=self.admin_id, text=message,
-                             reply_markup=ReplyKeyboardRemove(),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message,
+                               reply_markup=ReplyKeyboardRemove(),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
 
         return ConversationHandler.END
 
@@ -456,16 +580,16 @@ class TraderBot:
         state = self.trading_state
         if (state == self.INIT) or (state == self.WAITING):
             message = ("Trading is already deactivated!")
-            bot.send_message(chat_id=self.admin_id, text=message)
+            self.notifier.send(message)
             self.log("/stop_trading denied, trading already deactivated")
             return ConversationHandler.END
 
         else:
             message = ("Are you sure you want to *stop the automated trading*?")
             reply_keyboard = [['Yes', 'No']]
-            bot.send_message(chat_id=self.admin_id, text=message,
-                             reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message,
+                               reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
             self.log("Asked for confirmation of /stop_trading")
             return self.GET_STOP_TRADING_CONFIRMATION
 
@@ -474,16 +598,16 @@ class TraderBot:
         if update.message.text == 'Yes':
             self.log("/stop_trading confirmed")
             message = "Alrigth, *automated trading stopped*!\nIf there's an open order left, it will stay on."
-            bot.send_message(chat_id=self.admin_id, text=message,
-                             reply_markup=ReplyKeyboardRemove(),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
-            self.trading_state = self.WAITING
+            self.notifier.send(message,
+                               reply_markup=ReplyKeyboardRemove(),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
+            self.stop_trading()
         else:
             self.log("/stop_trading canceled, automated trading stays on")
             message = "Alrigth, *automated trading stays ON*."
-            bot.send_message(chat_id=self.admin_id, text=message,
-                             reply_markup=ReplyKeyboardRemove(),
-                             parse_mode=telegram.ParseMode.MARKDOWN)
+            self.notifier.send(message,
+                               reply_markup=ReplyKeyboardRemove(),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
         return ConversationHandler.END
 
 
@@ -493,15 +617,135 @@ class TraderBot:
         if state == self.INIT:
             message = ("I'm not connected to Binance yet! You first have to initialize me and send me the Binance API "
                        + "key and API secret.\nTo to that, send me the /start command.")
-            bot.send_message(chat_id=self.admin_id, text=message)
+            self.notifier.send(message)
             self.log("/current_price denied, INIT state")
         else:
-            current_price = float(self.binance_client.get_symbol_ticker(symbol='LTCUSDT')['price'])
-            message = ("Current LTC/USDT price: *$" + str(current_price) + "*")
-            bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
+            # From the market data stream, Binance is asked only when the stream is down
+            quote = self.market_data.get(self.symbol)
+            if quote is not None and quote.last is not None:
+                message = ("Current LTC/USDT price: *$" + str(quote.last) + "*\n"
+                           + "Best bid: $" + str(quote.bid) + ", best ask: $" + str(quote.ask))
+            else:
+                current_price = float(self.exchange.get_symbol_ticker(symbol=self.symbol)['price'])
+                message = ("Current LTC/USDT price: *$" + str(current_price) + "*")
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
             self.log("current price sent")
 
 
+    def perf_command(self, bot, update):
+        self.log("/perf command received")
+        message = "*Performance*\n```\n" + self.metrics.summary() + "\n```"
+        self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
+
+
+    def pnl_command(self, bot, update, args):
+        self.log("/pnl command received")
+        if self.ledger is None:
+            self.notifier.send("The trade ledger is turned off.")
+            return
+        period_text = args[0] if args else 'all'
+        try:
+            period = parse_period(period_text)
+        except ValueError:
+            message = ("*Wrong period!* Send me something like 24h, 7d, 2w, 1m, week, month or all, e.g.:\n"
+                       + "/pnl 7d")
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
+            return
+        summary = self.ledger.summary(period, symbol=self.symbol)
+        message = ("*PnL* (" + period_text + ")\n```\n"
+                   + format_summary(summary, self.base_asset, self.quote_asset) + "\n```")
+        self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
+
+
+    def digest_command(self, bot, update, args):
+        self.log("/digest command received")
+        if args and args[0].lower() in ('on', 'off'):
+            self.notifier.set_digest(args[0].lower() == 'on')
+        if self.notifier.digest:
+            message = ("Digest mode is *on*: fills are summarized once a minute. To get a message for every fill, "
+                       + "send me /digest off")
+        else:
+            message = ("Digest mode is *off*: you get a message for every fill. To get a summary once a minute "
+                       + "instead, send me /digest on")
+        self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
+
+
+    def collect_metrics(self):
+        # Counters owned by the order tracker and the exchange layers
+        samples = [('order_tracker_stream_hits', {}, self.order_tracker.stream_hits),
+                   ('order_tracker_polls', {}, self.order_tracker.polls),
+                   ('price_cache_hits', {}, self.market_data.hits),
+                   ('price_cache_misses', {}, self.market_data.misses)]
+        layer = self.exchange
+        while layer is not None:
+            if isinstance(layer, CachedExchange):
+                for kind in ('balance', 'order'):
+                    samples.append(('account_cache_hits', {'kind': kind}, layer.hits[kind]))
+                    samples.append(('account_cache_misses', {'kind': kind}, layer.misses[kind]))
+            elif isinstance(layer, ScheduledExchange):
+                samples.append(('request_weight_used', {}, layer.minute_weight))
+                samples.append(('rate_limit_rejected', {}, layer.rejected))
+                samples.append(('coalesced_requests', {}, layer.coalesced))
+            layer = getattr(layer, 'exchange', None)
+        return samples
+
+
+    def optimize_command(self, bot, update, args):
+        self.log("/optimize command received")
+        if self.optimization_running:
+            message = "I'm already optimizing, I'll send you the results as soon as I'm done."
+            self.notifier.send(message)
+            self.log("/optimize denied, already running")
+            return
+
+        if len(args) == 0:
+            message = ("Send me the historical prices file and, if you want, the ranges to test as "
+                       + "_start:stop:step_ (default " + DEFAULT_RANGE + "), e.g.:\n"
+                       + "/optimize prices.csv 0.5:5:0.5 0.5:5:0.5")
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
+            return
+
+        try:
+            sell_increments = parse_range(args[1] if len(args) > 1 else DEFAULT_RANGE)
+            buy_decrements = parse_range(args[2] if len(args) > 2 else DEFAULT_RANGE)
+        except Exception as e:
+            message = "*Wrong format!* Ranges must be sent as _start:stop:step_, e.g. 0.5:5:0.5"
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
+            self.log("/optimize ranges in wrong format")
+            return
+
+        # The sweep runs in its own thread (and processes), so it doesn't block the trading loop or the other
+        # commands
+        self.optimization_running = True
+        optimization_thread = threading.Thread(target=self.optimize,
+                                               args=(args[0], sell_increments, buy_decrements),
+                                               daemon=True)
+        optimization_thread.start()
+        message = ("Alright, I'm testing " + str(len(sell_increments) * len(buy_decrements))
+                   + " settings on the historical prices. It may take a while, meanwhile trading goes on.")
+        self.notifier.send(message)
+
+
+    def optimize(self, prices_file, sell_increments, buy_decrements):
+        try:
+            prices = load_prices(prices_file)
+            # Leaves a core to the bot
+            workers = max(1, (os.cpu_count() or 2) - 1)
+            result = sweep(prices, sell_increments, buy_decrements, workers=workers)
+            best = result.best()
+            message = ("*Optimization done*, here are the best settings:\n"
+                       + "```\n" + result.table(10) + "\n```\n"
+                       + "The best one is sell increment *+$" + str(best[0]) + "* and buy decrement *-$"
+                       + str(best[1]) + "*. If you want to use it, send me the /settings command.")
+            self.log("Optimization done, best settings: %s", best)
+        except Exception as e:
+            message = ("*Error while optimizing*!\nError message: " + str(e))
+            self.log("Exception while optimizing: %s", e)
+        finally:
+            self.optimization_running = False
+        self.notify(message)
+
+
     # # TODO: remove this in production
     # def set_state_command(self, bot, update, args):
     #     state_to_set = int(args[0])
@@ -509,289 +753,132 @@ class TraderBot:
     #     self.log("State changed to " + str(state_to_set))
 
 
-    def order_info_to_str(self, order):
-        if order is None:
-            return "None"
-        else:
-            order_str = ("  • Order ID: " + str(order['orderId'])
-                         + "\n  • Side: " + order['side']
-                         + "\n  • Price in USDT: " + order['price']
-                         + "\n  • Quantity in LTC: " + order['origQty']
-                         + "\n  • Status: " + order['status'])
-            return order_str
-
     def start_up(self):
-        try:
-            message = ("I just rebooted. For security reasons, you have to initialize and authorize me again, "
-                       + "using the /start command.")
-            self.updater.bot.send_message(chat_id=self.admin_id, text=message)
-        except TelegramError as e:
-            self.log("Telegram error on start_up function: " + str(e))
+        # Queued, delivery errors are dealt with by the notifier (see engine.Notifier.deliver)
+        if self.paper:
+            self.notifier.send("I just rebooted, *paper trading*: send me /start\\_trading to start.",
+                               parse_mode=telegram.ParseMode.MARKDOWN)
+            return
+        message = ("I just rebooted. For security reasons, you have to initialize and authorize me again, "
+                   + "using the /start command.")
+        if self.recovered is not None:
+            message += ("\nI was trading before rebooting, my last order ID is " + str(self.get_last_order())
+                        + ": I'll check it and resume trading as soon as I'm connected to Binance again.")
+        self.notifier.send(message)
 
 
     def cancel_command(self, bot, update):
         message = "Alright, action canceled."
-        bot.send_message(chat_id=self.admin_id, text=message)
+        self.notifier.send(message)
         self.log("/cancel command received.")
         return ConversationHandler.END
 
 
-    def log(self, text):
-        if self.debug:
-            now = datetime.now()
-            print(str(now) + ':  ' + text)
+    def notify(self, message, fill=None):
+        # Queued, it never blocks the main loop
+        if fill is not None:
+            self.notifier.fill(message, fill['side'], float(fill['cummulativeQuoteQty']),
+                               parse_mode=telegram.ParseMode.MARKDOWN)
+        else:
+            self.notifier.send(message, parse_mode=telegram.ParseMode.MARKDOWN)
 
 
-    def set_last_order(self, order):
-        # Removes older order
-        self.last_two_orders.pop(0)
-        # Append new one
-        self.last_two_orders.append(order)
+    def start_order_stream(self):
+        self.stop_order_stream()
+        try:
+            self.order_stream = self.exchange.order_stream(self.order_tracker)
+            self.order_stream.start()
+            self.log("User data stream started")
+        except Exception as e:
+            # Not fatal, orders will be polled
+            self.order_stream = None
+            self.log("Couldn't start user data stream, falling back to polling: %s", e)
 
 
-    def get_last_order(self):
-        return self.last_two_orders[1]
+    def stop_order_stream(self):
+        if self.order_stream is not None:
+            try:
+                self.order_stream.stop()
+            except Exception as e:
+                self.log("Exception while stopping user data stream: %s", e)
+            self.order_stream = None
 
 
-    def get_penultimate_order(self):
-        return self.last_two_orders[0]
+    def start_market_stream(self):
+        self.stop_market_stream()
+        try:
+            self.market_stream = self.exchange.market_stream(self.market_data, [self.symbol])
+            self.market_stream.start()
+            self.log("Market data stream started")
+        except Exception as e:
+            # Not fatal, prices will be asked to Binance
+            self.market_stream = None
+            self.log("Couldn't start market data stream, falling back to REST prices: %s", e)
+
+
+    def stop_market_stream(self):
+        if self.market_stream is not None:
+            try:
+                self.market_stream.stop()
+            except Exception as e:
+                self.log("Exception while stopping market data stream: %s", e)
+            self.market_stream = None
 
 
     def run(self):
-        self.updater.start_polling()
+        if self.metrics_port is not None:
+            try:
+                MetricsServer(self.metrics, self.metrics_port).start()
+            except OSError as e:
+                self.log("Couldn't start the metrics endpoint: %s", e)
+        self.engine.run(self.main_loop())
+
+
+    async def main_loop(self):
         # All the meaningful operations need to happen inside this loop, with the help of "schedule" variables.
         # If some event needs to do something important (e.g. buy, sell, stop trading), it needs to schedule
         # such operation with a proper variable and then let the main loop take care of it.
         # That's to guarantee atomicity and avoid overlapping operations.
-
+        self.notifier.start()
+        # Commands are submitted to the engine loop, they can't come in before it runs
+        self.updater.start_polling()
+        # An exchange given from outside is already set
+        if self.recovered is not None and self.exchange is not None:
+            await self.resume()
+
+        timers = Timers()
+        timers.schedule('tick', self.tick_interval())
+        timers.schedule('symbol_filters', self.order_builder.refresh_interval)
+        timers.schedule('keep_alive', self.keep_alive_interval)
+        timers.schedule('settings', self.settings_watcher.poll_interval)
         while True:
-            time.sleep(1)
-            state = self.trading_state
-
-            if state == self.INIT:
-                self.init_function()
-                self.buy_decrement_changed = False
-                self.sell_increment_changed = False
-
-            elif state == self.WAITING:
-                self.waiting_function()
-                self.buy_decrement_changed = False
-                self.sell_increment_changed = False
-
-            elif state == self.BUY_PLACED:
-                self.buy_placed_function()
-                self.sell_increment_changed = False
-                # Here I don't reset buy_decrement because in this state I WANT to know if it is necessary to
-                # change an order
-
-            elif state == self.BOUGHT:
-                self.bought_function()
-                self.buy_decrement_changed = False
-                self.sell_increment_changed = False
-
-            elif state == self.SELL_PLACED:
-                self.sell_placed_function()
-                self.buy_decrement_changed = False
-                # Here I don't reset sell_increment because in this state I WANT to know if it is necessary to
-                # change an order
-
-            elif state == self.SOLD:
-                self.sold_function()
-                self.buy_decrement_changed = False
-                self.sell_increment_changed = False
-
-
-
-    # MAIN LOOP FUNCTIONS
-    #
-    # Orders possible states:
-    #     NEW
-    #     PARTIALLY_FILLED
-    #     FILLED
-    #     CANCELED
-    #     PENDING_CANCEL(currently unused)
-    #     REJECTED
-    #     EXPIRED
-
-    def init_function(self):
-        # Nothing to do here
-        pass
-
-    def waiting_function(self):
-        # Nothing to do here as well
-        pass
-
-    def buy_placed_function(self):
-        # Gets last placed order and checks if it
-        try:
-            last_order = self.binance_client.get_order(symbol='LTCUSDT', orderId=str(self.get_last_order()))
-            last_order_status = last_order['status']
-            if last_order_status == 'FILLED':
-                self.trading_state = self.BOUGHT
-                self.log("Order filled: " + str(last_order))
-                self.log("State changed to BOUGHT")
-                message = ("*Buy order successfully filled*:\n" + self.order_info_to_str(last_order))
-                self.updater.bot.send_message(chat_id=self.admin_id,
-                                              text=message,
-                                              parse_mode=telegram.ParseMode.MARKDOWN)
-            elif last_order_status == 'NEW':
-                # The order is present, but yet to be filled
-                if self.buy_decrement_changed:
+            # Sleeps until the next deadline, but a fill coming from the user data stream (or a command) wakes the
+            # loop up at once
+            due, woken = await self.engine.wait(timers)
+            if 'symbol_filters' in due:
+                # Refreshed ahead of time, so that the next order doesn't wait for them
+                if self.exchange is not None and self.trading_state not in (self.INIT, self.WAITING):
                     try:
-                        message = ("The buy decrement has been changed, so *I'll try to modify the current open buy order*.")
-                        self.updater.bot.send_message(chat_id=self.admin_id,
-                                                      text=message,
-                                                      parse_mode=telegram.ParseMode.MARKDOWN)
-                        self.log("Buy decrement changed, I need to delete the current buy open order and make a new one")
-                        self.binance_client.cancel_order(symbol='LTCUSDT', orderId=self.get_last_order())
-                        # Goes back in time of one step, te penultimate order becomes the last
-                        self.last_two_orders[1] = self.last_two_orders[0]
-                        self.last_two_orders[0] = None
-                        self.trading_state = self.SOLD
+                        await self.load_symbol_filters()
                     except Exception as e:
-                        self.log("Error while trying to change current open order: " + str(e))
-                        message = ("Since you changed the buy decrement, I tried to modify the current open buy "
-                                   + " order, but *something went wrong and I couldn't do it*.")
-                        self.updater.bot.send_message(chat_id=self.admin_id,
-                                                      text=message,
-                                                      parse_mode=telegram.ParseMode.MARKDOWN)
-                    finally:
-                        self.buy_decrement_changed = False
-            elif last_order_status == 'PARTIALLY_FILLED':
-                # The order is present, has been partially filled and I can only wait
-                pass
-            else:
-                # Any other state
-                self.trading_state = self.WAITING
-                self.log("Last order has a state not expected: " + str(last_order))
-                self.log("State changed to WAITING")
-                message = ("*Error!*\nThere's something wrong with my last order."
-                           + "Maybe you canceled the order from the Binance site? Maybe Binance rejected it?\n"
-                           + "Here's the order in question:\n" + self.order_info_to_str(last_order)
-                           + "\n\nYou should take a look at your Binance trading page and see what happend."
-                           + "\nSince I don't know what's going on, *I stopped the automated trading*")
-                self.updater.bot.send_message(chat_id=self.admin_id,
-                                              text=message,
-                                              parse_mode=telegram.ParseMode.MARKDOWN)
-        except Exception as e:
-            self.log("Exception while checking last order: " + str(e))
-
-
-    def bought_function(self):
-        try:
-            # Now I have to schedule a new sell order
-            self.log("I'm going to place the next sell order")
-            sell_increment = self.sell_increment
-            last_order = self.binance_client.get_order(symbol='LTCUSDT', orderId=str(self.get_last_order()))
-            last_bought_price = float(last_order['price'])
-            next_sell_price = last_bought_price + sell_increment
-            ltc_to_sell = float(self.binance_client.get_asset_balance(asset='LTC')['free'])
-            self.log("Current LTC balance is: " + str(ltc_to_sell))
-            ltc_to_sell = "{:0.0{}f}".format(ltc_to_sell - 0.00001, 5)  # rounding LTC here too, for margin
-            self.log("But I will send a request for buying LTC (rounded): " + str(ltc_to_sell))
-            self.log("The price I want to buy at is: " + str(next_sell_price))
-            last_placed_order = self.binance_client.order_limit_sell(symbol='LTCUSDT',
-                                                                     quantity=ltc_to_sell,
-                                                                     price=str(next_sell_price))
-            self.set_last_order(last_placed_order['orderId'])
-            self.log("The order went fine, here it is:\n\t" + str(last_placed_order))
-            self.trading_state = self.SELL_PLACED
-            self.log("State changed to SELL_PLACED")
-            message = ("I'm going to sell again at $" + str(last_bought_price) + " + $" + str(sell_increment)
-                    + " = $" + str(next_sell_price) + ".\n"
-                    + "*Sell order successfully placed*:\n" + self.order_info_to_str(last_placed_order))
-            self.updater.bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
-        except Exception as e:
-            self.log("Exception while placing next sell order: " + str(e))
-
-
-    def sell_placed_function(self):
-        # Get last placed order
-        try:
-            last_order = self.binance_client.get_order(symbol='LTCUSDT', orderId=str(self.get_last_order()))
-            last_order_status = last_order['status']
-            if last_order_status == 'FILLED':
-                self.trading_state = self.SOLD
-                self.log("Order filled: " + str(last_order))
-                self.log("State changed to SOLD")
-                message = ("*Sell order successfully filled*:\n" + self.order_info_to_str(last_order))
-                self.updater.bot.send_message(chat_id=self.admin_id,
-                                              text=message,
-                                              parse_mode=telegram.ParseMode.MARKDOWN)
-            elif last_order_status == 'NEW':
-                # The order is present, but yet to be filled
-                if self.sell_increment_changed:
+                        self.log("Exception while loading the trading rules: %s", e)
+                timers.schedule('symbol_filters', self.order_builder.refresh_interval)
+            if 'keep_alive' in due:
+                if self.exchange is not None:
                     try:
-                        message = ("The sell increment has been changed, so *I'll try to modify the current open sell order*.")
-                        self.updater.bot.send_message(chat_id=self.admin_id,
-                                                      text=message,
-                                                      parse_mode=telegram.ParseMode.MARKDOWN)
-                        self.log("Sell increment changed, I need to delete the current sell open order and make a new one")
-                        self.binance_client.cancel_order(symbol='LTCUSDT', orderId=self.get_last_order())
-                        # Goes back in time of one step, te penultimate order becomes the last
-                        self.last_two_orders[1] = self.last_two_orders[0]
-                        self.last_two_orders[0] = None
-                        self.trading_state = self.BOUGHT
+                        await self.call(self.exchange.keep_alive)
                     except Exception as e:
-                        self.log("Error while trying to change current open sell order: " + str(e))
-                        message = ("I tried to modify the current open buy "
-                                   + " order, but *something went wrong and I couldn't do it*.")
-                        self.updater.bot.send_message(chat_id=self.admin_id,
-                                                      text=message,
-                                                      parse_mode=telegram.ParseMode.MARKDOWN)
-                    finally:
-                        self.sell_increment_changed = False
-                pass
-            elif last_order_status == 'PARTIALLY_FILLED':
-                # The order is present, has been partially filled and I can only wait
-                pass
-            else:
-                # Any other state
-                self.trading_state = self.WAITING
-                self.log("Last order has a state not expected: " + str(last_order))
-                self.log("State changed to WAITING")
-                message = ("*Error!*\nThere's something wrong with my last order."
-                           + "Maybe you canceled the order from the Binance site?  Maybe Binance rejected it?\n"
-                           + "Here's the order in question:\n" + self.order_info_to_str(last_order)
-                           + "\n\nYou should take a look at your Binance trading page and see what happend."
-                           + "\nSince I don't know what's going on, *I stopped the automated trading*.")
-                self.updater.bot.send_message(chat_id=self.admin_id,
-                                              text=message,
-                                              parse_mode=telegram.ParseMode.MARKDOWN)
-        except Exception as e:
-            self.log("Exception while checking last order: " + str(e))
-
-
-    def sold_function(self):
-        try:
-            # Now I have to schedule a new buy order
-
-            last_order = self.binance_client.get_order(symbol='LTCUSDT', orderId=str(self.get_last_order()))
-            last_sold_price = float(last_order['price'])
-            buy_decrement = self.buy_decrement
-            next_buy_price = last_sold_price - buy_decrement
-            self.log("I want to buy at: " + str(next_buy_price))
-            usdt_balance = float(self.binance_client.get_asset_balance(asset='USDT')['free'])
-            self.log("Current USDT balance is: " + str(usdt_balance))
-            rounded_usdt_balance = usdt_balance - 1  # I'll leave 1 dollar on the balance just to have a little margin
-            self.log("USDT balance - 1 is: " + str(rounded_usdt_balance))
-            ltc_to_buy = rounded_usdt_balance / next_buy_price
-            self.log("I want to buy rounded_usdt_balance/next_buy Litecoins: " + str(ltc_to_buy))
-            ltc_to_buy = "{:0.0{}f}".format(ltc_to_buy - 0.00001, 5)  # rounding LTC here too, for margin
-            self.log("I will actually send a request for buying LTC (rounded): " + str(ltc_to_buy))
-            last_placed_order = self.binance_client.order_limit_buy(symbol='LTCUSDT',
-                                                                    quantity=ltc_to_buy,
-                                                                    price=str(next_buy_price))
-            self.set_last_order(last_placed_order['orderId'])
-            self.log("The order went fine, here it is:\n\t" + str(last_placed_order))
-            self.trading_state = self.BUY_PLACED
-            self.log("State changed to BUY_PLACED")
-            message = ("I'm going to buy again at $" + str(last_sold_price) + " - $" + str(buy_decrement)
-                    + " = $" + str(next_buy_price) + ".\n"
-                    + "*Buy order successfully placed*:\n" + self.order_info_to_str(last_placed_order))
-            self.updater.bot.send_message(chat_id=self.admin_id, text=message, parse_mode=telegram.ParseMode.MARKDOWN)
-        except Exception as e:
-            self.log("Exception while placing next buy order: " + str(e))
+                        self.log("Exception while keeping the exchange connection alive: %s", e)
+                timers.schedule('keep_alive', self.keep_alive_interval)
+            if 'settings' in due:
+                # New settings are applied right away
+                woken = self.reload_settings() or woken
+                timers.schedule('settings', self.settings_watcher.poll_interval)
+            if woken or 'tick' in due:
+                start = time.perf_counter()
+                await self.tick()
+                self.metrics.observe('tick_seconds', time.perf_counter() - start)
+                timers.schedule('tick', self.tick_interval())
 
 
 if __name__ == '__main__':
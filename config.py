@@ -0,0 +1,168 @@
+# Settings file
+#
+# The bot's settings live in an INI file ('settings' next to bot.py), e.g.:
+#
+#   [SETTINGS]
+#   sell_increment = 1.0
+#   buy_decrement = 1.0
+#   token = 123456:ABC-DEF...
+#   admin_id = 12345678
+#   adaptive = false
+#   paper = false
+#
+# SCHEMA lists the keys, their type and what values they accept. A file with unknown keys (e.g. a typo), missing
+# keys or wrong values is rejected as a whole, with every problem listed (ConfigError).
+#
+# The bot doesn't need a restart to pick up an edited file: ConfigWatcher checks its modification time every
+# poll_interval seconds (a stat call, from the main loop), and when it changes the file is validated and compared
+# with the running settings, so that only the values that actually changed are applied (see
+# TraderBot.apply_settings). A file that doesn't validate is ignored, the running settings stay. Some keys (token,
+# admin_id, paper...) are only read at start up.
+#
+# /settings writes the file through ConfigWatcher.save, atomically: a half written file is never read.
+
+import configparser
+import os
+
+from volatility import VolatilityTracker
+
+
+SECTION = 'SETTINGS'
+# Default for keys that must be in the file
+REQUIRED = object()
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def parse_bool(text):
+    if text.lower() in configparser.ConfigParser.BOOLEAN_STATES:
+        return configparser.ConfigParser.BOOLEAN_STATES[text.lower()]
+    raise ValueError("not a boolean: " + text)
+
+
+def positive(value):
+    return value > 0
+
+
+def at_least_one(value):
+    return value >= 1
+
+
+# name, type, check (None for any value), default (REQUIRED if it must be in the file), applied without a restart
+SCHEMA = (('sell_increment', float, positive, REQUIRED, True),
+          ('buy_decrement', float, positive, REQUIRED, True),
+          ('adaptive', parse_bool, None, False, True),
+          ('volatility_multiplier', float, positive, VolatilityTracker.DEFAULT_MULTIPLIER, True),
+          ('adaptive_cap', float, at_least_one, VolatilityTracker.DEFAULT_CAP, True),
+          ('paper', parse_bool, None, False, False),
+          ('paper_balance', float, positive, 1000.0, False),
+          ('token', str, None, None, False),
+          ('admin_id', int, None, None, False))
+
+LIVE_KEYS = {name for name, value_type, check, default, live in SCHEMA if live}
+
+
+def parse_settings(values):
+    # Settings from a dict of strings (a section of the file), with the defaults filled in
+    problems = []
+    settings = {}
+    known = {name for name, value_type, check, default, live in SCHEMA}
+    for name in sorted(set(values) - known):
+        problems.append(name + ": unknown setting")
+    for name, value_type, check, default, live in SCHEMA:
+        if name not in values:
+            if default is REQUIRED:
+                problems.append(name + ": missing")
+            settings[name] = None if default is REQUIRED else default
+            continue
+        try:
+            value = value_type(values[name].strip())
+        except ValueError:
+            problems.append(name + ": wrong format, " + values[name])
+            continue
+        if check is not None and not check(value):
+            problems.append(name + ": " + values[name] + " is not allowed (" + check.__name__.replace('_', ' ') + ")")
+            continue
+        settings[name] = value
+    if problems:
+        raise ConfigError(', '.join(problems))
+    return settings
+
+
+def load_settings(path):
+    # Raises ConfigError if the file is missing or not valid
+    parser = configparser.ConfigParser()
+    try:
+        with open(path) as settings_file:
+            parser.read_file(settings_file)
+    except (OSError, configparser.Error) as e:
+        raise ConfigError("can't read " + path + ": " + str(e))
+    if SECTION not in parser:
+        raise ConfigError("no [" + SECTION + "] section in " + path)
+    return parse_settings(dict(parser[SECTION]))
+
+
+def save_settings(path, settings):
+    # Written to a temporary file and moved over the old one. Values that are None aren't written.
+    parser = configparser.ConfigParser()
+    parser[SECTION] = {}
+    for name, value_type, check, default, live in SCHEMA:
+        value = settings.get(name)
+        if value is not None:
+            parser[SECTION][name] = str(value).lower() if isinstance(value, bool) else str(value)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as settings_file:
+        parser.write(settings_file)
+        settings_file.flush()
+        os.fsync(settings_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def diff(old, new):
+    # {name: (old value, new value)} of the settings that changed
+    return {name: (old.get(name), value) for name, value in new.items() if old.get(name) != value}
+
+
+class ConfigWatcher:
+    DEFAULT_POLL_INTERVAL = 2.0
+
+    def __init__(self, path, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        # Running settings, raises ConfigError if the file isn't valid at start up
+        self.settings = load_settings(path)
+        self.stamp = self.file_stamp()
+
+    def file_stamp(self):
+        # Changes whenever the file is written or replaced, None if it's gone
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def check(self):
+        # Settings changed in the file since the last check, see diff. Raises ConfigError if the file changed and
+        # isn't valid, only once for each change: the running settings stay until it's fixed.
+        stamp = self.file_stamp()
+        if stamp == self.stamp:
+            return {}
+        self.stamp = stamp
+        settings = load_settings(self.path)
+        changes = diff(self.settings, settings)
+        self.settings = settings
+        return changes
+
+    def save(self, **values):
+        # Changes some settings and writes the file, returns the changes. Raises ConfigError without writing
+        # anything if the values aren't valid.
+        settings = dict(self.settings)
+        settings.update(values)
+        settings = parse_settings({name: str(value) for name, value in settings.items() if value is not None})
+        save_settings(self.path, settings)
+        changes = diff(self.settings, settings)
+        self.settings = settings
+        self.stamp = self.file_stamp()
+        return changes
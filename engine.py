@@ -0,0 +1,333 @@
+# asyncio engine
+#
+# The main loop runs on an asyncio event loop. Exchange adapters are blocking (requests under the hood), so
+# their calls run on a thread pool: calls that don't depend on each other (e.g. an order and a balance) and
+# the ticks of different strategies can run at the same time, see GridStrategy.call.
+# Telegram messages go through an outbound queue drained by a background task (see Notifier), so order state
+# transitions never wait for chat I/O.
+#
+# Telegram handlers run on their own threads (python-telegram-bot dispatcher): they hand work over to the loop
+# with Engine.submit.
+#
+# The main loop sleeps until the earliest of its deadlines (see Timers): ticks come sooner when the price is close
+# to an open order and later when it's far or trading is off, see GridStrategy.tick_interval.
+
+import asyncio
+import functools
+import heapq
+import html
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.utils.helpers import escape_markdown
+
+from structured_log import get_logger
+
+
+logger = get_logger('engine')
+
+
+class Engine:
+    # Exchange calls that can be in flight at the same time
+    DEFAULT_WORKERS = 8
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='exchange')
+        self.loop = None
+        self.wake_up_event = None
+
+    def run(self, coroutine):
+        # Runs the main coroutine, blocks until it's done
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.set_default_executor(self.executor)
+        self.wake_up_event = asyncio.Event()
+        try:
+            return self.loop.run_until_complete(coroutine)
+        finally:
+            self.loop.close()
+            self.loop = None
+
+    def submit(self, coroutine):
+        # Schedules a coroutine from another thread, returns a concurrent.futures.Future. The main loop is woken up
+        # when it's done, it may have changed what the next tick should be.
+        loop = self.loop
+        if loop is None:
+            coroutine.close()
+            raise RuntimeError("The engine isn't running")
+        return asyncio.run_coroutine_threadsafe(self.run_and_wake_up(coroutine), loop)
+
+    async def run_and_wake_up(self, coroutine):
+        try:
+            return await coroutine
+        finally:
+            self.wake_up_event.set()
+
+    def watch(self, order_tracker):
+        # Order updates wake the main loop up, see sleep
+        order_tracker.add_listener(self.wake_up)
+
+    def wake_up(self):
+        # Thread-safe
+        loop = self.loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self.wake_up_event.set)
+
+    async def sleep(self, timeout):
+        # Sleeps until timeout (None for no timeout) or until someone calls wake_up, whatever comes first.
+        # Returns True if woken up.
+        try:
+            await asyncio.wait_for(self.wake_up_event.wait(), timeout)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        self.wake_up_event.clear()
+        return woken
+
+    async def wait(self, timers):
+        # Sleeps until the earliest timer or a wake_up, returns the names of the timers due and whether it was
+        # woken up
+        woken = await self.sleep(timers.timeout())
+        return timers.due(), woken
+
+
+class Timers:
+    # Named deadlines (ticks, cache refreshes...) on a heap, so that a single loop serves all of them: it sleeps
+    # until the earliest one, see Engine.wait. Rescheduling a timer leaves its old entry in the heap, it's skipped
+    # when it comes up.
+
+    def __init__(self):
+        self.heap = []              # (deadline, sequence, name), deadlines are time.monotonic()
+        self.deadlines = {}         # name -> current deadline
+        self.sequence = itertools.count()
+
+    def schedule(self, name, delay):
+        # Replaces any deadline the timer already had
+        deadline = time.monotonic() + delay
+        self.deadlines[name] = deadline
+        heapq.heappush(self.heap, (deadline, next(self.sequence), name))
+
+    def cancel(self, name):
+        self.deadlines.pop(name, None)
+
+    def timeout(self):
+        # Seconds to the earliest deadline, None without timers
+        while self.heap:
+            deadline, _, name = self.heap[0]
+            if self.deadlines.get(name) != deadline:
+                heapq.heappop(self.heap)
+                continue
+            return max(0.0, deadline - time.monotonic())
+        return None
+
+    def due(self):
+        # Names of the timers whose deadline has passed, they're removed
+        now = time.monotonic()
+        names = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, name = heapq.heappop(self.heap)
+            if self.deadlines.get(name) == deadline:
+                del self.deadlines[name]
+                names.append(name)
+        return names
+
+
+class Notifier:
+    # Outbound message queue for Telegram chats. send never blocks: messages are queued and sent by a background
+    # task, trading never waits for Telegram. Before the loop is started, messages are sent right away.
+    #   - Bursts are merged: messages queued within merge_window (or while the chat is rate limited) go out as a
+    #     single message, as long as it fits. Messages with a keyboard are sent on their own.
+    #   - A chat gets at most a message every min_interval seconds, Telegram allows about one per second.
+    #   - Flood limits (RetryAfter) and network errors are retried with backoff, up to max_retries times.
+    #   - In digest mode fills aren't sent one by one, they're summarized every digest_interval seconds.
+
+    DEFAULT_MERGE_WINDOW = 0.2
+    DEFAULT_MIN_INTERVAL = 1.0
+    DEFAULT_MAX_RETRIES = 5
+    DEFAULT_DIGEST_INTERVAL = 60.0
+    MAX_BACKOFF = 30.0
+    MAX_MESSAGE_LENGTH = 4096
+
+    debug = True
+
+    def __init__(self, bot, chat_id, metrics=None, merge_window=DEFAULT_MERGE_WINDOW,
+                 min_interval=DEFAULT_MIN_INTERVAL, max_retries=DEFAULT_MAX_RETRIES,
+                 digest_interval=DEFAULT_DIGEST_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        # Send latency is recorded here, if any, see metrics.py
+        self.metrics = metrics
+        self.merge_window = merge_window
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.digest_interval = digest_interval
+        self.loop = None
+        self.queue = None
+        self.next_send = {}         # chat_id -> loop time the chat can get the next message
+        # Its own thread, a slow Telegram doesn't take threads away from exchange calls
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='telegram')
+
+        # Digest mode
+        self.digest = False
+        self.fills = []             # (side, quote quantity) of the fills since the last digest
+        self.fills_lock = threading.Lock()
+
+    def log(self, message, *args, **fields):
+        # See structured_log.py
+        if self.debug:
+            logger.info(message, *args, extra={'fields': fields})
+
+    def start(self):
+        # Must be called from the running loop
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.loop.create_task(self.digest_worker())
+        return self.loop.create_task(self.worker())
+
+    def send(self, text, chat_id=None, **kwargs):
+        # Thread-safe, kwargs are passed to bot.send_message
+        if chat_id is None:
+            chat_id = self.chat_id
+        if self.loop is None:
+            self.deliver(chat_id, text, kwargs)
+        else:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (chat_id, text, kwargs))
+
+    def fill(self, text, side, quote_quantity, **kwargs):
+        # Message about a filled order, summarized in digest mode. Thread-safe.
+        if not self.digest:
+            self.send(text, **kwargs)
+            return
+        with self.fills_lock:
+            self.fills.append((side, quote_quantity))
+
+    def set_digest(self, enabled):
+        self.digest = enabled
+        if not enabled:
+            # What's been collected so far
+            self.send_digest()
+
+    # Digest
+
+    def digest_message(self):
+        with self.fills_lock:
+            fills = self.fills
+            self.fills = []
+        if not fills:
+            return None
+        buys = sum(1 for side, _ in fills if side == 'BUY')
+        # Quote asset received by sells minus quote asset spent by buys
+        flow = sum(quote_quantity if side == 'SELL' else -quote_quantity for side, quote_quantity in fills)
+        if self.digest_interval == 60:
+            period = "minute"
+        else:
+            period = "{:g}".format(self.digest_interval) + " seconds"
+        return ("*Digest*: " + str(len(fills)) + " fills in the last " + period + " (" + str(buys) + " buys, "
+                + str(len(fills) - buys) + " sells), " + ("+$" if flow >= 0 else "-$") + "{:.2f}".format(abs(flow)))
+
+    def send_digest(self):
+        message = self.digest_message()
+        if message is not None:
+            self.send(message, parse_mode='Markdown')
+
+    async def digest_worker(self):
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            self.send_digest()
+
+    # Sending
+
+    def merge(self, batch):
+        # Consecutive messages to the same chat become one. Plain text is escaped when joined to Markdown.
+        merged = []
+        for chat_id, text, kwargs in batch:
+            if merged:
+                last_chat_id, last_text, last_kwargs = merged[-1]
+                last_mode = last_kwargs.get('parse_mode')
+                mode = kwargs.get('parse_mode')
+                if (last_chat_id == chat_id and set(last_kwargs) <= {'parse_mode'} and set(kwargs) <= {'parse_mode'}
+                        and (last_mode is None or mode is None or last_mode == mode)):
+                    if last_mode is None and mode is not None:
+                        last_text = escape_text(last_text, mode)
+                    elif mode is None and last_mode is not None:
+                        text = escape_text(text, last_mode)
+                    joined = last_text + "\n\n" + text
+                    if len(joined) <= self.MAX_MESSAGE_LENGTH:
+                        mode = mode or last_mode
+                        merged[-1] = (chat_id, joined, {'parse_mode': mode} if mode is not None else {})
+                        continue
+            merged.append((chat_id, text, kwargs))
+        if self.metrics is not None and len(merged) < len(batch):
+            self.metrics.increment('telegram_messages_merged_total', value=len(batch) - len(merged))
+        return merged
+
+    async def worker(self):
+        while True:
+            batch = [await self.queue.get()]
+            # Waits for the rest of the burst, or until the chat can get a message again
+            wait = max(self.merge_window, self.next_send.get(batch[0][0], 0.0) - self.loop.time())
+            await asyncio.sleep(wait)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            for chat_id, text, kwargs in self.merge(batch):
+                wait = self.next_send.get(chat_id, 0.0) - self.loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await self.loop.run_in_executor(self.executor, functools.partial(self.deliver, chat_id, text, kwargs))
+                self.next_send[chat_id] = self.loop.time() + self.min_interval
+
+    def deliver(self, chat_id, text, kwargs):
+        # Runs on the Telegram thread, sleeping here between retries doesn't hold the loop up
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return True
+            except RetryAfter as e:
+                # Flood limit, Telegram says how long to wait
+                delay = e.retry_after
+                error = e
+            except BadRequest as e:
+                if 'parse_mode' in kwargs:
+                    # Usually broken Markdown: better unformatted than lost
+                    self.log("Telegram refused the message (%s), sending it as plain text", e)
+                    kwargs = dict(kwargs)
+                    del kwargs['parse_mode']
+                    continue
+                self.send_failed(e)
+                return False
+            except (NetworkError, TimedOut) as e:
+                delay = min(self.MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1.0)
+                error = e
+            except Exception as e:
+                # Unauthorized, wrong chat... retrying doesn't help
+                self.send_failed(e)
+                return False
+            finally:
+                if self.metrics is not None:
+                    self.metrics.observe('telegram_send_seconds', time.perf_counter() - start)
+            attempt += 1
+            if attempt > self.max_retries:
+                self.send_failed(error)
+                return False
+            self.log("Telegram error: %s, retrying in %.1f s", error, delay)
+            if self.metrics is not None:
+                self.metrics.increment('telegram_send_retries_total')
+            time.sleep(delay)
+
+    def send_failed(self, error):
+        self.log("Exception while sending message: %s", error)
+        if self.metrics is not None:
+            self.metrics.increment('telegram_send_errors_total')
+
+
+def escape_text(text, parse_mode):
+    # Plain text that goes in a formatted message
+    if parse_mode == 'HTML':
+        return html.escape(text, quote=False)
+    return escape_markdown(text)
@@ -0,0 +1,596 @@
+# Exchange adapters
+#
+# TraderBot talks to the exchange only through an Exchange object, so the real exchange can be swapped with a
+# simulated one for tests, load tests and benchmarks. Method names, arguments and return values are the ones of
+# binance.client.Client (prices and quantities are strings, orders are dicts...), so the bot code reads the same.
+#
+#   BinanceExchange     the real thing, a thin wrapper around binance.client.Client on a pooled, kept alive HTTP
+#                       session (see http_pool.py), on the exchange clock (see time_sync.py)
+#   SimulatedExchange   deterministic in-memory matching engine, with configurable latency and fill model,
+#                       fed by a replayable price feed
+
+import hashlib
+import hmac
+import itertools
+import random
+import time
+
+from binance.client import Client
+from binance.exceptions import BinanceAPIException
+
+from http_pool import HttpPool
+from market_data import BinanceMarketStream, LocalMarketFeed
+from order_builder import InvalidOrder, SymbolFilters
+from order_stream import BinanceOrderStream, LocalOrderFeed, order_to_execution_report
+from time_sync import TimeSync
+
+
+# Filters of LTCUSDT, used by SimulatedExchange for every symbol
+DEFAULT_SYMBOL_FILTERS = [{'filterType': 'PRICE_FILTER', 'minPrice': '0.01000000', 'maxPrice': '100000.00000000',
+                           'tickSize': '0.01000000'},
+                          {'filterType': 'LOT_SIZE', 'minQty': '0.00001000', 'maxQty': '90000.00000000',
+                           'stepSize': '0.00001000'},
+                          {'filterType': 'MIN_NOTIONAL', 'minNotional': '10.00000000'}]
+
+
+class Exchange:
+    # Interface shared by all the adapters
+
+    # Whether calls block on I/O. Blocking calls are run on a thread pool by the engine, see GridStrategy.call.
+    blocking = True
+
+    def get_account(self):
+        raise NotImplementedError
+
+    def get_asset_balance(self, asset):
+        raise NotImplementedError
+
+    def get_symbol_ticker(self, symbol):
+        raise NotImplementedError
+
+    def get_order(self, symbol, orderId):
+        raise NotImplementedError
+
+    def get_open_orders(self):
+        # Open orders of all symbols
+        raise NotImplementedError
+
+    def get_symbol_info(self, symbol):
+        # Trading rules of symbol (filters), the symbol entry of exchangeInfo
+        raise NotImplementedError
+
+    def order_limit_buy(self, symbol, quantity, price):
+        raise NotImplementedError
+
+    def order_limit_sell(self, symbol, quantity, price):
+        raise NotImplementedError
+
+    def cancel_order(self, symbol, orderId):
+        raise NotImplementedError
+
+    def cancel_replace_order(self, symbol, orderId, side, quantity, price):
+        # Cancels an open order and places a new limit order instead, returns (canceled order, new order). The new
+        # order isn't placed if the cancel fails (e.g. the order has just been filled). Adapters without a
+        # cancel-replace endpoint do it with two calls.
+        canceled = self.cancel_order(symbol=symbol, orderId=orderId)
+        if side == 'BUY':
+            new_order = self.order_limit_buy(symbol=symbol, quantity=quantity, price=price)
+        else:
+            new_order = self.order_limit_sell(symbol=symbol, quantity=quantity, price=price)
+        return canceled, new_order
+
+    def order_stream(self, tracker):
+        # Returns an object with start() and stop() that feeds tracker with order updates
+        raise NotImplementedError
+
+    def market_stream(self, cache, symbols):
+        # Returns an object with start() and stop() that feeds cache (a market_data.PriceCache) with the trades
+        # and best bid/ask of symbols
+        raise NotImplementedError
+
+    def used_weight(self):
+        # Request weight used in the current minute, as reported by the exchange, None if unknown.
+        # See scheduler.py.
+        return None
+
+    def keep_alive(self):
+        # Called by the main loop every few seconds, keeps the connections to the exchange warm (see http_pool.py).
+        # Returns whether a request was sent.
+        return False
+
+    def time(self):
+        # Current exchange time in ms, same clock as order times
+        return int(time.time() * 1000)
+
+
+class BinanceClient(Client):
+    # Client on a session managed by HttpPool. The session is set up before Client.__init__ pings the exchange, so
+    # that ping already opens a pooled connection.
+    #
+    # Signed requests are timestamped with the exchange clock (see time_sync.py) and signed with an HMAC whose key
+    # is set up once: every signature copies it instead of hashing the secret again.
+
+    # Binance error code of a timestamp outside of recvWindow
+    INVALID_TIMESTAMP = -1021
+
+    def __init__(self, api_key, api_secret, pool, metrics=None):
+        self.pool = pool
+        self.metrics = metrics
+        self.signer = hmac.new(api_secret.encode('utf-8'), digestmod=hashlib.sha256)
+        self.time_sync = TimeSync(self.server_time, metrics=metrics)
+        self.timestamp_retries = 0
+        Client.__init__(self, api_key, api_secret)
+        self.time_sync.sync()
+
+    def _init_session(self):
+        return self.pool.mount(Client._init_session(self))
+
+    def server_time(self):
+        return self.get_server_time()['serverTime']
+
+    def sign(self, query_string):
+        signer = self.signer.copy()
+        signer.update(query_string.encode('utf-8'))
+        return signer.hexdigest()
+
+    def _generate_signature(self, data):
+        return self.sign('&'.join('{}={}'.format(key, value) for key, value in self._order_params(data)))
+
+    def _request(self, method, uri, signed, force_params=False, **kwargs):
+        if not signed:
+            return Client._request(self, method, uri, signed, force_params, **kwargs)
+        data = dict(kwargs.pop('data', None) or {})
+        try:
+            return self.signed_request(method, uri, force_params, data, kwargs)
+        except BinanceAPIException as e:
+            if e.code != self.INVALID_TIMESTAMP:
+                raise
+            # The clock moved more than we knew: synced again and sent once more, Binance did nothing with the
+            # rejected request
+            self.time_sync.sync()
+            self.timestamp_retries += 1
+            if self.metrics is not None:
+                self.metrics.increment('exchange_timestamp_retries_total')
+            return self.signed_request(method, uri, force_params, data, kwargs)
+
+    def signed_request(self, method, uri, force_params, data, kwargs):
+        # Same request as Client._request, with a fresh timestamp and signature
+        kwargs = dict(kwargs, timeout=10)
+        if self._requests_params:
+            kwargs.update(self._requests_params)
+        data = dict(data)
+        if 'requests_params' in data:
+            kwargs.update(data.pop('requests_params'))
+        data['timestamp'] = self.time_sync.now()
+        params = sorted((key, value) for key, value in data.items() if value is not None)
+        query_string = '&'.join('{}={}'.format(key, value) for key, value in params)
+        params.append(('signature', self.sign(query_string)))
+        if method == 'get' or force_params:
+            kwargs['params'] = query_string + '&signature=' + params[-1][1]
+        else:
+            kwargs['data'] = params
+        self.response = getattr(self.session, method)(uri, **kwargs)
+        return self._handle_response()
+
+
+class BinanceExchange(Exchange):
+
+    def __init__(self, api_key, api_secret, metrics=None):
+        self.pool = HttpPool(metrics=metrics)
+        self.client = BinanceClient(api_key, api_secret, self.pool, metrics)
+
+    def get_account(self):
+        return self.client.get_account()
+
+    def get_asset_balance(self, asset):
+        return self.client.get_asset_balance(asset=asset)
+
+    def get_symbol_ticker(self, symbol):
+        return self.client.get_symbol_ticker(symbol=symbol)
+
+    def get_order(self, symbol, orderId):
+        return self.client.get_order(symbol=symbol, orderId=orderId)
+
+    def get_open_orders(self):
+        return self.client.get_open_orders()
+
+    def get_symbol_info(self, symbol):
+        # exchangeInfo of the symbol only, Client.get_symbol_info downloads all of them
+        response = self.client._get('exchangeInfo', version=self.client.PRIVATE_API_VERSION, data={'symbol': symbol})
+        return response['symbols'][0]
+
+    def order_limit_buy(self, symbol, quantity, price):
+        return self.client.order_limit_buy(symbol=symbol, quantity=quantity, price=price)
+
+    def order_limit_sell(self, symbol, quantity, price):
+        return self.client.order_limit_sell(symbol=symbol, quantity=quantity, price=price)
+
+    def cancel_order(self, symbol, orderId):
+        return self.client.cancel_order(symbol=symbol, orderId=orderId)
+
+    def cancel_replace_order(self, symbol, orderId, side, quantity, price):
+        # Single request (POST /api/v3/order/cancelReplace), not wrapped by python-binance
+        response = self.client._post('order/cancelReplace', True, data={'symbol': symbol,
+                                                                        'side': side,
+                                                                        'type': 'LIMIT',
+                                                                        'timeInForce': 'GTC',
+                                                                        'quantity': quantity,
+                                                                        'price': price,
+                                                                        'cancelOrderId': orderId,
+                                                                        'cancelReplaceMode': 'STOP_ON_FAILURE'})
+        return response['cancelResponse'], response['newOrderResponse']
+
+    def order_stream(self, tracker):
+        return BinanceOrderStream(self.client, tracker)
+
+    def market_stream(self, cache, symbols):
+        return BinanceMarketStream(self.client, cache, symbols)
+
+    def used_weight(self):
+        # Header of the last response
+        response = self.client.response
+        if response is None:
+            return None
+        used_weight = response.headers.get('X-MBX-USED-WEIGHT-1M') or response.headers.get('X-MBX-USED-WEIGHT')
+        return int(used_weight) if used_weight is not None else None
+
+    def keep_alive(self):
+        # Syncing the clock keeps the connection warm as well as a ping
+        if self.client.time_sync.due():
+            self.client.time_sync.sync()
+            return True
+        return self.pool.keep_alive(self.client.ping)
+
+    def time(self):
+        return self.client.time_sync.now()
+
+
+# SIMULATION
+
+class SimulatedExchangeError(Exception):
+    # Same message format as BinanceAPIException
+
+    def __init__(self, code, message):
+        super().__init__(code, message)
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return 'APIError(code=' + str(self.code) + '): ' + self.message
+
+
+class PriceFeed:
+    # Replayable sequence of trade prices
+
+    def __init__(self, prices):
+        self.prices = [float(price) for price in prices]
+        self.position = 0
+
+    @classmethod
+    def from_file(cls, path):
+        # Close prices of a historical file, see backtest.load_prices
+        from backtest import load_prices
+        return cls(load_prices(path).close)
+
+    def current(self):
+        return self.prices[self.position]
+
+    def advance(self):
+        # Moves to the next price, returns False when the feed is over
+        if self.position + 1 >= len(self.prices):
+            return False
+        self.position += 1
+        return True
+
+    def rewind(self):
+        self.position = 0
+
+
+def touches(side, order_price, market_price):
+    if side == 'BUY':
+        return market_price <= order_price
+    return market_price >= order_price
+
+
+class TouchFillModel:
+    # A resting order is filled as soon as the market price reaches its price
+
+    def fills(self, side, order_price, market_price):
+        return touches(side, order_price, market_price)
+
+
+class ThroughFillModel:
+    # A resting order is filled only when the market price goes beyond its price by margin, a pessimistic
+    # model for orders at the back of the queue
+
+    def __init__(self, margin):
+        self.margin = margin
+
+    def fills(self, side, order_price, market_price):
+        if side == 'BUY':
+            return market_price <= order_price - self.margin
+        return market_price >= order_price + self.margin
+
+
+class ProbabilisticFillModel:
+    # When the market price reaches the order price, the order is filled with the given probability.
+    # The random generator is seeded, so runs are reproducible.
+
+    def __init__(self, probability, seed=0):
+        self.probability = probability
+        self.random = random.Random(seed)
+
+    def fills(self, side, order_price, market_price):
+        if not touches(side, order_price, market_price):
+            return False
+        return self.random.random() < self.probability
+
+
+def format_amount(value):
+    return "{:.8f}".format(value)
+
+
+class SimulatedExchange(Exchange):
+    # In-memory matching engine for a single account.
+    #
+    # Resting limit orders are matched against the price feed every time it advances (see advance). Orders that
+    # are marketable when placed are filled at once at the market price, resting orders are filled at their own
+    # price. Balances are locked and released like on Binance, fees are taken from the received asset.
+    #
+    # Time is simulated: every call adds latency seconds to the exchange clock, real_time=True actually sleeps
+    # too (slower, but closer to the real thing).
+    #
+    # price_feed is either a PriceFeed used for every symbol or a dict symbol -> PriceFeed. Market data streams
+    # get the feed price at every step, with the book spread wide around it.
+    #
+    # Orders are checked against symbol_filters (price tick, quantity step, minimum value) like Binance does.
+
+    def __init__(self, price_feed, balances=None, fee=0.001, latency=0.0, fill_model=None, real_time=False,
+                 start_time=0, spread=0.0, symbol_filters=None):
+        if isinstance(price_feed, dict):
+            self.price_feeds = price_feed
+        else:
+            self.price_feeds = {None: price_feed}
+        self.fee = fee
+        self.latency = latency
+        self.fill_model = fill_model or TouchFillModel()
+        self.real_time = real_time
+        # Without real sleeps, nothing blocks
+        self.blocking = real_time
+        self.clock = start_time        # ms
+
+        # asset -> [free, locked]
+        self.balances = {}
+        for asset, amount in (balances or {'USDT': 1000.0}).items():
+            self.balances[asset] = [float(amount), 0.0]
+
+        self.orders = {}
+        self.open_order_ids = []
+        self.order_ids = itertools.count(1)
+        self.spread = spread
+        self.feeds = []
+        self.market_feeds = []      # (LocalMarketFeed, symbols)
+        self.calls = 0
+        # Trading rules of every symbol, in exchangeInfo format. Orders that break them are rejected.
+        self.symbol_filters = symbol_filters if symbol_filters is not None else DEFAULT_SYMBOL_FILTERS
+
+    # Exchange interface
+
+    def get_account(self):
+        self.call()
+        return {'balances': [self.get_balance(asset) for asset in self.balances]}
+
+    def get_asset_balance(self, asset):
+        self.call()
+        return self.get_balance(asset)
+
+    def get_symbol_ticker(self, symbol):
+        self.call()
+        return {'symbol': symbol, 'price': format_amount(self.current_price(symbol))}
+
+    def get_order(self, symbol, orderId):
+        self.call()
+        order = self.orders.get(int(orderId))
+        if order is None or order['symbol'] != symbol:
+            raise SimulatedExchangeError(-2013, 'Order does not exist.')
+        return self.public(order)
+
+    def get_open_orders(self):
+        self.call()
+        return [self.public(self.orders[order_id]) for order_id in self.open_order_ids]
+
+    def get_symbol_info(self, symbol):
+        self.call()
+        base_asset, quote_asset = self.split_symbol(symbol)
+        return {'symbol': symbol,
+                'status': 'TRADING',
+                'baseAsset': base_asset,
+                'quoteAsset': quote_asset,
+                'filters': self.symbol_filters}
+
+    def order_limit_buy(self, symbol, quantity, price):
+        self.call()
+        self.check_filters(symbol, quantity, price)
+        return self.place_order(symbol, 'BUY', float(quantity), float(price))
+
+    def order_limit_sell(self, symbol, quantity, price):
+        self.call()
+        self.check_filters(symbol, quantity, price)
+        return self.place_order(symbol, 'SELL', float(quantity), float(price))
+
+    def cancel_order(self, symbol, orderId):
+        self.call()
+        return self.cancel(symbol, orderId)
+
+    def cancel_replace_order(self, symbol, orderId, side, quantity, price):
+        # Atomic, a single call
+        self.call()
+        canceled = self.cancel(symbol, orderId)
+        self.check_filters(symbol, quantity, price)
+        return canceled, self.place_order(symbol, side, float(quantity), float(price))
+
+    def cancel(self, symbol, orderId):
+        order = self.orders.get(int(orderId))
+        if order is None or order['symbol'] != symbol or order['status'] not in ('NEW', 'PARTIALLY_FILLED'):
+            raise SimulatedExchangeError(-2011, 'Unknown order sent.')
+        self.release(order)
+        self.open_order_ids.remove(order['orderId'])
+        order['status'] = 'CANCELED'
+        order['updateTime'] = self.clock
+        self.publish(order)
+        return self.public(order)
+
+    def order_stream(self, tracker):
+        feed = LocalOrderFeed(tracker)
+        self.feeds.append(feed)
+        return feed
+
+    def market_stream(self, cache, symbols):
+        feed = LocalMarketFeed(cache)
+        self.market_feeds.append((feed, symbols))
+        self.publish_prices()
+        return feed
+
+    def time(self):
+        return self.clock
+
+    # Simulation
+
+    def advance(self, steps=1):
+        # Moves the price feed forward and matches resting orders, returns False when the feed is over
+        for _ in range(steps):
+            advanced = [price_feed.advance() for price_feed in self.price_feeds.values()]
+            if not all(advanced):
+                return False
+            self.clock += 1000
+            self.match()
+            self.publish_prices()
+        return True
+
+    def current_price(self, symbol):
+        price_feed = self.price_feeds.get(symbol)
+        if price_feed is None:
+            price_feed = self.price_feeds[None]
+        return price_feed.current()
+
+    def match(self):
+        for order_id in list(self.open_order_ids):
+            order = self.orders[order_id]
+            market_price = self.current_price(order['symbol'])
+            if self.fill_model.fills(order['side'], float(order['price']), market_price):
+                self.fill(order, float(order['price']))
+
+    def call(self):
+        self.calls += 1
+        if self.latency:
+            self.clock += int(self.latency * 1000)
+            if self.real_time:
+                time.sleep(self.latency)
+
+    def get_balance(self, asset):
+        free, locked = self.balances.get(asset, (0.0, 0.0))
+        return {'asset': asset, 'free': format_amount(free), 'locked': format_amount(locked)}
+
+    def check_filters(self, symbol, quantity, price):
+        try:
+            SymbolFilters({'symbol': symbol, 'filters': self.symbol_filters}).validate(quantity, price)
+        except InvalidOrder as e:
+            raise SimulatedExchangeError(-1013, 'Filter failure: ' + e.filter_type)
+
+    def split_symbol(self, symbol):
+        # Only USDT markets are simulated
+        if not symbol.endswith('USDT'):
+            raise SimulatedExchangeError(-1121, 'Invalid symbol.')
+        return symbol[:-4], 'USDT'
+
+    def place_order(self, symbol, side, quantity, price):
+        base_asset, quote_asset = self.split_symbol(symbol)
+        if quantity <= 0 or price <= 0:
+            raise SimulatedExchangeError(-1013, 'Invalid quantity or price.')
+
+        # Locks what the order could spend
+        if side == 'BUY':
+            locked_asset, locked_amount = quote_asset, quantity * price
+        else:
+            locked_asset, locked_amount = base_asset, quantity
+        balance = self.balances.setdefault(locked_asset, [0.0, 0.0])
+        if balance[0] < locked_amount:
+            raise SimulatedExchangeError(-2010, 'Account has insufficient balance for requested action.')
+        balance[0] -= locked_amount
+        balance[1] += locked_amount
+
+        order = {'symbol': symbol,
+                 'orderId': next(self.order_ids),
+                 'clientOrderId': '',
+                 'price': format_amount(price),
+                 'origQty': format_amount(quantity),
+                 'executedQty': format_amount(0),
+                 'cummulativeQuoteQty': format_amount(0),
+                 'status': 'NEW',
+                 'timeInForce': 'GTC',
+                 'type': 'LIMIT',
+                 'side': side,
+                 'time': self.clock,
+                 'updateTime': self.clock,
+                 'lockedAsset': locked_asset,
+                 'lockedAmount': locked_amount}
+        self.orders[order['orderId']] = order
+        self.open_order_ids.append(order['orderId'])
+
+        # Marketable orders are filled at once, at market price
+        market_price = self.current_price(symbol)
+        if touches(side, price, market_price):
+            self.fill(order, market_price)
+        return self.public(order)
+
+    def fill(self, order, fill_price):
+        base_asset, quote_asset = self.split_symbol(order['symbol'])
+        quantity = float(order['origQty'])
+        quote_quantity = quantity * fill_price
+        self.release(order)
+
+        if order['side'] == 'BUY':
+            self.balances[quote_asset][0] -= quote_quantity
+            self.balances.setdefault(base_asset, [0.0, 0.0])[0] += quantity * (1 - self.fee)
+        else:
+            self.balances[base_asset][0] -= quantity
+            self.balances.setdefault(quote_asset, [0.0, 0.0])[0] += quote_quantity * (1 - self.fee)
+
+        self.open_order_ids.remove(order['orderId'])
+        order['status'] = 'FILLED'
+        order['executedQty'] = order['origQty']
+        order['cummulativeQuoteQty'] = format_amount(quote_quantity)
+        order['updateTime'] = self.clock
+        self.publish(order)
+
+    def release(self, order):
+        # Gives back the locked amount to the free balance
+        balance = self.balances[order['lockedAsset']]
+        balance[0] += order['lockedAmount']
+        balance[1] -= order['lockedAmount']
+        order['lockedAmount'] = 0.0
+
+    def public(self, order):
+        # Order as returned by Binance, without the simulation bookkeeping
+        order = dict(order)
+        del order['lockedAsset']
+        del order['lockedAmount']
+        return order
+
+    def publish_prices(self):
+        for feed, symbols in self.market_feeds:
+            for symbol in symbols:
+                feed.push(symbol, self.current_price(symbol), self.spread)
+
+    def publish(self, order):
+        # Same events as the user data stream: the execution report, then the new balances of the symbol assets
+        event = order_to_execution_report(self.public(order), event_time=self.clock)
+        balances = [self.get_balance(asset) for asset in self.split_symbol(order['symbol'])]
+        account_event = {'e': 'outboundAccountPosition',
+                         'E': self.clock,
+                         'u': self.clock,
+                         'B': [{'a': balance['asset'], 'f': balance['free'], 'l': balance['locked']}
+                               for balance in balances]}
+        for feed in self.feeds:
+            feed.push(event)
+            feed.push(account_event)
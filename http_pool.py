@@ -0,0 +1,146 @@
+# HTTP connection pool of the exchange client
+#
+# binance.client.Client sends every REST call through a requests session. Out of the box the session keeps up to
+# 10 connections but nothing keeps them open: Binance closes a connection after some idle time, and the next call
+# (usually an order, after many ticks answered by the streams and the caches) pays DNS, TCP and TLS again before
+# its own round trip. HttpPool takes care of the session:
+#
+#   pool            pool_size connections, one for each engine worker (see engine.py), so concurrent calls don't
+#                   open and throw away extra connections. No retries: a failed order is never sent twice.
+#   keep alive      keep_alive pings the exchange when no call has gone out for keep_alive_interval seconds, so
+#                   the connection is warm when an order goes out. urllib3 hands out the most recently used
+#                   connection first, the one just pinged.
+#   DNS cache       host addresses are resolved once every dns_ttl seconds, not at every new connection. If the
+#                   resolver fails, the last address is used. TLS still checks the certificate against the host
+#                   name.
+#   latency         round trip of every request by endpoint (e.g. POST /api/v3/order), up to the response
+#                   headers, and new connections opened, see metrics.py:
+#                       exchange_http_seconds{endpoint}
+#                       exchange_http_connections_total
+
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class DnsCache:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.addresses = {}         # (host, port) -> (address, time.monotonic() of the lookup)
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port):
+        with self.lock:
+            entry = self.addresses.get((host, port))
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        try:
+            address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            if entry is None:
+                raise
+            return entry[0]
+        with self.lock:
+            self.addresses[(host, port)] = (address, time.monotonic())
+        return address
+
+
+class CachedDnsHTTPSConnection(HTTPSConnection):
+    # Connects to the cached address of the host, see PooledAdapter
+    dns_cache = None
+    on_connect = None
+
+    def _new_conn(self):
+        host = self._dns_host
+        self._dns_host = self.dns_cache.resolve(host, self.port)
+        try:
+            sock = HTTPSConnection._new_conn(self)
+        finally:
+            self._dns_host = host
+        self.on_connect()
+        return sock
+
+
+class PooledAdapter(HTTPAdapter):
+
+    def __init__(self, dns_cache, on_connect, pool_size):
+        # Used by init_poolmanager, called by HTTPAdapter.__init__
+        self.dns_cache = dns_cache
+        self.on_connect = on_connect
+        HTTPAdapter.__init__(self, pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+
+    def init_poolmanager(self, *args, **kwargs):
+        # TCP keep alive on top of Nagle off (urllib3 default)
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE,
+                                                                             1)]
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        connection_class = type('CachedDnsHTTPSConnection', (CachedDnsHTTPSConnection,),
+                                {'dns_cache': self.dns_cache, 'on_connect': staticmethod(self.on_connect)})
+        pool_class = type('CachedDnsHTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': connection_class})
+        self.poolmanager.pool_classes_by_scheme = {'http': HTTPConnectionPool, 'https': pool_class}
+
+
+class HttpPool:
+    # One engine worker each
+    DEFAULT_POOL_SIZE = 8
+    DEFAULT_KEEP_ALIVE_INTERVAL = 15.0
+    DEFAULT_DNS_TTL = 300.0
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, keep_alive_interval=DEFAULT_KEEP_ALIVE_INTERVAL,
+                 dns_ttl=DEFAULT_DNS_TTL, metrics=None):
+        self.pool_size = pool_size
+        self.keep_alive_interval = keep_alive_interval
+        self.dns_cache = DnsCache(dns_ttl)
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.describe('exchange_http_seconds', "Round trip of exchange HTTP requests, up to the headers")
+            metrics.describe('exchange_http_connections_total', "Connections opened to the exchange")
+        self.lock = threading.Lock()
+        self.last_request = time.monotonic()
+        self.requests = 0
+        self.connections = 0
+        self.pings = 0
+
+    def mount(self, session):
+        adapter = PooledAdapter(self.dns_cache, self.connected, self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.hooks['response'].append(self.record)
+        return session
+
+    def connected(self):
+        with self.lock:
+            self.connections += 1
+        if self.metrics is not None:
+            self.metrics.increment('exchange_http_connections_total')
+
+    def record(self, response, *args, **kwargs):
+        # requests response hook
+        with self.lock:
+            self.last_request = time.monotonic()
+            self.requests += 1
+        if self.metrics is not None:
+            endpoint = response.request.method + ' ' + urlparse(response.url).path
+            self.metrics.observe('exchange_http_seconds', response.elapsed.total_seconds(), {'endpoint': endpoint})
+
+    def keep_alive(self, ping):
+        # Calls ping if the pool has been idle for keep_alive_interval. Returns whether it did.
+        with self.lock:
+            if time.monotonic() - self.last_request < self.keep_alive_interval:
+                return False
+            # Concurrent callers don't ping too
+            self.last_request = time.monotonic()
+            self.pings += 1
+        ping()
+        return True
+
+    def stats(self):
+        # e.g. "120 requests on 2 connections, 8 pings"
+        return (str(self.requests) + " requests on " + str(self.connections) + " connections, " + str(self.pings)
+                + " pings")
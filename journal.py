@@ -0,0 +1,148 @@
+# Trading state journal
+#
+# Every change of a strategy state (trading state, last two order IDs, increments) is appended to a write-ahead
+# log, so that after a crash or a reboot the state machine can be rebuilt and open orders aren't left unmanaged.
+#
+#   <path>.wal        one JSON record per line, appended by a background thread. Records are queued in memory
+#                     by record() and written and fsync'd in batches every sync_interval seconds, the main loop
+#                     never waits for the disk.
+#   <path>.snapshot   latest record of every strategy, rewritten atomically (temporary file, fsync, rename) every
+#                     snapshot_every records, after which the log starts over.
+#
+# Recovery reads the snapshot and replays the log on top of it, a torn last line (crash while writing) is
+# ignored. Records newer than the last fsync are lost, see GridStrategy.resume for how the exchange fills the gap.
+#
+# API keys and secrets are never journaled.
+
+import json
+import os
+import threading
+import time
+
+from structured_log import get_logger
+
+
+logger = get_logger('journal')
+
+
+class Journal:
+    DEFAULT_SYNC_INTERVAL = 0.2
+    DEFAULT_SNAPSHOT_EVERY = 1000
+
+    debug = True
+
+    def __init__(self, path, sync_interval=DEFAULT_SYNC_INTERVAL, snapshot_every=DEFAULT_SNAPSHOT_EVERY):
+        self.wal_path = path + '.wal'
+        self.snapshot_path = path + '.snapshot'
+        self.sync_interval = sync_interval
+        self.snapshot_every = snapshot_every
+
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.latest = {}        # strategy name -> latest record
+        self.pending = []       # lines yet to be written
+        self.written = 0        # records written since the last snapshot
+        self.wal = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def log(self, message, *args, **fields):
+        # See structured_log.py
+        if self.debug:
+            logger.info(message, *args, extra={'fields': fields})
+
+    # Recovery
+
+    def recover(self):
+        # Rebuilds the latest record of every strategy, must be called before start
+        start = time.perf_counter()
+        latest = {}
+        seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            latest = snapshot['strategies']
+            seq = snapshot['seq']
+        replayed = 0
+        if os.path.exists(self.wal_path):
+            with open(self.wal_path) as wal_file:
+                for line in wal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write, nothing after it can be trusted
+                        self.log("Journal: ignoring a damaged record at the end of the log")
+                        break
+                    # Records already in the snapshot (crash between snapshot and log truncation)
+                    if record['seq'] <= seq:
+                        continue
+                    latest[record['name']] = record
+                    seq = record['seq']
+                    replayed += 1
+        with self.lock:
+            self.latest = latest
+            self.seq = seq
+        self.log("Journal: recovered %s strategies (%s log records) in %.1f ms", len(latest), replayed,
+                 (time.perf_counter() - start) * 1000)
+        return dict(latest)
+
+    # Writing
+
+    def start(self):
+        self.wal = open(self.wal_path, 'a')
+        self.thread = threading.Thread(target=self.writer, name='journal', daemon=True)
+        self.thread.start()
+
+    def record(self, name, state):
+        # Queues a record, state is a dict that can be serialized to JSON. Thread-safe, never blocks on I/O.
+        with self.lock:
+            self.seq += 1
+            record = dict(state, name=name, seq=self.seq, time=time.time())
+            self.latest[name] = record
+            self.pending.append(json.dumps(record) + '\n')
+
+    def writer(self):
+        while not self.stopped.wait(self.sync_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            lines = self.pending
+            self.pending = []
+            if not lines:
+                return
+            # State after these lines, in case a snapshot is due
+            latest = dict(self.latest)
+            seq = self.seq
+        try:
+            self.wal.write(''.join(lines))
+            self.wal.flush()
+            os.fsync(self.wal.fileno())
+            self.written += len(lines)
+            if self.written >= self.snapshot_every:
+                self.snapshot(latest, seq)
+        except Exception as e:
+            self.log("Exception while writing the journal: %s", e)
+
+    def snapshot(self, latest, seq):
+        temporary_path = self.snapshot_path + '.tmp'
+        with open(temporary_path, 'w') as snapshot_file:
+            json.dump({'seq': seq, 'strategies': latest}, snapshot_file)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+        # The snapshot has everything, the log can start over
+        self.wal.truncate(0)
+        self.wal.seek(0)
+        self.written = 0
+
+    def close(self):
+        # Writes what's left
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+        if self.wal is not None:
+            self.wal.close()
+            self.wal = None
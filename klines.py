@@ -0,0 +1,263 @@
+# Historical klines
+#
+# Price history for backtests and parameter sweeps (see backtest.py and optimize.py), kept locally and synced
+# with Binance:
+#
+#   store       one directory per symbol and interval (e.g. klines/LTCUSDT-1m), one raw binary file per column
+#               like the trade ledger (see ledger.py). Rows are only ever appended, in open time order, so a query
+#               is a binary search on the open time column and slices of memory maps: a month of 1m klines comes
+#               back in milliseconds, without reading the rest of the file.
+#   download    klines are fetched in pages of 1000 (GET /api/v3/klines, weight 2), workers pages at a time, and
+#               appended in order as they come, so an interrupted download leaves a store that's only shorter.
+#   sync        only what's after the last stored kline is downloaded, and only closed klines are stored.
+#   CSV         Binance kline dumps (data.binance.vision, CSV without header) can be loaded instead, for offline
+#               use.
+#
+# Usage:
+#     python klines.py sync LTCUSDT 1m [--since 2021-01-01] [--store klines]
+#     python klines.py load LTCUSDT 1m dump.csv [dump2.csv...] [--store klines]
+#     python klines.py query LTCUSDT 1m [period] [--store klines]        period e.g. 30d, 24h, all
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from backtest import Prices
+from ledger import parse_period
+
+
+COLUMNS = (('open_time', np.int64),       # ms
+           ('open', np.float64),
+           ('high', np.float64),
+           ('low', np.float64),
+           ('close', np.float64),
+           ('volume', np.float64),        # base asset
+           ('quote_volume', np.float64),
+           ('trades', np.int64))
+
+# Position of the columns in Binance kline rows (API and CSV dumps)
+SOURCE_COLUMNS = (0, 1, 2, 3, 4, 5, 7, 8)
+
+INTERVALS = {'1m': 60 * 1000, '3m': 3 * 60 * 1000, '5m': 5 * 60 * 1000, '15m': 15 * 60 * 1000,
+             '30m': 30 * 60 * 1000, '1h': 3600 * 1000, '2h': 2 * 3600 * 1000, '4h': 4 * 3600 * 1000,
+             '6h': 6 * 3600 * 1000, '8h': 8 * 3600 * 1000, '12h': 12 * 3600 * 1000, '1d': 24 * 3600 * 1000}
+
+DEFAULT_STORE = 'klines'
+PAGE_SIZE = 1000
+DEFAULT_WORKERS = 4
+# Start of a sync without klines stored nor a start given
+DEFAULT_HISTORY = 365 * 24 * 3600 * 1000
+
+
+def interval_ms(interval):
+    if interval not in INTERVALS:
+        raise ValueError("Unknown interval: " + interval + ", expected one of: " + ', '.join(INTERVALS))
+    return INTERVALS[interval]
+
+
+class KlineStore:
+
+    def __init__(self, root, symbol, interval):
+        self.symbol = symbol
+        self.interval = interval
+        self.interval_ms = interval_ms(interval)
+        self.path = os.path.join(root, symbol + '-' + interval)
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def column_path(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def rows(self):
+        counts = []
+        for name, dtype in COLUMNS:
+            path = self.column_path(name)
+            counts.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        return min(counts)
+
+    def last_time(self):
+        # Open time of the last kline stored, None if there isn't any
+        rows = self.rows()
+        if rows == 0:
+            return None
+        with open(self.column_path('open_time'), 'rb') as time_file:
+            time_file.seek((rows - 1) * np.dtype(np.int64).itemsize)
+            return int(np.frombuffer(time_file.read(np.dtype(np.int64).itemsize), dtype=np.int64)[0])
+
+    # Writing
+
+    def append(self, klines):
+        # klines is a 2D array (or list of rows) with the columns in COLUMNS order. Rows that aren't after the last
+        # kline stored are skipped, the rest is sorted. Returns the number of rows appended.
+        data = np.asarray(klines, dtype=np.float64)
+        if data.size == 0:
+            return 0
+        data = data.reshape(-1, len(COLUMNS))
+        with self.lock:
+            rows = self.rows()
+            # A crash in the middle of an append can leave some columns one row longer than others
+            for name, dtype in COLUMNS:
+                path = self.column_path(name)
+                if os.path.exists(path) and os.path.getsize(path) != rows * np.dtype(dtype).itemsize:
+                    with open(path, 'r+b') as column_file:
+                        column_file.truncate(rows * np.dtype(dtype).itemsize)
+            times = data[:, 0].astype(np.int64)
+            # Newer Binance dumps use microseconds
+            if times[0] > 10 ** 14:
+                times //= 1000
+            order = np.argsort(times, kind='stable')
+            times = times[order]
+            data = data[order]
+            keep = np.ones(len(times), dtype=bool)
+            keep[1:] = times[1:] != times[:-1]
+            last_time = self.last_time()
+            if last_time is not None:
+                keep &= times > last_time
+            if not keep.any():
+                return 0
+            data = data[keep]
+            data[:, 0] = times[keep]
+            for index, (name, dtype) in enumerate(COLUMNS):
+                with open(self.column_path(name), 'ab') as column_file:
+                    column_file.write(np.ascontiguousarray(data[:, index]).astype(dtype).tobytes())
+            return len(data)
+
+    def load_csv(self, path):
+        # Binance kline dump: open_time, open, high, low, close, volume, close_time, quote_volume, trades, ...
+        data = np.loadtxt(path, delimiter=',', ndmin=2, usecols=SOURCE_COLUMNS)
+        return self.append(data)
+
+    # Queries
+
+    def columns(self):
+        # Memory maps of all the columns, no data is read until it's used
+        rows = self.rows()
+        columns = {}
+        for name, dtype in COLUMNS:
+            if rows == 0:
+                columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                columns[name] = np.memmap(self.column_path(name), dtype=dtype, mode='r', shape=(rows,))
+        return columns
+
+    def range(self, start=None, end=None):
+        # Columns of the klines opened in [start, end) ms, None for no bound. Slices of the memory maps.
+        columns = self.columns()
+        times = columns['open_time']
+        first = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        last = len(times) if end is None else int(np.searchsorted(times, end, side='left'))
+        return {name: column[first:last] for name, column in columns.items()}
+
+    def last(self, period=None, now=None):
+        # Klines of the last period ms (None for everything)
+        if period is None:
+            return self.range()
+        if now is None:
+            now = int(time.time() * 1000)
+        return self.range(now - period)
+
+    def prices(self, start=None, end=None):
+        # For backtest.run_backtest and optimize.sweep
+        columns = self.range(start, end)
+        return Prices(columns['open_time'], columns['low'], columns['high'], columns['close'])
+
+
+def open_store(path):
+    # Store from its directory, e.g. klines/LTCUSDT-1m
+    root, name = os.path.split(os.path.normpath(path))
+    symbol, interval = name.rsplit('-', 1)
+    return KlineStore(root, symbol, interval)
+
+
+# Download
+
+def fetch_page(client, symbol, interval, start):
+    # Up to PAGE_SIZE klines opened from start on, as rows in COLUMNS order
+    klines = client.get_klines(symbol=symbol, interval=interval, startTime=start, limit=PAGE_SIZE)
+    return [[float(kline[index]) for index in SOURCE_COLUMNS] for kline in klines]
+
+
+def sync(store, client, start=None, workers=DEFAULT_WORKERS, now=None, progress=None):
+    # Downloads the closed klines after the last one stored (or from start, ms), returns the rows appended.
+    # client is a binance.client.Client, klines are public: no key needed.
+    if now is None:
+        now = int(time.time() * 1000)
+    step = store.interval_ms
+    last_time = store.last_time()
+    if last_time is not None:
+        start = last_time + step
+    elif start is None:
+        start = now - DEFAULT_HISTORY
+    start -= start % step
+    # Only klines closed by now
+    end = now - now % step
+    page_starts = list(range(start, end, PAGE_SIZE * step))
+    appended = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map gives the pages back in order, each one is appended as soon as the ones before it are
+        for page_start, rows in zip(page_starts, executor.map(lambda page_start: fetch_page(
+                client, store.symbol, store.interval, page_start), page_starts)):
+            rows = [row for row in rows if row[0] < end]
+            appended += store.append(rows)
+            if progress is not None:
+                progress(page_start, appended)
+    return appended
+
+
+def format_time(ms):
+    return str(datetime.fromtimestamp(ms / 1000.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download and query historical klines")
+    parser.add_argument('command', choices=('sync', 'load', 'query'))
+    parser.add_argument('symbol')
+    parser.add_argument('interval', choices=sorted(INTERVALS, key=INTERVALS.get))
+    parser.add_argument('arguments', nargs='*', help="CSV files to load, or the period to query (e.g. 30d)")
+    parser.add_argument('--store', default=DEFAULT_STORE, help="Directory of the kline stores")
+    parser.add_argument('--since', help="Start of the first sync, YYYY-MM-DD (a year ago by default)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Pages downloaded at the same time")
+    args = parser.parse_args()
+
+    store = KlineStore(args.store, args.symbol, args.interval)
+    start = time.perf_counter()
+    if args.command == 'sync':
+        from binance.client import Client
+        since = None
+        if args.since:
+            since = int(datetime.strptime(args.since, '%Y-%m-%d').timestamp() * 1000)
+        appended = sync(store, Client(), since, args.workers,
+                        progress=lambda page_start, appended: print("Up to " + format_time(page_start) + ": "
+                                                                    + str(appended) + " klines"))
+        print(str(appended) + " klines added in " + "{:.1f}".format(time.perf_counter() - start) + " s, "
+              + str(store.rows()) + " stored")
+    elif args.command == 'load':
+        if not args.arguments:
+            print("Send the CSV files to load")
+            sys.exit(1)
+        appended = sum(store.load_csv(path) for path in sorted(args.arguments))
+        print(str(appended) + " klines added, " + str(store.rows()) + " stored")
+    else:
+        columns = store.last(parse_period(args.arguments[0] if args.arguments else None))
+        elapsed = time.perf_counter() - start
+        count = len(columns['open_time'])
+        if count == 0:
+            print("No klines")
+            return
+        print(str(count) + " klines from " + format_time(int(columns['open_time'][0])) + " to "
+              + format_time(int(columns['open_time'][-1])))
+        print("Low " + "{:.4f}".format(float(columns['low'].min())) + ", high "
+              + "{:.4f}".format(float(columns['high'].max())) + ", last close "
+              + "{:.4f}".format(float(columns['close'][-1])) + ", volume "
+              + "{:.2f}".format(float(columns['volume'].sum())))
+        print("Query: " + "{:.1f}".format(elapsed * 1000) + " ms")
+
+
+if __name__ == '__main__':
+    main()
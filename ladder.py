@@ -0,0 +1,271 @@
+# Ladder mode
+#
+# Instead of a single order at a time, LadderStrategy keeps a ladder of resting orders: levels buy orders below the
+# price, buy_decrement apart, and levels sell orders above it, sell_increment apart (as long as there's base asset
+# to sell). When a buy is filled, a sell is placed sell_increment above it, when a sell is filled, a buy is placed
+# buy_decrement below it. The next levels are already on the book when the price moves, instead of a single order
+# being replaced after every fill.
+#
+# Resting orders are kept by orderId (see Ladder). Fills aren't looked for level by level: the order tracker tells
+# which orders finished (see LadderStrategy.order_updated), whatever the size of the ladder. All the fills found in
+# a tick are replaced at the same time: Binance spot has no batch order endpoint, so the new orders are sent
+# concurrently, one round trip for the whole batch.
+
+import asyncio
+import threading
+
+from order_stream import FINAL_STATUSES
+from strategy import GridStrategy
+
+
+def format_price(price):
+    return "{:.8f}".format(round(price, 8))
+
+
+class Ladder:
+    # Resting orders by orderId. The closest levels are only looked for again after the ladder changed.
+
+    def __init__(self):
+        self.orders = {}                            # orderId -> (side, price, quantity)
+        self.counts = {'BUY': 0, 'SELL': 0}         # orders of each side
+        self.closest = None                         # (highest buy, lowest sell), None after a change
+
+    def __len__(self):
+        return len(self.orders)
+
+    def order_ids(self):
+        return list(self.orders)
+
+    def __contains__(self, order_id):
+        return int(order_id) in self.orders
+
+    def add(self, order_id, side, price, quantity):
+        self.orders[int(order_id)] = (side, price, quantity)
+        self.counts[side] += 1
+        self.closest = None
+
+    def remove(self, order_id):
+        # Returns (side, price, quantity) of the removed order
+        side, price, quantity = self.orders.pop(int(order_id))
+        self.counts[side] -= 1
+        self.closest = None
+        return side, price, quantity
+
+    def closest_levels(self):
+        if self.closest is None:
+            buys = [price for side, price, quantity in self.orders.values() if side == 'BUY']
+            sells = [price for side, price, quantity in self.orders.values() if side == 'SELL']
+            self.closest = (max(buys) if buys else None, min(sells) if sells else None)
+        return self.closest
+
+    def highest_buy(self):
+        return self.closest_levels()[0]
+
+    def lowest_sell(self):
+        return self.closest_levels()[1]
+
+    def rows(self):
+        # Serializable copy, see LadderStrategy.journal_state
+        return sorted([order_id, side, price, quantity] for order_id, (side, price, quantity) in self.orders.items())
+
+
+class LadderStrategy(GridStrategy):
+    LADDER = 6          # Ladder of orders placed, trading
+    STATE_NAMES = dict(GridStrategy.STATE_NAMES)
+    STATE_NAMES[LADDER] = 'LADDER'
+
+    def __init__(self, levels=5, level_budget=None, fee=0.001, **kwargs):
+        GridStrategy.__init__(self, **kwargs)
+        self.levels = levels
+        # Quote asset spent by each buy level, None splits the free balance among the levels
+        self.level_budget = level_budget
+        # Taken from the bought asset, what's left after a buy is what can be sold
+        self.fee = fee
+        self.ladder = Ladder()
+        # orderId -> order, finished orders of the symbol not looked at yet, filled by the order tracker
+        self.finished = {}
+        self.finished_lock = threading.Lock()
+        self.order_tracker.add_order_listener(self.order_updated)
+
+    def state_to_str(self):
+        if self.trading_state == self.LADDER:
+            return ("Trading ON, ladder of " + str(self.ladder.counts['BUY']) + " buy and "
+                    + str(self.ladder.counts['SELL']) + " sell orders")
+        return GridStrategy.state_to_str(self)
+
+    def journal_state(self):
+        state = GridStrategy.journal_state(self)
+        state['ladder'] = self.ladder.rows()
+        return state
+
+    def resting_orders(self):
+        if self.trading_state == self.LADDER:
+            return self.ladder.order_ids()
+        return []
+
+    def order_distance(self):
+        # Distance of the closest level, in grid steps
+        if self.trading_state != self.LADDER:
+            return GridStrategy.order_distance(self)
+        price = self.market_data.price(self.symbol) if self.market_data is not None else None
+        if price is None:
+            return None
+        distances = []
+        highest_buy = self.ladder.highest_buy()
+        if highest_buy is not None and self.buy_decrement > 0:
+            distances.append(abs(price - highest_buy) / self.buy_decrement)
+        lowest_sell = self.ladder.lowest_sell()
+        if lowest_sell is not None and self.sell_increment > 0:
+            distances.append(abs(lowest_sell - price) / self.sell_increment)
+        return min(distances) if distances else None
+
+    async def place(self, side, price, quantity):
+        # Places a level and adds it to the ladder, at the price rounded to the tick size
+        quantity, price = await self.build_order(side, quantity, price)
+        function = self.exchange.order_limit_buy if side == 'BUY' else self.exchange.order_limit_sell
+        order = await self.call(function, symbol=self.symbol, quantity=quantity, price=price)
+        self.order_placed(order)
+        self.ladder.add(order['orderId'], side, float(price), quantity)
+        # The stream can tell about the fill before the response comes back, while the order wasn't a level yet
+        known = self.order_tracker.last_known(order['orderId'])
+        if known is not None:
+            self.order_updated(known)
+        return order
+
+    def order_updated(self, order):
+        # Order tracker listener, called from any thread: finished orders are dealt with at the next tick. Orders
+        # of other strategies on the same tracker are dropped there.
+        if order['symbol'] == self.symbol and order['status'] in FINAL_STATUSES:
+            with self.finished_lock:
+                self.finished[int(order['orderId'])] = order
+
+    async def place_all(self, levels):
+        # levels is a list of (side, price, quantity), all sent at the same time. Returns the orders placed.
+        results = await asyncio.gather(*(self.place(side, price, quantity) for side, price, quantity in levels),
+                                       return_exceptions=True)
+        placed = []
+        for (side, price, quantity), result in zip(levels, results):
+            if isinstance(result, Exception):
+                self.log("Exception while placing %s level at %s: %s", side, price, result)
+                self.exception_swallowed('ladder')
+                self.notify("*Error while placing a " + side.lower() + " order* at $" + format_price(price)
+                            + "!\nError message: " + str(result))
+            else:
+                placed.append(result)
+        return placed
+
+    async def start_trading(self):
+        # Builds the ladder around the middle of the book
+        try:
+            (bid, ask), quote_balance, base_balance, filters = await asyncio.gather(
+                self.top_of_book(),
+                self.get_free_balance(self.quote_asset),
+                self.get_free_balance(self.base_asset),
+                self.symbol_filters())
+        except Exception as e:
+            self.log("Exception from exchange: %s", e)
+            self.exception_swallowed('start_trading')
+            self.notify("*Error from Binance*!\nError message: " + str(e) + "\n\n*Automated trading stopped*.")
+            self.trading_state = self.WAITING
+            self.checkpoint()
+            return
+
+        price = (bid + ask) / 2
+        level_budget = self.level_budget
+        if level_budget is None:
+            level_budget = (quote_balance - 1) / self.levels
+        levels = []
+        for level in range(1, self.levels + 1):
+            buy_price = round(price - level * self.buy_decrement, 8)
+            if buy_price > 0 and level_budget > 0:
+                levels.append(('BUY', buy_price, level_budget / buy_price))
+        # Sells only with what's already there, and only when the whole account is ours (no level budget)
+        base_per_level = base_balance / self.levels
+        rounded_base_per_level = filters.round_quantity(base_per_level)
+        if self.level_budget is None and rounded_base_per_level > 0 and rounded_base_per_level >= filters.min_quantity:
+            for level in range(1, self.levels + 1):
+                levels.append(('SELL', round(price + level * self.sell_increment, 8), base_per_level))
+
+        self.log("I'm going to place a ladder of %s orders around %s", len(levels), price)
+        placed = await self.place_all(levels)
+        if placed:
+            self.trading_state = self.LADDER
+            self.log("State changed to LADDER")
+            self.notify("*Ladder placed*: " + str(len(placed)) + " orders around $" + format_price(price) + ".\n"
+                        + "Highest buy: $" + str(self.ladder.highest_buy())
+                        + ", lowest sell: $" + str(self.ladder.lowest_sell()))
+        else:
+            self.trading_state = self.WAITING
+            self.notify("*No order of the ladder could be placed*.\n\n*Automated trading stopped*.")
+        self.checkpoint()
+
+    async def tick(self):
+        if self.trading_state != self.LADDER:
+            await GridStrategy.tick(self)
+            return
+        await self.ladder_function()
+        self.checkpoint()
+
+    async def ladder_function(self):
+        # Confirms the resting orders with a single open orders call when needed, then replaces the ones that
+        # finished, see order_updated
+        stale_orders = [order_id for order_id in self.ladder.order_ids() if self.order_tracker.is_stale(order_id)]
+        if stale_orders:
+            try:
+                await self.call(self.order_tracker.sync_open_orders, self.exchange, stale_orders)
+                # Levels restored from the journal that aren't open anymore, the tracker has never seen them
+                unknown_orders = [order_id for order_id in stale_orders
+                                  if self.order_tracker.last_known(order_id) is None]
+                await asyncio.gather(*(self.get_order(order_id) for order_id in unknown_orders))
+            except Exception as e:
+                self.log("Exception while checking ladder orders: %s", e)
+                self.exception_swallowed('ladder_function')
+                return
+
+        with self.finished_lock:
+            finished = self.finished
+            self.finished = {}
+        replacements = []
+        for order_id, order in finished.items():
+            if order_id not in self.ladder:
+                continue
+            side, price, quantity = self.ladder.remove(order_id)
+            self.order_tracker.forget(order_id)
+            if order['status'] != 'FILLED':
+                self.log("Ladder order has a state not expected: %s", order, orderId=order['orderId'])
+                self.notify("*A ladder order is gone*, maybe you canceled it from the Binance site?\n"
+                            + self.order_info_to_str(order) + "\n\nThat level won't be replaced.")
+                continue
+            self.fill_detected(order)
+            if side == 'BUY':
+                next_level = ('SELL', round(price + self.sell_increment, 8),
+                              float(order['executedQty']) * (1 - self.fee))
+            else:
+                buy_price = round(price - self.buy_decrement, 8)
+                # A sell at or below the buy decrement leaves no room for a buy under it
+                if buy_price <= 0:
+                    continue
+                next_level = ('BUY', buy_price, float(order['cummulativeQuoteQty']) * (1 - self.fee) / buy_price)
+            replacements.append(next_level)
+            self.notify("*" + side.capitalize() + " order filled* at $" + format_price(price) + ", placing a "
+                        + next_level[0].lower() + " order at $" + format_price(next_level[1]), fill=order)
+
+        if replacements:
+            await self.place_all(replacements)
+        if not self.ladder.orders:
+            self.trading_state = self.WAITING
+            self.log("State changed to WAITING, ladder is empty")
+            self.notify("*The ladder is empty*, automated trading stopped.")
+
+    async def resume(self, claimed=()):
+        record = self.recovered
+        if record['state'] != self.LADDER:
+            return await GridStrategy.resume(self, claimed)
+        # Orders filled or canceled while the bot was down are dealt with at the next tick
+        self.recovered = None
+        for order_id, side, price, quantity in record['ladder']:
+            self.ladder.add(order_id, side, price, quantity)
+        self.trading_state = self.LADDER if self.ladder.orders else self.WAITING
+        self.notify("*Trading resumed* where I left off: " + self.state_to_str() + ".")
+        self.checkpoint()
+        return self.trading_state == self.LADDER
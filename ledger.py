@@ -0,0 +1,296 @@
+# Trade ledger
+#
+# Every order placed and every fill is appended to a columnar on-disk ledger: one raw binary file per column
+# (time, order id, strategy, symbol, kind, side, price, quantity, quote quantity, fee) in a directory. Appending writes a
+# few bytes at the end of each file, queries map the files with NumPy (np.memmap) and aggregate whole columns at
+# once, so months of fills are summed in milliseconds without building a Python object per row.
+#
+# Rows are in time order, a period is found with a binary search on the time column.
+#
+# Fees are estimated with fee_rate on the quote quantity: order responses don't say what was paid.
+#
+# Strategies of a runner can trade different symbols on the same ledger: quantities and prices only add up within
+# a symbol, so summaries are of one symbol (see summary) or one per symbol (see summaries).
+#
+# Usage:
+#     python ledger.py ledger_directory [period]      prints the PnL summary of every symbol, e.g. period 7d, 24h,
+#                                                     month, all
+
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+COLUMNS = (('time', np.int64),            # ms, when the order or the fill was recorded
+           ('order_id', np.int64),
+           ('strategy', np.int32),        # index in strategies.json
+           ('symbol', np.int32),          # index in symbols.json, UNKNOWN_SYMBOL in ledgers older than the column
+           ('kind', np.int8),             # ORDER or FILL
+           ('side', np.int8),             # BUY or SELL
+           ('price', np.float64),
+           ('quantity', np.float64),      # base asset, executed quantity for fills
+           ('quote_quantity', np.float64),
+           ('fee', np.float64))           # quote asset, estimated
+
+# kind
+ORDER = 0
+FILL = 1
+# side
+BUY = 1
+SELL = -1
+UNKNOWN_SYMBOL = -1
+# Quote assets, to tell the base asset of a symbol
+QUOTE_ASSETS = ('USDT', 'BUSD', 'USDC', 'BTC', 'ETH', 'BNB')
+
+PERIODS = {'h': 3600 * 1000, 'd': 24 * 3600 * 1000, 'w': 7 * 24 * 3600 * 1000, 'm': 30 * 24 * 3600 * 1000}
+NAMED_PERIODS = {'day': '1d', 'today': '1d', 'week': '1w', 'month': '1m', 'year': '365d'}
+
+
+def parse_period(text):
+    # Length in ms of a period like 24h, 7d, 2w, 1m (30 days) or day, week, month, year. None means everything.
+    text = (text or 'all').lower()
+    if text == 'all':
+        return None
+    text = NAMED_PERIODS.get(text, text)
+    if len(text) < 2 or text[-1] not in PERIODS or not text[:-1].isdigit():
+        raise ValueError("Unknown period: " + text)
+    return int(text[:-1]) * PERIODS[text[-1]]
+
+
+class TradeLedger:
+    DEFAULT_FEE_RATE = 0.001
+
+    def __init__(self, path, fee_rate=DEFAULT_FEE_RATE):
+        self.path = path
+        self.fee_rate = fee_rate
+        self.lock = threading.Lock()
+        self.files = None
+        os.makedirs(path, exist_ok=True)
+
+        self.strategies_path = os.path.join(path, 'strategies.json')
+        self.strategies = self.load_names(self.strategies_path)
+        self.symbols_path = os.path.join(path, 'symbols.json')
+        self.symbols = self.load_names(self.symbols_path)
+        self.add_symbol_column()
+
+    def load_names(self, path):
+        if os.path.exists(path):
+            with open(path) as names_file:
+                return json.load(names_file)
+        return []
+
+    def add_symbol_column(self):
+        # Ledgers written before the symbol column get one, with the symbol unknown
+        symbol_path = self.column_path('symbol')
+        time_path = self.column_path('time')
+        if os.path.exists(time_path) and not os.path.exists(symbol_path):
+            rows = os.path.getsize(time_path) // np.dtype(np.int64).itemsize
+            with open(symbol_path, 'wb') as symbol_file:
+                symbol_file.write(np.full(rows, UNKNOWN_SYMBOL, dtype=np.int32).tobytes())
+
+    def column_path(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def open(self):
+        # Opens the columns for appending. A crash in the middle of an append can leave some columns one row
+        # longer than others: they're cut back to the shortest one.
+        rows = self.rows()
+        for name, dtype in COLUMNS:
+            path = self.column_path(name)
+            if os.path.exists(path) and os.path.getsize(path) != rows * np.dtype(dtype).itemsize:
+                with open(path, 'r+b') as column_file:
+                    column_file.truncate(rows * np.dtype(dtype).itemsize)
+        self.files = [open(self.column_path(name), 'ab') for name, _ in COLUMNS]
+
+    def close(self):
+        if self.files is not None:
+            for column_file in self.files:
+                column_file.close()
+            self.files = None
+
+    def rows(self):
+        counts = []
+        for name, dtype in COLUMNS:
+            path = self.column_path(name)
+            counts.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        return min(counts)
+
+    def name_index(self, names, path, name):
+        # Index of name in names, saved to path when it's new
+        if name not in names:
+            names.append(name)
+            temporary_path = path + '.tmp'
+            with open(temporary_path, 'w') as names_file:
+                json.dump(names, names_file)
+            os.replace(temporary_path, path)
+        return names.index(name)
+
+    def strategy_index(self, name):
+        return self.name_index(self.strategies, self.strategies_path, name)
+
+    def symbol_index(self, symbol):
+        if symbol is None:
+            return UNKNOWN_SYMBOL
+        return self.name_index(self.symbols, self.symbols_path, symbol)
+
+    # Writing
+
+    def append(self, strategy, kind, order, event_time=None):
+        # order is in get_order format, fills are recorded with their executed quantity
+        if kind == FILL:
+            quantity = float(order['executedQty'])
+            quote_quantity = float(order['cummulativeQuoteQty'])
+            price = quote_quantity / quantity if quantity else float(order['price'])
+        else:
+            quantity = float(order['origQty'])
+            price = float(order['price'])
+            quote_quantity = quantity * price
+        fee = quote_quantity * self.fee_rate if kind == FILL else 0.0
+        if event_time is None:
+            # When it's recorded rather than the exchange time: rows stay in order, periods are local time
+            event_time = int(time.time() * 1000)
+        with self.lock:
+            if self.files is None:
+                self.open()
+            values = (event_time, int(order['orderId']), self.strategy_index(strategy),
+                      self.symbol_index(order.get('symbol')), kind,
+                      BUY if order['side'] == 'BUY' else SELL, price, quantity, quote_quantity, fee)
+            for column_file, (name, dtype), value in zip(self.files, COLUMNS, values):
+                column_file.write(np.array(value, dtype=dtype).tobytes())
+            for column_file in self.files:
+                column_file.flush()
+
+    def record_order(self, strategy, order):
+        self.append(strategy, ORDER, order)
+
+    def record_fill(self, strategy, order):
+        self.append(strategy, FILL, order)
+
+    # Queries
+
+    def columns(self):
+        # Memory maps of all the columns, no data is read until it's used
+        rows = self.rows()
+        columns = {}
+        for name, dtype in COLUMNS:
+            if rows == 0:
+                columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                columns[name] = np.memmap(self.column_path(name), dtype=dtype, mode='r', shape=(rows,))
+        return columns
+
+    def summary(self, period=None, strategy=None, symbol=None, now=None):
+        # Aggregates the fills of the last period ms (None for everything), of one strategy or all of them, of one
+        # symbol or all of them (only meaningful if there's a single one, see summaries).
+        # Realized PnL is the one of the volume both bought and sold in the period, at the average prices:
+        # what's still held isn't counted.
+        columns = self.columns()
+        start = self.period_start(columns, period, now)
+        return self.aggregate(columns, start, self.fill_mask(columns, start, strategy, symbol))
+
+    def summaries(self, period=None, strategy=None, now=None):
+        # One summary per symbol traded in the period, {symbol: summary}, None for fills of unknown symbol
+        columns = self.columns()
+        start = self.period_start(columns, period, now)
+        mask = self.fill_mask(columns, start, strategy, None)
+        symbols = np.asarray(columns['symbol'][start:])
+        summaries = {}
+        for index in np.unique(symbols[mask]):
+            symbol = self.symbols[index] if index != UNKNOWN_SYMBOL else None
+            summaries[symbol] = self.aggregate(columns, start, mask & (symbols == index))
+        return summaries
+
+    def period_start(self, columns, period, now):
+        # First row of the last period ms, a binary search on the time column
+        if period is None:
+            return 0
+        if now is None:
+            now = int(time.time() * 1000)
+        return int(np.searchsorted(columns['time'], now - period, side='left'))
+
+    def fill_mask(self, columns, start, strategy, symbol):
+        mask = np.asarray(columns['kind'][start:]) == FILL
+        for name, names, value in (('strategy', self.strategies, strategy), ('symbol', self.symbols, symbol)):
+            if value is None:
+                continue
+            if value not in names:
+                mask[:] = False
+            else:
+                mask &= np.asarray(columns[name][start:]) == names.index(value)
+        return mask
+
+    def aggregate(self, columns, start, mask):
+        side = np.asarray(columns['side'][start:])
+        buys = mask & (side == BUY)
+        sells = mask & (side == SELL)
+        quantity = columns['quantity'][start:]
+        quote_quantity = columns['quote_quantity'][start:]
+
+        bought = float(quantity[buys].sum())
+        sold = float(quantity[sells].sum())
+        spent = float(quote_quantity[buys].sum())
+        received = float(quote_quantity[sells].sum())
+        fees = float(columns['fee'][start:][mask].sum())
+        average_buy = spent / bought if bought else 0.0
+        average_sell = received / sold if sold else 0.0
+        matched = min(bought, sold)
+        return {'fills': int(mask.sum()),
+                'buys': int(buys.sum()),
+                'sells': int(sells.sum()),
+                'bought': bought,
+                'sold': sold,
+                'spent': spent,
+                'received': received,
+                'average_buy': average_buy,
+                'average_sell': average_sell,
+                'fees': fees,
+                'realized_pnl': matched * (average_sell - average_buy) - fees,
+                'net_position': bought - sold}
+
+
+def split_symbol(symbol):
+    # Base and quote asset, e.g. ('LTC', 'USDT')
+    for quote_asset in QUOTE_ASSETS:
+        if symbol.endswith(quote_asset) and len(symbol) > len(quote_asset):
+            return symbol[:-len(quote_asset)], quote_asset
+    return symbol, '?'
+
+
+def format_summary(summary, base_asset='LTC', quote_asset='USDT'):
+    return '\n'.join(["Fills: " + str(summary['fills']) + " (" + str(summary['buys']) + " buys, "
+                      + str(summary['sells']) + " sells)",
+                      "Bought: " + "{:.5f}".format(summary['bought']) + " " + base_asset + " at avg "
+                      + "{:.4f}".format(summary['average_buy']),
+                      "Sold: " + "{:.5f}".format(summary['sold']) + " " + base_asset + " at avg "
+                      + "{:.4f}".format(summary['average_sell']),
+                      "Fees (estimated): " + "{:.4f}".format(summary['fees']) + " " + quote_asset,
+                      "Realized PnL: " + "{:+.4f}".format(summary['realized_pnl']) + " " + quote_asset,
+                      "Net position: " + "{:+.5f}".format(summary['net_position']) + " " + base_asset])
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python ledger.py ledger_directory [period]")
+        sys.exit(1)
+    ledger = TradeLedger(sys.argv[1])
+    period = parse_period(sys.argv[2] if len(sys.argv) > 2 else None)
+    start = time.perf_counter()
+    summaries = ledger.summaries(period)
+    elapsed = time.perf_counter() - start
+    if not summaries:
+        print("No fills")
+    for symbol, summary in sorted(summaries.items(), key=lambda item: item[0] or ''):
+        print((symbol or "Unknown symbol") + ":")
+        if symbol is None:
+            print(format_summary(summary, 'base asset', 'quote asset'))
+        else:
+            print(format_summary(summary, *split_symbol(symbol)))
+    print(str(ledger.rows()) + " rows in " + "{:.1f}".format(elapsed * 1000) + " ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# Market data
+#
+# Keeps the last trade price and the best bid/ask of every watched symbol in memory, fed by the Binance trade and
+# bookTicker streams. /current_price and order pricing read from here instead of calling get_symbol_ticker.
+#
+# Quotes are immutable tuples and a new one replaces the old one with a single dict assignment, so readers never
+# take a lock and never see half an update: reading a price costs a dict lookup.
+#
+# LocalMarketFeed is a stand-in for the real streams, quotes are pushed by hand or replayed from a price list
+# (tests, simulations, see SimulatedExchange.market_stream).
+
+import collections
+import time
+
+from binance.websockets import BinanceSocketManager
+
+
+# Prices are floats, time is time.monotonic() of the update
+Quote = collections.namedtuple('Quote', ['last', 'bid', 'ask', 'bid_qty', 'ask_qty', 'time'])
+
+
+class PriceCache:
+    # Quotes older than this are not trusted (stream down, very quiet market), callers fall back to REST
+    DEFAULT_MAX_AGE = 10.0
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self.quotes = {}        # symbol -> Quote
+        self.connected = False
+        # Called as listener(symbol, price) at every trade, on the stream thread, see volatility.py
+        self.trade_listeners = []
+
+        # Counters
+        self.updates = 0
+        self.hits = 0
+        self.misses = 0
+
+    # Stream side
+
+    def add_trade_listener(self, listener):
+        # A new list, the stream thread may be going through the old one
+        self.trade_listeners = self.trade_listeners + [listener]
+
+    def remove_trade_listener(self, listener):
+        self.trade_listeners = [other for other in self.trade_listeners if other != listener]
+
+    def on_connect(self):
+        self.connected = True
+
+    def on_disconnect(self):
+        self.connected = False
+
+    def on_message(self, message):
+        # Callback for raw stream messages, plain or wrapped in a combined stream
+        data = message.get('data', message)
+        event_type = data.get('e')
+        if event_type == 'trade':
+            self.on_trade(data['s'], float(data['p']))
+        elif event_type == 'error':
+            self.on_disconnect()
+        elif 'b' in data and 'a' in data and 's' in data:
+            # bookTicker messages have no event type
+            self.on_book_ticker(data['s'], float(data['b']), float(data['B']), float(data['a']), float(data['A']))
+
+    def on_trade(self, symbol, price):
+        quote = self.quotes.get(symbol)
+        if quote is None:
+            self.quotes[symbol] = Quote(price, None, None, None, None, time.monotonic())
+        else:
+            self.quotes[symbol] = quote._replace(last=price, time=time.monotonic())
+        self.updates += 1
+        for listener in self.trade_listeners:
+            listener(symbol, price)
+
+    def on_book_ticker(self, symbol, bid, bid_qty, ask, ask_qty):
+        quote = self.quotes.get(symbol)
+        last = quote.last if quote is not None else None
+        self.quotes[symbol] = Quote(last, bid, ask, bid_qty, ask_qty, time.monotonic())
+        self.updates += 1
+
+    # Readers
+
+    def get(self, symbol):
+        # Fresh quote of symbol, None if there isn't one
+        quote = self.quotes.get(symbol)
+        if quote is None or not self.connected or time.monotonic() - quote.time > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return quote
+
+    def price(self, symbol):
+        # Last trade price, or the middle of the book before the first trade
+        quote = self.get(symbol)
+        if quote is None:
+            return None
+        if quote.last is not None:
+            return quote.last
+        if quote.bid is not None:
+            return (quote.bid + quote.ask) / 2
+        return None
+
+
+class BinanceMarketStream:
+    # Feeds a PriceCache with the trade and bookTicker streams of some symbols, on a single connection
+
+    def __init__(self, client, cache, symbols):
+        self.client = client
+        self.cache = cache
+        self.symbols = symbols
+        self.socket_manager = None
+
+    def start(self):
+        streams = []
+        for symbol in self.symbols:
+            streams.append(symbol.lower() + '@trade')
+            streams.append(symbol.lower() + '@bookTicker')
+        self.socket_manager = BinanceSocketManager(self.client)
+        conn_key = self.socket_manager.start_multiplex_socket(streams, self.cache.on_message)
+        if not conn_key:
+            raise RuntimeError("Couldn't open the market data stream")
+        self.socket_manager.start()
+        self.cache.on_connect()
+
+    def stop(self):
+        if self.socket_manager is not None:
+            self.socket_manager.close()
+            self.socket_manager = None
+        self.cache.on_disconnect()
+
+
+class LocalMarketFeed:
+    # Stand-in for BinanceMarketStream: quotes are pushed by hand, synchronously
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def start(self):
+        self.cache.on_connect()
+
+    def stop(self):
+        self.cache.on_disconnect()
+
+    def push(self, symbol, price, spread=0.0):
+        # A trade at price, with the book around it
+        self.cache.on_trade(symbol, price)
+        self.cache.on_book_ticker(symbol, price - spread / 2, 0.0, price + spread / 2, 0.0)
+
+    def replay(self, symbol, prices, spread=0.0):
+        # Pushes a whole price list, e.g. a PriceFeed or backtest close prices
+        for price in prices:
+            self.push(symbol, float(price), spread)
@@ -0,0 +1,308 @@
+# Performance metrics
+#
+# Latency histograms and counters for the hot paths of the bot: exchange calls, Telegram sends, ticks of the
+# main loop, fill detection lag and exceptions swallowed by the state functions. Recording a value is a bisect
+# and two increments, so it can stay on in production.
+#
+# Metrics are exposed in the Prometheus text format by MetricsServer (localhost only) and summarized by the /perf
+# Telegram command, see Metrics.summary.
+#
+#   exchange_call_seconds{method}         round trip of every exchange call, see InstrumentedExchange
+#   exchange_call_errors_total{method}
+#   exchange_http_seconds{endpoint}       HTTP round trip of every request, see http_pool.py
+#   exchange_http_connections_total       connections opened to the exchange
+#   exchange_timestamp_retries_total      signed calls sent again after a -1021, see time_sync.py
+#   exchange_clock_offset_ms              exchange clock - local clock
+#   telegram_send_seconds                 see engine.Notifier
+#   telegram_send_retries_total           flood limits and network errors retried
+#   telegram_messages_merged_total        messages sent as part of a bigger one
+#   tick_seconds                          one iteration of the main loop
+#   fill_detection_lag_seconds            from the fill on the exchange (order updateTime) to the state change
+#   cancel_replace_seconds                re-pricing of an open order, end to end, see GridStrategy.replace_order
+#   swallowed_exceptions_total{function}  exceptions logged and ignored by the state functions
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from exchange import Exchange
+from structured_log import get_logger
+
+
+logger = get_logger('metrics')
+
+
+# Upper bounds in seconds, from half a millisecond to half a minute
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One more for values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def percentile(self, percent):
+        # Upper bound of the bucket the percentile falls in, None without values
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+        if count == 0:
+            return None
+        rank = count * percent / 100.0
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(name + '="' + str(value) + '"' for name, value in labels) + '}'
+
+
+class Metrics:
+
+    def __init__(self):
+        self.histograms = {}        # (name, labels) -> Histogram, labels is a tuple of (name, value)
+        self.counters = {}          # (name, labels) -> number
+        self.descriptions = {}
+        # Functions returning a list of (name, labels dict, value), for values owned by other objects (cache hits,
+        # used request weight...)
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+    def histogram(self, name, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, value, labels=None):
+        self.histogram(name, labels).observe(value)
+
+    def increment(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def collect(self):
+        samples = []
+        for collector in self.collectors:
+            try:
+                samples.extend(collector())
+            except Exception:
+                # A broken collector mustn't take the endpoint down
+                pass
+        return samples
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        typed = set()
+
+        def header(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                if name in self.descriptions:
+                    lines.append('# HELP ' + name + ' ' + self.descriptions[name])
+                lines.append('# TYPE ' + name + ' ' + metric_type)
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            header(name, 'histogram')
+            with histogram.lock:
+                counts = list(histogram.counts)
+                count = histogram.count
+                total = histogram.sum
+            cumulative = 0
+            for bucket, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(name + '_bucket' + format_labels(labels + (('le', bucket),)) + ' ' + str(cumulative))
+            lines.append(name + '_bucket' + format_labels(labels + (('le', '+Inf'),)) + ' ' + str(count))
+            lines.append(name + '_sum' + format_labels(labels) + ' ' + repr(total))
+            lines.append(name + '_count' + format_labels(labels) + ' ' + str(count))
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(name + format_labels(labels) + ' ' + str(value))
+
+        for name, labels, value in self.collect():
+            header(name, 'gauge')
+            lines.append(name + format_labels(tuple(sorted(labels.items()))) + ' ' + str(value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        # Short human readable version, for /perf
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if not histogram.count:
+                continue
+            title = name + ''.join(' ' + str(value) for _, value in labels)
+            lines.append(title + ": count " + str(histogram.count) + ", avg " + format_seconds(histogram.mean())
+                         + ", p50 " + format_seconds(histogram.percentile(50))
+                         + ", p99 " + format_seconds(histogram.percentile(99)))
+        with self.lock:
+            counters = sorted(self.counters.items())
+        for (name, labels), value in counters:
+            lines.append(name + ''.join(' ' + str(label) for _, label in labels) + ": " + str(value))
+        for name, labels, value in self.collect():
+            lines.append(name + ''.join(' ' + str(label) for label in labels.values()) + ": " + str(value))
+        return '\n'.join(lines) if lines else "No metrics yet"
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    if seconds == float('inf'):
+        return "inf"
+    if seconds < 1:
+        return "{:.1f}ms".format(seconds * 1000)
+    return "{:.2f}s".format(seconds)
+
+
+class InstrumentedExchange(Exchange):
+    # Measures the round trip of every call to the wrapped exchange. Goes right around the real adapter, so that
+    # time spent waiting for rate limits (see scheduler.py) isn't counted.
+
+    def __init__(self, exchange, metrics):
+        self.exchange = exchange
+        self.blocking = exchange.blocking
+        self.metrics = metrics
+        metrics.describe('exchange_call_seconds', "Round trip of exchange calls")
+        metrics.describe('exchange_call_errors_total', "Exchange calls that raised an exception")
+
+    def timed(self, method, **kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(self.exchange, method)(**kwargs)
+        except Exception:
+            self.metrics.increment('exchange_call_errors_total', {'method': method})
+            raise
+        finally:
+            self.metrics.observe('exchange_call_seconds', time.perf_counter() - start, {'method': method})
+
+    def get_account(self):
+        return self.timed('get_account')
+
+    def get_asset_balance(self, asset):
+        return self.timed('get_asset_balance', asset=asset)
+
+    def get_symbol_ticker(self, symbol):
+        return self.timed('get_symbol_ticker', symbol=symbol)
+
+    def get_order(self, symbol, orderId):
+        return self.timed('get_order', symbol=symbol, orderId=orderId)
+
+    def get_open_orders(self):
+        return self.timed('get_open_orders')
+
+    def get_symbol_info(self, symbol):
+        return self.timed('get_symbol_info', symbol=symbol)
+
+    def order_limit_buy(self, symbol, quantity, price):
+        return self.timed('order_limit_buy', symbol=symbol, quantity=quantity, price=price)
+
+    def order_limit_sell(self, symbol, quantity, price):
+        return self.timed('order_limit_sell', symbol=symbol, quantity=quantity, price=price)
+
+    def cancel_order(self, symbol, orderId):
+        return self.timed('cancel_order', symbol=symbol, orderId=orderId)
+
+    def cancel_replace_order(self, symbol, orderId, side, quantity, price):
+        return self.timed('cancel_replace_order', symbol=symbol, orderId=orderId, side=side, quantity=quantity,
+                          price=price)
+
+    def order_stream(self, tracker):
+        return self.exchange.order_stream(tracker)
+
+    def used_weight(self):
+        return self.exchange.used_weight()
+
+    def keep_alive(self):
+        # Not timed, most calls send nothing. Pings are measured by the HTTP pool.
+        return self.exchange.keep_alive()
+
+    def market_stream(self, cache, symbols):
+        return self.exchange.market_stream(cache, symbols)
+
+    def time(self):
+        return self.exchange.time()
+
+
+class MetricsServer:
+    # Serves /metrics in Prometheus text format, on localhost only
+
+    DEFAULT_PORT = 9108
+
+    debug = True
+
+    def __init__(self, metrics, port=DEFAULT_PORT, host='127.0.0.1'):
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+        self.server = None
+
+    def log(self, message, *args, **fields):
+        # See structured_log.py
+        if self.debug:
+            logger.info(message, *args, extra={'fields': fields})
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # No access log on stdout
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        thread.start()
+        self.log("Metrics served on http://%s:%s/metrics", self.host, self.port)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,155 @@
+# Parameter sweep of sell increment and buy decrement
+#
+# Backtests every (sell_increment, buy_decrement) pair of a grid against historical prices (see backtest.py)
+# and ranks them by PnL. Pairs are spread on a process pool; the price arrays are copied once into shared
+# memory and every worker maps them, so the dataset isn't copied (or pickled) for each worker.
+#
+# Usage:
+#     python optimize.py prices.csv [--sell 0.1:5:0.1] [--buy 0.1:5:0.1] [--workers N] [--top 20]
+#                                   [--heatmap heatmap.npy]
+#
+# Ranges are start:stop:step, both ends included. The heatmap is a NumPy array of PnL with one row per sell
+# increment and one column per buy decrement.
+
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtest import Prices, load_prices, run_backtest
+
+
+DEFAULT_RANGE = '0.1:5:0.1'
+PRICE_ARRAYS = ('time', 'low', 'high', 'close')
+
+# Set in every worker by attach_prices
+worker_prices = None
+worker_blocks = []
+
+
+def parse_range(text):
+    start, stop, step = (float(value) for value in text.split(':'))
+    # Half a step more so that stop is included, then rounding to hide float noise
+    return np.round(np.arange(start, stop + step / 2, step), 8)
+
+
+def share_prices(prices):
+    # Copies the price arrays into shared memory blocks, returns the blocks and what workers need to map them
+    blocks = []
+    layout = []
+    for name in PRICE_ARRAYS:
+        array = getattr(prices, name)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        layout.append((block.name, array.shape, array.dtype.str))
+    return blocks, layout
+
+
+def attach_prices(layout):
+    # Process pool initializer
+    global worker_prices
+    arrays = []
+    for name, shape, dtype in layout:
+        block = shared_memory.SharedMemory(name=name)
+        # Keeps a reference, the arrays are only valid while the block is open
+        worker_blocks.append(block)
+        arrays.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf))
+    worker_prices = Prices(*arrays)
+
+
+def evaluate(pairs, initial_usdt, fee):
+    rows = []
+    for sell_increment, buy_decrement in pairs:
+        result = run_backtest(worker_prices, sell_increment, buy_decrement, initial_usdt, fee)
+        rows.append((sell_increment, buy_decrement, result.pnl, result.trades, result.time_in_position_percent))
+    return rows
+
+
+class SweepResult:
+
+    def __init__(self, sell_increments, buy_decrements, rows):
+        self.sell_increments = sell_increments
+        self.buy_decrements = buy_decrements
+        # Best first
+        self.rows = sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def heatmap(self):
+        # PnL with one row per sell increment and one column per buy decrement
+        heatmap = np.full((len(self.sell_increments), len(self.buy_decrements)), np.nan)
+        sell_index = {value: i for i, value in enumerate(self.sell_increments)}
+        buy_index = {value: i for i, value in enumerate(self.buy_decrements)}
+        for sell_increment, buy_decrement, pnl, trades, time_in_position in self.rows:
+            heatmap[sell_index[sell_increment], buy_index[buy_decrement]] = pnl
+        return heatmap
+
+    def best(self):
+        return self.rows[0] if self.rows else None
+
+    def table(self, top=20):
+        lines = ["rank  sell_inc  buy_dec         pnl  trades  in_position"]
+        for rank, row in enumerate(self.rows[:top], 1):
+            lines.append("{:>4}  {:>8}  {:>7}  {:>+10.2f}  {:>6}  {:>10.1f}%".format(rank, *row))
+        return '\n'.join(lines)
+
+
+def sweep(prices, sell_increments, buy_decrements, workers=None, initial_usdt=1000.0, fee=0.001):
+    workers = workers or os.cpu_count() or 1
+    pairs = [(float(sell), float(buy)) for sell in sell_increments for buy in buy_decrements]
+
+    # A few chunks per worker, so that slow chunks (small increments, many fills) are balanced
+    chunk_size = max(1, len(pairs) // (workers * 4))
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+
+    blocks, layout = share_prices(prices)
+    try:
+        # spawn instead of fork: the bot calls this from a thread, while other threads (Telegram, websockets)
+        # are running, and forking a multi-threaded process isn't safe
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=attach_prices, initargs=(layout,)) as executor:
+            futures = [executor.submit(evaluate, chunk, initial_usdt, fee) for chunk in chunks]
+            rows = [row for future in futures for row in future.result()]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return SweepResult([float(value) for value in sell_increments],
+                       [float(value) for value in buy_decrements],
+                       rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep sell increment and buy decrement on historical prices")
+    parser.add_argument('prices', help="CSV or Parquet file, or kline store directory, with historical prices")
+    parser.add_argument('--sell', default=DEFAULT_RANGE, help="Sell increments as start:stop:step")
+    parser.add_argument('--buy', default=DEFAULT_RANGE, help="Buy decrements as start:stop:step")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes, all cores by default")
+    parser.add_argument('--usdt', type=float, default=1000.0, help="Initial USDT balance")
+    parser.add_argument('--fee', type=float, default=0.001, help="Trading fee, 0.001 is 0.1%%")
+    parser.add_argument('--top', type=int, default=20, help="Rows of the ranked table to print")
+    parser.add_argument('--heatmap', default=None, help="Saves the PnL heatmap to this .npy file")
+    args = parser.parse_args()
+
+    prices = load_prices(args.prices)
+    sell_increments = parse_range(args.sell)
+    buy_decrements = parse_range(args.buy)
+
+    start = time.perf_counter()
+    result = sweep(prices, sell_increments, buy_decrements, args.workers, args.usdt, args.fee)
+    elapsed = time.perf_counter() - start
+
+    print(result.table(args.top))
+    print(str(len(result.rows)) + " pairs in " + "{:.2f}".format(elapsed) + " s")
+    if args.heatmap:
+        np.save(args.heatmap, result.heatmap())
+        print("Heatmap saved to " + args.heatmap)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Order builder
+#
+# Binance rejects orders that don't follow the trading rules of the symbol (exchangeInfo filters):
+#   PRICE_FILTER               price between minPrice and maxPrice, a multiple of tickSize
+#   LOT_SIZE                   quantity between minQty and maxQty, a multiple of stepSize
+#   MIN_NOTIONAL / NOTIONAL    price * quantity at least minNotional
+# Prices and quantities are rounded here with Decimal, exactly, and checked before they're sent: an order that
+# would be rejected raises InvalidOrder and costs no request.
+#
+# Rounding is always in favour of the account: quantities are rounded down (never more than the balance), buy
+# prices down and sell prices up.
+#
+# The filters of a symbol are loaded once and kept for refresh_interval seconds, see GridStrategy.symbol_filters.
+
+import threading
+import time
+from decimal import Decimal, ROUND_DOWN, ROUND_UP
+
+
+class InvalidOrder(Exception):
+    # The order breaks a trading rule of the symbol, it hasn't been sent
+
+    def __init__(self, filter_type, message):
+        Exception.__init__(self, message)
+        self.filter_type = filter_type
+
+
+def to_decimal(value):
+    # Floats are cut to the 15 significant digits they can hold: 60 + 0.3 is 60.3 and not 60.300000000000004,
+    # which would become 60.31 when rounded up
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        return Decimal(format(value, '.15g'))
+    return Decimal(value)
+
+
+def format_decimal(value):
+    return '{:f}'.format(value)
+
+
+class SymbolFilters:
+
+    def __init__(self, symbol_info):
+        self.symbol = symbol_info['symbol']
+        self.tick_size = None
+        self.min_price = Decimal(0)
+        self.max_price = Decimal(0)         # 0 means no limit
+        self.step_size = None
+        self.min_quantity = Decimal(0)
+        self.max_quantity = Decimal(0)
+        self.min_notional = Decimal(0)
+        for symbol_filter in symbol_info['filters']:
+            filter_type = symbol_filter['filterType']
+            if filter_type == 'PRICE_FILTER':
+                self.tick_size = Decimal(symbol_filter['tickSize']).normalize()
+                self.min_price = Decimal(symbol_filter['minPrice'])
+                self.max_price = Decimal(symbol_filter['maxPrice'])
+            elif filter_type == 'LOT_SIZE':
+                self.step_size = Decimal(symbol_filter['stepSize']).normalize()
+                self.min_quantity = Decimal(symbol_filter['minQty'])
+                self.max_quantity = Decimal(symbol_filter['maxQty'])
+            elif filter_type in ('MIN_NOTIONAL', 'NOTIONAL'):
+                self.min_notional = Decimal(symbol_filter['minNotional'])
+
+    def round_price(self, price, side):
+        price = to_decimal(price)
+        if not self.tick_size:
+            return price
+        rounding = ROUND_DOWN if side == 'BUY' else ROUND_UP
+        return (price / self.tick_size).to_integral_value(rounding) * self.tick_size
+
+    def round_quantity(self, quantity):
+        quantity = to_decimal(quantity)
+        if not self.step_size:
+            return quantity
+        return (quantity / self.step_size).to_integral_value(ROUND_DOWN) * self.step_size
+
+    def check(self, quantity, price):
+        if price < self.min_price or (self.max_price and price > self.max_price):
+            raise InvalidOrder('PRICE_FILTER', "Price " + format_decimal(price) + " is out of the allowed range ("
+                               + format_decimal(self.min_price) + " - " + format_decimal(self.max_price) + ")")
+        if quantity <= 0 or quantity < self.min_quantity or (self.max_quantity and quantity > self.max_quantity):
+            raise InvalidOrder('LOT_SIZE', "Quantity " + format_decimal(quantity) + " is out of the allowed range ("
+                               + format_decimal(self.min_quantity) + " - " + format_decimal(self.max_quantity) + ")")
+        if quantity * price < self.min_notional:
+            raise InvalidOrder('MIN_NOTIONAL', "Order value " + format_decimal(quantity * price)
+                               + " is below the minimum of " + format_decimal(self.min_notional))
+
+    def validate(self, quantity, price):
+        # Checks an order as it is, like Binance does
+        quantity = to_decimal(quantity)
+        price = to_decimal(price)
+        if self.tick_size and price % self.tick_size:
+            raise InvalidOrder('PRICE_FILTER', "Price " + format_decimal(price) + " isn't a multiple of "
+                               + format_decimal(self.tick_size))
+        if self.step_size and quantity % self.step_size:
+            raise InvalidOrder('LOT_SIZE', "Quantity " + format_decimal(quantity) + " isn't a multiple of "
+                               + format_decimal(self.step_size))
+        self.check(quantity, price)
+
+    def build(self, side, quantity, price):
+        # Rounded and checked quantity and price, as strings ready to be sent
+        price = self.round_price(price, side)
+        quantity = self.round_quantity(quantity)
+        self.check(quantity, price)
+        return format_decimal(quantity), format_decimal(price)
+
+
+class OrderBuilder:
+    # Filters of the symbols traded, shared by the strategies of a runner
+    DEFAULT_REFRESH_INTERVAL = 3600.0
+
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.symbols = {}           # symbol -> (SymbolFilters, time.monotonic() of the load)
+        self.lock = threading.Lock()
+        self.loads = 0
+
+    def get(self, symbol, fresh=True):
+        # Filters of symbol, None if they have never been loaded or (fresh) they're due for a refresh
+        with self.lock:
+            entry = self.symbols.get(symbol)
+        if entry is None:
+            return None
+        filters, loaded = entry
+        if fresh and time.monotonic() - loaded > self.refresh_interval:
+            return None
+        return filters
+
+    def store(self, symbol, symbol_info):
+        if symbol_info is None:
+            raise ValueError("Unknown symbol: " + symbol)
+        filters = SymbolFilters(symbol_info)
+        with self.lock:
+            self.symbols[symbol] = (filters, time.monotonic())
+            self.loads += 1
+        return filters
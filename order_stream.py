@@ -0,0 +1,255 @@
+# Order update subsystem
+#
+# Keeps an in-memory copy of the bot's orders, fed by the execution reports of the Binance user data stream.
+# The main loop reads orders from here instead of calling get_order every second, and it's woken up as soon
+# as a fill event arrives. When the stream is down, or an order hasn't been confirmed by anyone for a while,
+# the tracker falls back to a plain get_order REST call.
+#
+# LocalOrderFeed is a stand-in for the real stream, it feeds the tracker by hand (tests, simulations).
+
+import threading
+import time
+
+from binance.websockets import BinanceSocketManager
+
+
+# Statuses of orders that won't change anymore
+FINAL_STATUSES = ('FILLED', 'CANCELED', 'REJECTED', 'EXPIRED')
+
+
+def execution_report_to_order(event):
+    # Converts an executionReport event to the same format returned by get_order, so that the rest of the bot
+    # (e.g. order_info_to_str) doesn't need to know where the order comes from
+    return {'symbol': event['s'],
+            'orderId': event['i'],
+            'clientOrderId': event['c'],
+            'price': event['p'],
+            'origQty': event['q'],
+            'executedQty': event['z'],
+            'cummulativeQuoteQty': event['Z'],
+            'status': event['X'],
+            'timeInForce': event['f'],
+            'type': event['o'],
+            'side': event['S'],
+            'updateTime': event['T']}
+
+
+def order_time(order):
+    # Time of the last change, REST order responses call it transactTime
+    return order.get('updateTime', order.get('transactTime'))
+
+
+def is_older(order, previous):
+    # Copies of an order arrive out of order: the response to the order placement often comes after the stream
+    # event of its fill. A final status is newer than any other, then the copy with more executed, then the one
+    # with the later time.
+    if (order['status'] in FINAL_STATUSES) != (previous['status'] in FINAL_STATUSES):
+        return previous['status'] in FINAL_STATUSES
+    executed, previous_executed = float(order['executedQty']), float(previous['executedQty'])
+    if executed != previous_executed:
+        return executed < previous_executed
+    update_time, previous_time = order_time(order), order_time(previous)
+    return update_time is not None and previous_time is not None and update_time < previous_time
+
+
+def order_to_execution_report(order, status=None, event_time=None):
+    # Opposite of execution_report_to_order, used by LocalOrderFeed to fake stream events
+    status = status or order['status']
+    if event_time is None:
+        event_time = int(time.time() * 1000)
+    executed_qty = order['origQty'] if status == 'FILLED' else order.get('executedQty', '0.00000000')
+    return {'e': 'executionReport',
+            'E': event_time,
+            'T': event_time,
+            's': order['symbol'],
+            'c': order.get('clientOrderId', ''),
+            'S': order['side'],
+            'o': order.get('type', 'LIMIT'),
+            'f': order.get('timeInForce', 'GTC'),
+            'q': order['origQty'],
+            'p': order['price'],
+            'X': status,
+            'i': order['orderId'],
+            'z': executed_qty,
+            'Z': order.get('cummulativeQuoteQty', '0.00000000')}
+
+
+class OrderTracker:
+    # While the stream is up, an order copy is trusted for this many seconds after the last confirmation (stream
+    # event or REST call), after that it's polled again. It's a safety net against lost events: one REST call
+    # per minute per open order, instead of one per second.
+    DEFAULT_STALE_AFTER = 60.0
+    # While the stream is down, only copies confirmed in the last fraction of second are trusted (e.g. a
+    # batch of open orders fetched at the beginning of the tick, see sync_open_orders)
+    DEFAULT_POLL_INTERVAL = 0.5
+
+    def __init__(self, stale_after=DEFAULT_STALE_AFTER, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.connected = False
+        self.orders = {}            # orderId -> order, in get_order format
+        self.confirmed_at = {}      # orderId -> time.monotonic() of last confirmation
+        self.lock = threading.Lock()
+        # Called with no arguments on every order update, from whatever thread the update comes from
+        self.listeners = []
+        # Called with the order whenever a newer copy is stored, from whatever thread it comes from
+        self.order_listeners = []
+        # Called with every raw stream event (e.g. balance updates for the account cache)
+        self.event_listeners = []
+
+        # Counters, useful to see how many REST calls the stream is saving
+        self.stream_hits = 0
+        self.polls = 0
+
+    # Stream side
+
+    def on_connect(self):
+        self.connected = True
+
+    def on_disconnect(self):
+        self.connected = False
+        # Wakes up the main loop, that will go back to polling
+        self.wake_up()
+
+    def on_event(self, event):
+        # Callback for raw user data stream messages
+        for listener in self.event_listeners:
+            listener(event)
+        event_type = event.get('e')
+        if event_type == 'executionReport':
+            self.update(execution_report_to_order(event))
+            self.wake_up()
+        elif event_type == 'error':
+            self.on_disconnect()
+
+    def update(self, order):
+        # Stores a fresh copy of an order, either from the stream or from a REST response (get_order,
+        # order_limit_buy...). An older copy than the one kept only confirms it, see is_older.
+        order_id = int(order['orderId'])
+        with self.lock:
+            previous = self.orders.get(order_id)
+            stored = previous is None or not is_older(order, previous)
+            if stored:
+                self.orders[order_id] = order
+            self.confirmed_at[order_id] = time.monotonic()
+        if stored:
+            for listener in self.order_listeners:
+                listener(order)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def add_order_listener(self, listener):
+        self.order_listeners.append(listener)
+
+    def add_event_listener(self, listener):
+        self.event_listeners.append(listener)
+
+    def wake_up(self):
+        for listener in self.listeners:
+            listener()
+
+    def forget(self, order_id):
+        with self.lock:
+            self.orders.pop(int(order_id), None)
+            self.confirmed_at.pop(int(order_id), None)
+
+    # Main loop side
+
+    def is_stale(self, order_id):
+        confirmed_at = self.confirmed_at.get(int(order_id))
+        if confirmed_at is None:
+            return True
+        # Orders that are done can't change anymore
+        if self.orders[int(order_id)]['status'] in FINAL_STATUSES:
+            return False
+        max_age = self.stale_after if self.connected else self.poll_interval
+        return time.monotonic() - confirmed_at > max_age
+
+    def sync_open_orders(self, client, order_ids):
+        # Confirms many orders with a single open orders call. Orders that aren't open anymore (filled,
+        # canceled...) are the only ones fetched one by one.
+        open_ids = set()
+        for order in client.get_open_orders():
+            open_ids.add(int(order['orderId']))
+            self.update(order)
+        for order_id in order_ids:
+            order_id = int(order_id)
+            if order_id not in open_ids:
+                with self.lock:
+                    order = self.orders.get(order_id)
+                if order is not None:
+                    self.polls += 1
+                    self.update(client.get_order(symbol=order['symbol'], orderId=str(order_id)))
+
+    def last_known(self, order_id):
+        # The last copy of the order however old, None if it's never been seen
+        with self.lock:
+            return self.orders.get(int(order_id))
+
+    def get_cached(self, order_id):
+        # Returns the order from memory if the copy is recent enough (see is_stale), None otherwise
+        order_id = int(order_id)
+        if self.is_stale(order_id):
+            return None
+        with self.lock:
+            order = self.orders.get(order_id)
+        if order is not None:
+            self.stream_hits += 1
+        return order
+
+    def get_order(self, client, symbol, order_id):
+        # Like get_cached, but asks Binance when the copy isn't good
+        order = self.get_cached(order_id)
+        if order is None:
+            self.polls += 1
+            order = client.get_order(symbol=symbol, orderId=str(order_id))
+            self.update(order)
+        return order
+
+
+class BinanceOrderStream:
+    # Feeds an OrderTracker with the Binance user data stream
+
+    def __init__(self, client, tracker):
+        self.client = client
+        self.tracker = tracker
+        self.socket_manager = None
+        self.conn_key = None
+
+    def start(self):
+        self.socket_manager = BinanceSocketManager(self.client)
+        self.conn_key = self.socket_manager.start_user_socket(self.tracker.on_event)
+        if not self.conn_key:
+            raise RuntimeError("Couldn't open the user data stream")
+        self.socket_manager.start()
+        self.tracker.on_connect()
+
+    def stop(self):
+        if self.socket_manager is not None:
+            self.socket_manager.close()
+            self.socket_manager = None
+            self.conn_key = None
+        self.tracker.on_disconnect()
+
+
+class LocalOrderFeed:
+    # Stand-in for BinanceOrderStream: events are pushed by hand, synchronously
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def start(self):
+        self.tracker.on_connect()
+
+    def stop(self):
+        self.tracker.on_disconnect()
+
+    def push(self, event):
+        self.tracker.on_event(event)
+
+    def fill(self, order):
+        self.push(order_to_execution_report(order, status='FILLED'))
+
+    def cancel(self, order):
+        self.push(order_to_execution_report(order, status='CANCELED'))
@@ -0,0 +1,398 @@
+# Paper trading
+#
+# Runs the real strategies (TraderBot, GridRunner) on live or recorded prices without sending any order: orders go
+# to a local fill simulator, balances are virtual. New settings can run for days before they touch real money, and
+# many of them side by side, to compare them on the same prices.
+#
+#   PaperMarket     the simulated side of the exchange, shared by all the paper accounts of the process: last trade
+#                   price of every symbol, resting orders of every account in two heaps per symbol (buys by highest
+#                   price, sells by lowest) and order IDs, unique across accounts so that all of them can share an
+#                   order tracker. A trade fills the orders it crosses by popping them from the heaps: a trade that
+#                   fills nothing costs two comparisons, however many bots are running. Public data (trading rules,
+#                   ticker, the market data stream) comes from source, a real exchange (no API keys needed), or from
+#                   recorded prices, see replay.
+#   PaperAccount    a virtual account on the market, see PaperMarket.account: locking, fills and fees work like in
+#                   SimulatedExchange, get_asset_balance returns the virtual balances. Order and balance events are
+#                   pushed to the order trackers like the user data stream does.
+#
+# A resting order is filled at its price when the market trades at it, or margin beyond it for a pessimistic run
+# (orders at the back of the queue). Orders that are marketable when placed are filled at the last trade price.
+#
+# Usage:
+#     TraderBot: paper = true in the settings file (see config.py), no API keys needed
+#     Many bots, one account each, sell increment:buy decrement (:levels for a ladder):
+#         python paper.py LTCUSDT 1.0:1.0 2.0:2.0 1.0:2.0:5 [--usdt 1000] [--margin 0.0]
+#         python paper.py LTCUSDT 1.0:1.0 2.0:2.0 --prices klines/LTCUSDT-1m [--adaptive]
+#     On live prices a report is printed every --report-interval seconds, on recorded prices (see
+#     backtest.load_prices) the bots go as fast as they can and the report is printed at the end.
+
+import argparse
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+from exchange import DEFAULT_SYMBOL_FILTERS, Exchange, SimulatedExchange, SimulatedExchangeError
+from market_data import LocalMarketFeed
+from order_stream import LocalOrderFeed
+from structured_log import get_logger
+
+
+logger = get_logger('paper')
+
+
+class PaperMarket(Exchange):
+    # Exchange interface of the whole market, for GridRunner: open orders and orders of every account, public
+    # data, streams. Orders are placed through the accounts.
+
+    def __init__(self, source=None, fee=0.001, margin=0.0):
+        self.source = source
+        # Only public data is asked to the source, rarely
+        self.blocking = source is not None
+        self.fee = fee
+        self.margin = margin
+        # Matching runs on the market data stream thread, calls on the engine loop
+        self.lock = threading.RLock()
+        self.prices = {}            # symbol -> last trade price
+        self.books = {}             # symbol -> (buys, sells), heaps of (-price or price, orderId)
+        self.resting = {}           # orderId -> account, open orders only
+        self.owners = {}            # orderId -> account
+        self.order_ids = itertools.count(1)
+        self.symbol_infos = {}
+        self.feeds = []             # LocalOrderFeed of every order tracker
+        self.caches = []            # PriceCache of every market stream
+        # Time of the last recorded trade, ms. None on live prices: the local clock.
+        self.clock = None
+
+        # Counters
+        self.trades = 0
+        self.fills = 0
+
+    def account(self, balances=None):
+        return PaperAccount(self, balances)
+
+    # Exchange interface
+
+    def get_symbol_ticker(self, symbol):
+        return {'symbol': symbol, 'price': "{:.8f}".format(self.price(symbol))}
+
+    def get_order(self, symbol, orderId):
+        account = self.owners.get(int(orderId))
+        if account is None:
+            raise SimulatedExchangeError(-2013, 'Order does not exist.')
+        return account.get_order(symbol, orderId)
+
+    def get_open_orders(self):
+        with self.lock:
+            return [account.public(account.orders[order_id]) for order_id, account in self.resting.items()]
+
+    def get_symbol_info(self, symbol):
+        # Trading rules don't change often, they're asked to the source once
+        symbol_info = self.symbol_infos.get(symbol)
+        if symbol_info is None:
+            if self.source is not None:
+                symbol_info = self.source.get_symbol_info(symbol)
+            else:
+                # Like SimulatedExchange, only USDT markets without a source
+                if not symbol.endswith('USDT'):
+                    raise SimulatedExchangeError(-1121, 'Invalid symbol.')
+                symbol_info = {'symbol': symbol, 'status': 'TRADING', 'baseAsset': symbol[:-4],
+                               'quoteAsset': 'USDT', 'filters': DEFAULT_SYMBOL_FILTERS}
+            self.symbol_infos[symbol] = symbol_info
+        return symbol_info
+
+    def order_stream(self, tracker):
+        feed = LocalOrderFeed(tracker)
+        self.feeds.append(feed)
+        return feed
+
+    def market_stream(self, cache, symbols):
+        # Trades reaching cache are matched against the resting orders
+        if cache not in self.caches:
+            self.caches.append(cache)
+            cache.add_trade_listener(self.on_trade)
+        if self.source is not None:
+            return self.source.market_stream(cache, symbols)
+        return LocalMarketFeed(cache)
+
+    def keep_alive(self):
+        if self.source is not None:
+            return self.source.keep_alive()
+        return False
+
+    def time(self):
+        if self.clock is None:
+            return int(time.time() * 1000)
+        return self.clock
+
+    # Simulation
+
+    def price(self, symbol):
+        price = self.prices.get(symbol)
+        if price is None:
+            if self.source is None:
+                raise SimulatedExchangeError(-1121, 'No price yet for ' + symbol + '.')
+            price = float(self.source.get_symbol_ticker(symbol)['price'])
+            self.prices.setdefault(symbol, price)
+        return price
+
+    def on_trade(self, symbol, price):
+        # PriceCache trade listener: fills the resting orders the trade crosses
+        with self.lock:
+            self.trades += 1
+            self.prices[symbol] = price
+            book = self.books.get(symbol)
+            if book is None:
+                return
+            buys, sells = book
+            while buys and -buys[0][0] - self.margin >= price:
+                self.fill(heapq.heappop(buys)[1])
+            while sells and sells[0][0] + self.margin <= price:
+                self.fill(heapq.heappop(sells)[1])
+
+    def replay(self, symbol, price, clock=None):
+        # A recorded trade, through the market streams like a live one
+        self.clock = clock
+        if not self.caches:
+            self.on_trade(symbol, price)
+        for cache in self.caches:
+            cache.on_trade(symbol, price)
+            cache.on_book_ticker(symbol, price, 0.0, price, 0.0)
+
+    def rest(self, account, order):
+        # Called with the lock held
+        self.resting[order['orderId']] = account
+        buys, sells = self.books.setdefault(order['symbol'], ([], []))
+        if len(buys) + len(sells) > 2 * len(self.resting) + 100:
+            # Canceled orders pile up in the heaps when the price doesn't get to them, they're dropped once in a while
+            for heap in (buys, sells):
+                heap[:] = [entry for entry in heap if entry[1] in self.resting]
+                heapq.heapify(heap)
+        if order['side'] == 'BUY':
+            heapq.heappush(buys, (-float(order['price']), order['orderId']))
+        else:
+            heapq.heappush(sells, (float(order['price']), order['orderId']))
+
+    def fill(self, order_id):
+        # Canceled orders are still in the heaps, they're skipped here
+        account = self.resting.pop(order_id, None)
+        if account is not None:
+            account.fill_resting(order_id)
+
+
+class PaperAccount(SimulatedExchange):
+    # Virtual balances and orders on a PaperMarket. Calls block like the market's: trading rules and the first
+    # price of a symbol can come from the source.
+
+    def __init__(self, market, balances=None):
+        SimulatedExchange.__init__(self, None, balances=balances, fee=market.fee)
+        self.market = market
+        self.blocking = market.blocking
+        # Shared with the market: IDs unique across accounts, events go to every order tracker
+        self.order_ids = market.order_ids
+        self.feeds = market.feeds
+        self.fills = 0
+
+    # Exchange interface, under the market lock
+
+    def get_account(self):
+        with self.market.lock:
+            return SimulatedExchange.get_account(self)
+
+    def get_asset_balance(self, asset):
+        with self.market.lock:
+            return SimulatedExchange.get_asset_balance(self, asset)
+
+    def get_symbol_ticker(self, symbol):
+        self.call()
+        return self.market.get_symbol_ticker(symbol)
+
+    def get_order(self, symbol, orderId):
+        with self.market.lock:
+            return SimulatedExchange.get_order(self, symbol, orderId)
+
+    def get_open_orders(self):
+        with self.market.lock:
+            return SimulatedExchange.get_open_orders(self)
+
+    def get_symbol_info(self, symbol):
+        self.call()
+        return self.market.get_symbol_info(symbol)
+
+    def order_limit_buy(self, symbol, quantity, price):
+        with self.market.lock:
+            return SimulatedExchange.order_limit_buy(self, symbol, quantity, price)
+
+    def order_limit_sell(self, symbol, quantity, price):
+        with self.market.lock:
+            return SimulatedExchange.order_limit_sell(self, symbol, quantity, price)
+
+    def cancel_order(self, symbol, orderId):
+        with self.market.lock:
+            return SimulatedExchange.cancel_order(self, symbol, orderId)
+
+    def cancel_replace_order(self, symbol, orderId, side, quantity, price):
+        with self.market.lock:
+            return SimulatedExchange.cancel_replace_order(self, symbol, orderId, side, quantity, price)
+
+    def market_stream(self, cache, symbols):
+        return self.market.market_stream(cache, symbols)
+
+    def keep_alive(self):
+        return self.market.keep_alive()
+
+    def time(self):
+        return self.market.time()
+
+    # Simulation
+
+    def call(self):
+        SimulatedExchange.call(self)
+        self.clock = self.market.time()
+
+    def current_price(self, symbol):
+        return self.market.price(symbol)
+
+    def check_filters(self, symbol, quantity, price):
+        self.symbol_filters = self.market.get_symbol_info(symbol)['filters']
+        SimulatedExchange.check_filters(self, symbol, quantity, price)
+
+    def split_symbol(self, symbol):
+        symbol_info = self.market.get_symbol_info(symbol)
+        return symbol_info['baseAsset'], symbol_info['quoteAsset']
+
+    def place_order(self, symbol, side, quantity, price):
+        order = SimulatedExchange.place_order(self, symbol, side, quantity, price)
+        self.market.owners[order['orderId']] = self
+        if order['status'] == 'NEW':
+            self.market.rest(self, order)
+        return order
+
+    def cancel(self, symbol, orderId):
+        order = SimulatedExchange.cancel(self, symbol, orderId)
+        self.market.resting.pop(order['orderId'], None)
+        return order
+
+    def fill(self, order, fill_price):
+        self.fills += 1
+        self.market.fills += 1
+        SimulatedExchange.fill(self, order, fill_price)
+
+    def fill_resting(self, order_id):
+        # Reached by the market price, called by the market with the lock held
+        self.clock = self.market.time()
+        order = self.orders[order_id]
+        self.fill(order, float(order['price']))
+
+    def value(self, quote_asset='USDT'):
+        # Everything in quote asset at the last prices, free and locked
+        with self.market.lock:
+            total = 0.0
+            for asset, (free, locked) in self.balances.items():
+                if asset == quote_asset:
+                    total += free + locked
+                elif free + locked:
+                    total += (free + locked) * self.market.price(asset + quote_asset)
+            return total
+
+
+def parse_bot(text):
+    # "sell:buy" or "sell:buy:levels"
+    parts = text.split(':')
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError("expected sell increment:buy decrement[:levels], got " + text)
+    try:
+        return float(parts[0]), float(parts[1]), int(parts[2]) if len(parts) == 3 else None
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected numbers, got " + text)
+
+
+def add_bots(runner, market, symbol, bots, usdt, adaptive=False):
+    # One account each, returns name -> account. adaptive bots follow the volatility, see volatility.py
+    accounts = {}
+    for sell_increment, buy_decrement, levels in bots:
+        name = "{:g}:{:g}".format(sell_increment, buy_decrement) + (":" + str(levels) if levels else "")
+        account = market.account({'USDT': usdt})
+        runner.add_strategy(symbol, sell_increment, buy_decrement, budget=usdt / levels if levels else None,
+                            name=name, levels=levels, exchange=account, adaptive=adaptive)
+        accounts[name] = account
+    return accounts
+
+
+def report(runner, accounts, usdt):
+    # Bots from the best to the worst
+    rows = sorted(((account.value(), name) for name, account in accounts.items()), reverse=True)
+    lines = ["{:<14} {:<12} {:>7} {:>14} {:>9}".format('bot', 'state', 'fills', 'value', 'change')]
+    for value, name in rows:
+        strategy = runner.strategies[name]
+        lines.append("{:<14} {:<12} {:>7} {:>14.2f} {:>+8.2f}%".format(
+            name, strategy.STATE_NAMES.get(strategy.trading_state, str(strategy.trading_state)),
+            accounts[name].fills, value, (value / usdt - 1) * 100))
+    return '\n'.join(lines)
+
+
+async def replay(runner, market, symbol, prices):
+    # Recorded klines, the bots tick after every trade: low and high in the order that ends closest to the close,
+    # then the close
+    runner.start_order_stream()
+    runner.start_market_stream()
+    if len(prices.close) == 0:
+        return
+    # The first buy is at the first open, more or less
+    market.replay(symbol, float(prices.close[0]), int(prices.time[0]))
+    await runner.start_trading()
+    for clock, low, high, close in zip(prices.time, prices.low, prices.high, prices.close):
+        trades = (low, high) if close >= (low + high) / 2 else (high, low)
+        for price in trades + (close,):
+            market.replay(symbol, float(price), int(clock))
+            await runner.tick()
+
+
+def main():
+    from runner import GridRunner
+
+    parser = argparse.ArgumentParser(description="Paper trade grid strategies side by side")
+    parser.add_argument('symbol')
+    parser.add_argument('bots', nargs='+', type=parse_bot, help="sell increment:buy decrement[:levels]")
+    parser.add_argument('--usdt', type=float, default=1000.0, help="Initial USDT balance of every bot")
+    parser.add_argument('--fee', type=float, default=0.001, help="Trading fee, 0.001 is 0.1%%")
+    parser.add_argument('--margin', type=float, default=0.0,
+                        help="How far the price must go beyond an order to fill it")
+    parser.add_argument('--prices', help="Recorded prices (see backtest.py) instead of the live ones")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="Increments follow the volatility, the given ones are the floors")
+    parser.add_argument('--report-interval', type=float, default=600.0, help="Seconds between reports, live")
+    args = parser.parse_args()
+
+    if args.prices:
+        from backtest import load_prices
+        market = PaperMarket(fee=args.fee, margin=args.margin)
+        runner = GridRunner(market)
+        runner.debug = False
+        accounts = add_bots(runner, market, args.symbol, args.bots, args.usdt, args.adaptive)
+        prices = load_prices(args.prices)
+        start = time.perf_counter()
+        asyncio.run(replay(runner, market, args.symbol, prices))
+        elapsed = time.perf_counter() - start
+        print(report(runner, accounts, args.usdt))
+        print(str(market.trades) + " trades, " + str(market.fills) + " fills in " + "{:.1f}".format(elapsed) + " s")
+        return
+
+    from exchange import BinanceExchange
+    # Public data only, no API keys
+    market = PaperMarket(BinanceExchange('', ''), fee=args.fee, margin=args.margin)
+    runner = GridRunner(market)
+    accounts = add_bots(runner, market, args.symbol, args.bots, args.usdt, args.adaptive)
+    thread = threading.Thread(target=runner.run, daemon=True)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(args.report_interval)
+            logger.info("Paper trading report:\n%s", report(runner, accounts, args.usdt))
+    except KeyboardInterrupt:
+        print(report(runner, accounts, args.usdt))
+
+
+if __name__ == '__main__':
+    main()
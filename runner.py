@@ -0,0 +1,271 @@
+# Multi-grid runner
+#
+# Runs many GridStrategy objects (different symbols, different increments) from one process, driven by a single
+# loop. All the strategies share one order tracker and one user data stream. Instead of a get_order call per
+# strategy per tick, all the open orders are confirmed with one open orders call, and only the orders that
+# disappeared from it (filled, canceled...) are fetched one by one. When the user data stream is up, even the
+# open orders call is made only once in a while, see OrderTracker. Balances are cached for all the strategies,
+# see account_cache.py.
+#
+# Usage:
+#     runner = GridRunner(ScheduledExchange(BinanceExchange(api_key, api_secret)), notifier=Notifier(bot, chat_id))
+#     runner.add_strategy('LTCUSDT', sell_increment=1.0, buy_decrement=1.0, budget=100)
+#     runner.add_strategy('BTCUSDT', sell_increment=200, buy_decrement=200, budget=100)
+#     runner.add_strategy('LTCUSDT', sell_increment=2.0, buy_decrement=2.0, budget=100, name='LTCUSDT wide')
+#     runner.add_strategy('ETHUSDT', sell_increment=5, buy_decrement=5, budget=20, levels=5)
+#     runner.run()
+#
+# Paper trading, one virtual account per strategy (see paper.py): the runner runs on the market itself, its order
+# checks and streams then cover all the accounts
+#     market = PaperMarket(BinanceExchange())
+#     runner = GridRunner(market)
+#     runner.add_strategy('LTCUSDT', sell_increment=1.0, buy_decrement=1.0, exchange=market.account({'USDT': 1000}))
+#     runner.add_strategy('LTCUSDT', sell_increment=2.0, buy_decrement=2.0, name='LTCUSDT wide',
+#                         exchange=market.account({'USDT': 1000}))
+#     runner.run()
+#
+# Strategies still WAITING when the runner starts begin trading at once. Ticks of different strategies run
+# concurrently on the engine loop, see engine.py.
+
+import asyncio
+import time
+
+from account_cache import CachedExchange
+from engine import Engine, Timers
+from ladder import LadderStrategy
+from market_data import PriceCache
+from order_builder import OrderBuilder
+from order_stream import OrderTracker
+from strategy import GridStrategy
+from structured_log import get_logger
+from volatility import VolatilityTracker
+
+
+logger = get_logger('runner')
+
+
+class GridRunner:
+    debug = True
+    # Seconds between chances for the exchange to keep its connections warm, see http_pool.py
+    keep_alive_interval = 5.0
+
+    def __init__(self, exchange, notifier=None, tick_interval=1.0, journal=None, metrics=None, ledger=None):
+        # Strategies on the same account share balances, see account_cache.py
+        self.exchange = CachedExchange(exchange)
+        # engine.Notifier shared by all the strategies
+        self.notifier = notifier
+        # Seconds between ticks when a strategy can't tell, see GridStrategy.tick_interval
+        self.tick_interval = tick_interval
+        self.order_tracker = OrderTracker()
+        self.order_stream = None
+        # Prices of all the symbols, from a single market data stream
+        self.market_data = PriceCache()
+        # Trading rules of all the symbols, loaded once per symbol
+        self.order_builder = OrderBuilder()
+        self.market_stream = None
+        self.engine = Engine()
+        self.engine.watch(self.order_tracker)
+
+        # name -> strategy, the name is the symbol unless told otherwise
+        self.strategies = {}
+
+        # Shared by all the strategies, see metrics.py and ledger.py
+        self.metrics = metrics
+        self.ledger = ledger
+
+        # Strategies found in the journal pick up where they left off, see journal.py
+        self.journal = journal
+        self.recovered = {}
+        if journal is not None:
+            self.recovered = journal.recover()
+            journal.start()
+
+    def log(self, message, *args, **fields):
+        # See structured_log.py
+        if self.debug:
+            logger.info(message, *args, extra={'fields': fields})
+
+    def add_strategy(self, symbol, sell_increment, buy_decrement, budget=None, name=None, quote_asset='USDT',
+                     base_asset=None, levels=None, adaptive=False, exchange=None):
+        # With levels, the strategy is a ladder of levels buy and sell orders (see ladder.py), budget is then
+        # spent by each buy level. adaptive places the next orders as far as the volatility says, between the
+        # increments and 3 times them, see volatility.py. exchange is an account of the strategy's own on the
+        # runner's paper market (see paper.py): orders are checked and streamed through the runner's exchange, an
+        # account anywhere else would never see its fills.
+        name = name or symbol
+        if name in self.strategies:
+            raise ValueError("There's already a strategy called " + name)
+        if exchange is not None and getattr(exchange, 'market', None) is not self.exchange.exchange:
+            raise ValueError("The exchange of " + name + " must be an account of the runner's paper market")
+        if base_asset is None:
+            base_asset = symbol[:-len(quote_asset)]
+
+        kwargs = dict(exchange=exchange or self.exchange, symbol=symbol, base_asset=base_asset, quote_asset=quote_asset,
+                      sell_increment=sell_increment, buy_decrement=buy_decrement, order_tracker=self.order_tracker,
+                      name=name, notifier=self.strategy_notification, journal=self.journal, metrics=self.metrics,
+                      market_data=self.market_data, ledger=self.ledger, order_builder=self.order_builder)
+        if levels:
+            strategy = LadderStrategy(levels=levels, level_budget=budget, **kwargs)
+        else:
+            strategy = GridStrategy(budget=budget, **kwargs)
+        strategy.debug = self.debug
+        strategy.default_tick_interval = self.tick_interval
+        if adaptive:
+            # Bars on the strategy's exchange clock
+            strategy.set_volatility(VolatilityTracker(symbol, clock=strategy.exchange_clock))
+        if name in self.recovered:
+            strategy.restore(self.recovered[name])
+        self.strategies[name] = strategy
+        self.log("Strategy %s added", name)
+        return strategy
+
+    def remove_strategy(self, name):
+        # Any open order of the strategy is left on the exchange
+        self.log("Strategy %s removed", name)
+        return self.strategies.pop(name)
+
+    def strategies_for(self, symbol):
+        return [strategy for strategy in self.strategies.values() if strategy.symbol == symbol]
+
+    def strategy_notification(self, strategy, message, fill=None):
+        if self.notifier is None:
+            return
+        message = "*" + strategy.name + "*\n" + message
+        if fill is not None:
+            self.notifier.fill(message, fill['side'], float(fill['cummulativeQuoteQty']), parse_mode='Markdown')
+        else:
+            self.notifier.send(message, parse_mode='Markdown')
+
+    async def start_trading(self):
+        # Strategies restored from the journal are resumed, the others start from scratch
+        restored = [strategy for strategy in self.strategies.values() if strategy.recovered is not None]
+        claimed = set()
+        for strategy in restored:
+            claimed.update(int(order_id) for order_id in strategy.last_two_orders if order_id is not None)
+        await asyncio.gather(*(strategy.resume(claimed) for strategy in restored))
+        await asyncio.gather(*(strategy.start_trading() for strategy in self.strategies.values()
+                               if strategy.trading_state == GridStrategy.WAITING and strategy not in restored))
+
+    def stop_trading(self):
+        for strategy in self.strategies.values():
+            strategy.stop_trading()
+
+    def placed_orders(self, strategies=None):
+        # Orders waiting to be filled, one for each strategy (more for ladders)
+        if strategies is None:
+            strategies = self.strategies.values()
+        return [order_id for strategy in strategies for order_id in strategy.resting_orders()]
+
+    async def sync_orders(self, strategies=None):
+        # A single batched check for all the orders that need to be confirmed
+        stale_orders = [order_id for order_id in self.placed_orders(strategies)
+                        if self.order_tracker.is_stale(order_id)]
+        if stale_orders:
+            try:
+                if self.exchange.blocking:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, self.order_tracker.sync_open_orders, self.exchange,
+                                               stale_orders)
+                else:
+                    self.order_tracker.sync_open_orders(self.exchange, stale_orders)
+            except Exception as e:
+                # Strategies will poll their orders by themselves
+                self.log("Exception while checking open orders: %s", e)
+
+    async def tick(self, strategies=None):
+        # All the strategies, or only the ones given
+        if strategies is None:
+            strategies = list(self.strategies.values())
+        await self.sync_orders(strategies)
+        await asyncio.gather(*(strategy.tick() for strategy in strategies))
+
+    def start_order_stream(self):
+        try:
+            self.order_stream = self.exchange.order_stream(self.order_tracker)
+            self.order_stream.start()
+            self.log("User data stream started")
+        except Exception as e:
+            # Not fatal, orders will be polled
+            self.order_stream = None
+            self.log("Couldn't start user data stream, falling back to polling: %s", e)
+
+    def stop_order_stream(self):
+        if self.order_stream is not None:
+            self.order_stream.stop()
+            self.order_stream = None
+
+    def start_market_stream(self):
+        symbols = sorted(set(strategy.symbol for strategy in self.strategies.values()))
+        try:
+            self.market_stream = self.exchange.market_stream(self.market_data, symbols)
+            self.market_stream.start()
+            self.log("Market data stream started")
+        except Exception as e:
+            # Not fatal, prices will be asked to the exchange
+            self.market_stream = None
+            self.log("Couldn't start market data stream, falling back to REST prices: %s", e)
+
+    def stop_market_stream(self):
+        if self.market_stream is not None:
+            self.market_stream.stop()
+            self.market_stream = None
+
+    def run(self):
+        self.engine.run(self.main_loop())
+
+    async def main_loop(self):
+        if self.notifier is not None:
+            self.notifier.start()
+        self.start_order_stream()
+        self.start_market_stream()
+        await self.start_trading()
+        # A tick timer for each strategy, every strategy ticks as often as its own open order needs
+        timers = Timers()
+        for name, strategy in self.strategies.items():
+            timers.schedule(('tick', name), strategy.tick_interval())
+        timers.schedule(('symbol_filters',), self.order_builder.refresh_interval)
+        timers.schedule(('keep_alive',), self.keep_alive_interval)
+        while True:
+            # Sleeps until the next deadline, fills coming from the user data stream wake the loop up at once
+            due, woken = await self.engine.wait(timers)
+            if ('symbol_filters',) in due:
+                await self.refresh_symbol_filters()
+                timers.schedule(('symbol_filters',), self.order_builder.refresh_interval)
+            if ('keep_alive',) in due:
+                await self.keep_alive()
+                timers.schedule(('keep_alive',), self.keep_alive_interval)
+            if woken:
+                # Whose order was filled isn't known here, all of them tick
+                names = list(self.strategies)
+            else:
+                names = [timer[1] for timer in due if timer[0] == 'tick' and timer[1] in self.strategies]
+            if not names:
+                continue
+            start = time.perf_counter()
+            await self.tick([self.strategies[name] for name in names])
+            if self.metrics is not None:
+                self.metrics.observe('tick_seconds', time.perf_counter() - start)
+            for name in names:
+                if name in self.strategies:
+                    timers.schedule(('tick', name), self.strategies[name].tick_interval())
+
+    async def keep_alive(self):
+        try:
+            if self.exchange.blocking:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.exchange.keep_alive)
+            else:
+                self.exchange.keep_alive()
+        except Exception as e:
+            self.log("Exception while keeping the exchange connection alive: %s", e)
+
+    async def refresh_symbol_filters(self):
+        # One load per symbol traded, ahead of the orders that need them
+        strategies = {}
+        for strategy in self.strategies.values():
+            strategies.setdefault(strategy.symbol, strategy)
+        results = await asyncio.gather(*(strategy.load_symbol_filters() for strategy in strategies.values()),
+                                       return_exceptions=True)
+        for symbol, result in zip(strategies, results):
+            if isinstance(result, Exception):
+                self.log("Exception while loading the %s trading rules: %s", symbol, result)
@@ -0,0 +1,267 @@
+# Rate limited request scheduler
+#
+# ScheduledExchange wraps an Exchange (usually BinanceExchange) and lets every call through a single scheduler:
+#
+#   weight budget   Binance gives each IP a request weight budget per minute (REQUEST_WEIGHT rate limit) and
+#                   reports what's been used in the X-MBX-USED-WEIGHT header. Calls are counted with their
+#                   documented weight and the count is corrected with the header when there is one. Informational
+#                   calls stop at soft_limit percent of the budget, order placement and cancellation can use it
+#                   all.
+#   priorities      when calls have to wait, orders go first, then what the state machine needs (orders,
+#                   balances), then informational calls (prices, account)
+#   coalescing      a read that's identical to one already in flight waits for its result instead of being sent
+#                   again
+#   backoff         a 429 (too many requests) or 418 (IP banned) answer stops every call for the Retry-After time
+#                   Binance asks for, or for an exponential, jittered, backoff. Meanwhile calls fail at once with
+#                   RateLimitError, without touching Binance.
+#
+# Calls that would have to wait more than max_wait seconds for budget fail with RateLimitError too, the main
+# loop will try again at the next tick.
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from exchange import Exchange
+from structured_log import get_logger
+
+
+logger = get_logger('scheduler')
+
+
+# Priorities, lower goes first
+ORDER = 0
+TRADING = 1
+INFORMATIONAL = 2
+
+# name -> (priority, weight, whether identical calls can share a response)
+CALLS = {'order_limit_buy': (ORDER, 1, False),
+         'order_limit_sell': (ORDER, 1, False),
+         'cancel_order': (ORDER, 1, False),
+         'cancel_replace_order': (ORDER, 1, False),
+         'get_order': (TRADING, 2, True),
+         'get_asset_balance': (TRADING, 10, True),
+         'get_open_orders': (TRADING, 40, True),
+         'get_symbol_info': (TRADING, 10, True),
+         'get_account': (INFORMATIONAL, 10, True),
+         'get_symbol_ticker': (INFORMATIONAL, 1, True)}
+
+# HTTP statuses used by Binance for rate limits
+TOO_MANY_REQUESTS = 429
+IP_BANNED = 418
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class ScheduledExchange(Exchange):
+    DEFAULT_WEIGHT_LIMIT = 1200
+    DEFAULT_SOFT_LIMIT = 80
+    DEFAULT_MAX_WAIT = 5.0
+    BACKOFF_START = 1.0
+    BACKOFF_MAX = 300.0
+
+    debug = True
+
+    def __init__(self, exchange, weight_limit=DEFAULT_WEIGHT_LIMIT, soft_limit=DEFAULT_SOFT_LIMIT,
+                 max_wait=DEFAULT_MAX_WAIT):
+        self.exchange = exchange
+        self.blocking = exchange.blocking
+        self.weight_limit = weight_limit
+        self.soft_limit = soft_limit
+        self.max_wait = max_wait
+
+        self.condition = threading.Condition()
+        self.window = None          # current minute
+        self.minute_weight = 0
+        self.waiting = []           # heap of (priority, ticket)
+        self.tickets = itertools.count()
+        self.in_flight = {}         # call key -> Future, for coalescing
+        self.blocked_until = 0.0    # time.time() when backoff ends
+        self.backoffs = 0
+
+        # Counters
+        self.sent = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def log(self, message, *args, **fields):
+        # See structured_log.py
+        if self.debug:
+            logger.info(message, *args, extra={'fields': fields})
+
+    # Budget
+
+    def budget(self, priority):
+        # Weight this priority is allowed to use in a minute
+        if priority == ORDER:
+            return self.weight_limit
+        return self.weight_limit * self.soft_limit // 100
+
+    def roll_window(self, now):
+        window = int(now // 60)
+        if window != self.window:
+            self.window = window
+            self.minute_weight = 0
+
+    def wait_time(self, priority, weight, now):
+        # 0 if the call can go now, otherwise how long to wait at least
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.roll_window(now)
+        if self.minute_weight + weight > self.budget(priority):
+            return (self.window + 1) * 60 - now
+        return 0
+
+    def acquire(self, priority, weight):
+        ticket = (priority, next(self.tickets))
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    now = time.time()
+                    if now < self.blocked_until:
+                        self.rejected += 1
+                        raise RateLimitError("Rate limited by Binance, calls resume in "
+                                             + "{:.0f}".format(self.blocked_until - now) + " s")
+                    wait = self.wait_time(priority, weight, now)
+                    if wait == 0 and self.waiting[0] == ticket:
+                        self.minute_weight += weight
+                        return
+                    if wait > self.max_wait:
+                        self.rejected += 1
+                        raise RateLimitError("Request weight budget used up, " + str(self.minute_weight) + "/"
+                                             + str(self.weight_limit) + " this minute")
+                    # Woken up by calls leaving the queue, or when the budget comes back
+                    self.condition.wait(wait or None)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def update_used_weight(self):
+        # What Binance says we used this minute, when it says it
+        used_weight = self.exchange.used_weight()
+        if used_weight is not None:
+            with self.condition:
+                self.roll_window(time.time())
+                # Responses of concurrent calls can come back in any order, the highest count is the latest
+                self.minute_weight = max(self.minute_weight, used_weight)
+
+    def back_off(self, exception):
+        # Called on 429 and 418 answers
+        retry_after = None
+        response = getattr(exception, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+        with self.condition:
+            if retry_after is not None:
+                delay = float(retry_after)
+            else:
+                delay = min(self.BACKOFF_MAX, self.BACKOFF_START * 2 ** self.backoffs) * random.uniform(0.5, 1.5)
+            self.backoffs += 1
+            self.rate_limited += 1
+            self.blocked_until = max(self.blocked_until, time.time() + delay)
+            self.condition.notify_all()
+        self.log("Rate limited by Binance (HTTP %s), backing off for %.1f s", exception.status_code, delay)
+
+    # Calls
+
+    def request(self, name, **kwargs):
+        priority, weight, coalesce = CALLS[name]
+        key = None
+        future = None
+        if coalesce:
+            key = (name, tuple(sorted(kwargs.items())))
+            with self.condition:
+                shared = self.in_flight.get(key)
+                if shared is None:
+                    future = self.in_flight[key] = Future()
+                else:
+                    self.coalesced += 1
+            if shared is not None:
+                return shared.result()
+
+        try:
+            self.acquire(priority, weight)
+            self.sent += 1
+            try:
+                result = getattr(self.exchange, name)(**kwargs)
+            except Exception as e:
+                if getattr(e, 'status_code', None) in (TOO_MANY_REQUESTS, IP_BANNED):
+                    self.back_off(e)
+                raise
+            self.update_used_weight()
+            with self.condition:
+                self.backoffs = 0
+        except Exception as e:
+            if future is not None:
+                future.set_exception(e)
+            raise
+        else:
+            if future is not None:
+                future.set_result(result)
+            return result
+        finally:
+            if future is not None:
+                with self.condition:
+                    self.in_flight.pop(key, None)
+
+    # Exchange interface
+
+    def get_account(self):
+        return self.request('get_account')
+
+    def get_asset_balance(self, asset):
+        return self.request('get_asset_balance', asset=asset)
+
+    def get_symbol_ticker(self, symbol):
+        return self.request('get_symbol_ticker', symbol=symbol)
+
+    def get_order(self, symbol, orderId):
+        return self.request('get_order', symbol=symbol, orderId=orderId)
+
+    def get_open_orders(self):
+        return self.request('get_open_orders')
+
+    def get_symbol_info(self, symbol):
+        return self.request('get_symbol_info', symbol=symbol)
+
+    def order_limit_buy(self, symbol, quantity, price):
+        return self.request('order_limit_buy', symbol=symbol, quantity=quantity, price=price)
+
+    def order_limit_sell(self, symbol, quantity, price):
+        return self.request('order_limit_sell', symbol=symbol, quantity=quantity, price=price)
+
+    def cancel_order(self, symbol, orderId):
+        return self.request('cancel_order', symbol=symbol, orderId=orderId)
+
+    def cancel_replace_order(self, symbol, orderId, side, quantity, price):
+        return self.request('cancel_replace_order', symbol=symbol, orderId=orderId, side=side, quantity=quantity,
+                            price=price)
+
+    def order_stream(self, tracker):
+        # The user data stream isn't weighted
+        return self.exchange.order_stream(tracker)
+
+    def used_weight(self):
+        return self.minute_weight
+
+    def keep_alive(self):
+        # A ping isn't worth waiting for: skipped while backing off or when informational calls would have to wait.
+        # Its weight is counted from the header of the next response.
+        with self.condition:
+            if self.wait_time(INFORMATIONAL, 1, time.time()) > 0:
+                return False
+        return self.exchange.keep_alive()
+
+    def market_stream(self, cache, symbols):
+        return self.exchange.market_stream(cache, symbols)
+
+    def time(self):
+        return self.exchange.time()
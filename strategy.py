@@ -0,0 +1,714 @@
+# Grid trading strategy
+#
+# The trading state machine of the bot, for a single symbol: buy, sell at last bought price + sell increment,
+# buy at last sold price - buy decrement, and so on. All its state lives in the instance, so many strategies
+# (different symbols, different increments) can run side by side, see runner.py.
+# TraderBot is the Telegram-controlled LTCUSDT strategy.
+#
+# The main loop functions are coroutines, they run on the event loop of engine.Engine.
+
+import asyncio
+import functools
+import logging
+import time
+
+from order_builder import OrderBuilder
+from order_stream import OrderTracker
+from structured_log import get_logger
+
+
+logger = get_logger('strategy')
+
+
+class GridStrategy:
+    # Trading states
+    INIT = 0            # Exchange is not set, key and secret need to be sent
+    WAITING = 1         # Exchange is set and verified but trading is not activated
+    BUY_PLACED = 2      # A buy order has been scheduled but it isn't filled yet        ###  STATES WITH
+    BOUGHT = 3          # Buy order completed and a sell order is yet to be scheduled    ##  AUTOMATED
+    SELL_PLACED = 4     # A sell order has been scheduled but it isn't filled yet        ##  TRADING
+    SOLD = 5            # Sell order completed and a buy order is yet to be scheduled   ###  ACTIVATED
+    STATE_NAMES = {INIT: 'INIT', WAITING: 'WAITING', BUY_PLACED: 'BUY_PLACED', BOUGHT: 'BOUGHT',
+                   SELL_PLACED: 'SELL_PLACED', SOLD: 'SOLD'}
+
+    debug = True
+
+    # Seconds between ticks, see tick_interval
+    min_tick_interval = 0.25
+    max_tick_interval = 5.0
+    default_tick_interval = 1.0
+
+    def __init__(self, exchange=None, symbol='LTCUSDT', base_asset='LTC', quote_asset='USDT',
+                 sell_increment=1.0, buy_decrement=1.0, order_tracker=None, budget=None, name=None, notifier=None,
+                 journal=None, metrics=None, market_data=None, ledger=None, order_builder=None, volatility=None):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.base_asset = base_asset
+        self.quote_asset = quote_asset
+        self.name = name or symbol
+        # Called as notifier(strategy, message, fill), see notify
+        self.notifier = notifier
+
+        # Orders can be shared with other strategies on the same account
+        self.order_tracker = order_tracker or OrderTracker()
+
+        # Maximum amount of quote asset used for each buy order. None means all the free balance (minus 1, for
+        # margin), that's fine only when there's a single strategy per quote asset.
+        self.budget = budget
+
+        self.trading_state = self.INIT if exchange is None else self.WAITING
+
+        # Trading parameters in quote asset
+        self.sell_increment = sell_increment
+        self.buy_decrement = buy_decrement
+
+        # element 0: older order
+        # element 1: newer order
+        self.last_two_orders = [None, None]
+
+        # Scheduled action variables
+        self.sell_increment_changed = False
+        self.buy_decrement_changed = False
+
+        # State changes are written to the journal, if any, see journal.py
+        self.journal = journal
+        self.journaled_state = None
+        # Journal record waiting to be resumed, see restore
+        self.recovered = None
+
+        # Fill detection lag and swallowed exceptions are recorded here, if any, see metrics.py
+        self.metrics = metrics
+
+        # Prices from the market data stream, if any, see market_data.py
+        self.market_data = market_data
+
+        # Orders and fills are appended here, if any, see ledger.py
+        self.ledger = ledger
+
+        # Trading rules of the symbol, orders are rounded and checked before being sent, see order_builder.py
+        self.order_builder = order_builder if order_builder is not None else OrderBuilder()
+
+        # Adaptive mode: volatility.VolatilityTracker of the symbol, fed by the market data stream. None for the
+        # fixed increments.
+        self.volatility = None
+        self.set_volatility(volatility)
+
+    def notify(self, message, fill=None):
+        # Sends a message to the user, messages are Markdown. fill is the filled order the message is about, if any:
+        # fills can be summarized in a digest, see engine.Notifier.fill
+        if self.notifier is not None:
+            self.notifier(self, message, fill)
+
+    def log(self, message, *args, **fields):
+        # message is formatted with args ("%s") only if it's written, see structured_log.py. fields go to the JSON
+        # record, along with the strategy and its state.
+        if self.debug and logger.isEnabledFor(logging.INFO):
+            fields['strategy'] = self.name
+            fields['state'] = self.STATE_NAMES.get(self.trading_state, self.trading_state)
+            logger.info(message, *args, extra={'fields': fields})
+
+    def exception_swallowed(self, function):
+        if self.metrics is not None:
+            self.metrics.increment('swallowed_exceptions_total', {'function': function})
+
+    def order_placed(self, order):
+        self.order_tracker.update(order)
+        if self.ledger is not None:
+            self.ledger.record_order(self.name, order)
+
+    def fill_detected(self, order):
+        if self.ledger is not None:
+            self.ledger.record_fill(self.name, order)
+        # How long after the fill on the exchange the state machine noticed it
+        if 'updateTime' in order:
+            lag = max(0.0, (self.exchange.time() - order['updateTime']) / 1000.0)
+            if self.metrics is not None:
+                self.metrics.observe('fill_detection_lag_seconds', lag)
+            self.log("Fill of order %s detected after %.0f ms", order['orderId'], lag * 1000, orderId=order['orderId'],
+                     latency_ms=lag * 1000)
+
+    def state_to_str(self):
+        state = self.trading_state
+        if state == self.INIT:
+            return "Trading OFF, not connected to Binance"
+        elif state == self.WAITING:
+            return "Trading OFF, connected to Binance"
+        elif state == self.BUY_PLACED:
+            return "Trading ON, buy order placed and yet to be filled"
+        elif state == self.BOUGHT:
+            return "Trading ON, buy order filled"
+        elif state == self.SELL_PLACED:
+            return "Trading ON, sell order placed and yet to be filled"
+        elif state == self.SOLD:
+            return "Trading ON, sell order filled"
+
+    def order_info_to_str(self, order):
+        if order is None:
+            return "None"
+        else:
+            order_str = ("  • Order ID: " + str(order['orderId'])
+                         + "\n  • Side: " + order['side']
+                         + "\n  • Price in " + self.quote_asset + ": " + order['price']
+                         + "\n  • Quantity in " + self.base_asset + ": " + order['origQty']
+                         + "\n  • Status: " + order['status'])
+            return order_str
+
+    def set_last_order(self, order):
+        # Removes older order
+        self.last_two_orders.pop(0)
+        # Append new one
+        self.last_two_orders.append(order)
+
+    def get_last_order(self):
+        return self.last_two_orders[1]
+
+    def get_penultimate_order(self):
+        return self.last_two_orders[0]
+
+    def checkpoint(self):
+        # Journals the state if it changed since the last time, cheap enough to be called at every tick
+        # A state waiting to be resumed must not be overwritten (e.g. by INIT while waiting for API keys)
+        if self.journal is None or self.recovered is not None:
+            return
+        state = self.journal_state()
+        if state != self.journaled_state:
+            self.journaled_state = state
+            self.journal.record(self.name, state)
+
+    def journal_state(self):
+        # What's needed to pick up after a restart, see resume
+        return {'symbol': self.symbol,
+                'state': self.trading_state,
+                'orders': list(self.last_two_orders),
+                'sell_increment': self.sell_increment,
+                'buy_decrement': self.buy_decrement}
+
+    def resting_orders(self):
+        # IDs of the orders waiting to be filled
+        if self.trading_state in (self.BUY_PLACED, self.SELL_PLACED):
+            return [self.get_last_order()]
+        return []
+
+    def restore(self, record):
+        # Loads a journal record (see Journal.recover), trading is resumed later by resume
+        self.recovered = record
+        self.last_two_orders = list(record['orders'])
+
+    async def resume(self, claimed=()):
+        # Picks up the restored state, once the exchange is set. Orders are checked against the exchange: from
+        # then on the state machine deals with whatever happened while the bot was down (fills, orders canceled
+        # by hand...). claimed are order IDs that belong to other strategies. Returns whether trading was resumed.
+        state = self.recovered['state']
+        self.last_two_orders = list(self.recovered['orders'])
+        self.recovered = None
+        if state not in (self.BUY_PLACED, self.BOUGHT, self.SELL_PLACED, self.SOLD) or self.get_last_order() is None:
+            self.trading_state = self.WAITING
+            self.checkpoint()
+            return False
+        try:
+            last_order = await self.get_order(self.get_last_order())
+            if state in (self.BOUGHT, self.SOLD):
+                # The bot may have gone down right after placing the next order, before journaling it: an
+                # open order newer than the last one is adopted instead of placing another one
+                side = 'SELL' if state == self.BOUGHT else 'BUY'
+                open_orders = await self.call(self.exchange.get_open_orders)
+                newer_orders = [order for order in open_orders
+                                if order['symbol'] == self.symbol and order['side'] == side
+                                and int(order['orderId']) > int(self.get_last_order())
+                                and int(order['orderId']) not in claimed]
+                if newer_orders:
+                    last_order = max(newer_orders, key=lambda order: int(order['orderId']))
+                    self.set_last_order(last_order['orderId'])
+                    self.order_tracker.update(last_order)
+                    state = self.SELL_PLACED if state == self.BOUGHT else self.BUY_PLACED
+        except Exception as e:
+            self.log("Exception while resuming: %s", e)
+            self.exception_swallowed('resume')
+            message = ("*I couldn't resume trading*, error while checking my last order: " + str(e)
+                       + "\nTake a look at your Binance trading page before starting again.")
+            self.notify(message)
+            self.trading_state = self.WAITING
+            self.checkpoint()
+            return False
+        self.trading_state = state
+        self.log("Trading resumed, state is %s", state)
+        message = ("*Trading resumed* where I left off: " + self.state_to_str() + ".\nLast order:\n"
+                   + self.order_info_to_str(last_order))
+        self.notify(message)
+        self.checkpoint()
+        return True
+
+    def set_increments(self, sell_increment=None, buy_decrement=None):
+        # New settings (None leaves one as it is). The open order is re-priced at the next tick only if the value it
+        # depends on actually changed: the sell increment for an open sell, the buy decrement for an open buy.
+        if sell_increment is not None and sell_increment != self.sell_increment:
+            self.sell_increment = sell_increment
+            self.sell_increment_changed = True
+        if buy_decrement is not None and buy_decrement != self.buy_decrement:
+            self.buy_decrement = buy_decrement
+            self.buy_decrement_changed = True
+
+    def set_volatility(self, volatility):
+        # Turns adaptive mode on (a volatility.VolatilityTracker of the symbol) or off (None), from the next order
+        if self.volatility is not None and self.market_data is not None:
+            self.market_data.remove_trade_listener(self.volatility.on_trade)
+        self.volatility = volatility
+        if volatility is not None and self.market_data is not None:
+            self.market_data.add_trade_listener(volatility.on_trade)
+
+    def exchange_clock(self):
+        # Seconds on the exchange clock, the replay clock for simulations and paper trading on recorded prices
+        if self.exchange is None:
+            return time.time()
+        return self.exchange.time() / 1000.0
+
+    def next_sell_increment(self):
+        # Distance of the next sell from the last buy: the sell increment, or in adaptive mode the volatility, with
+        # the sell increment as floor, see volatility.py
+        if self.volatility is None:
+            return self.sell_increment
+        return self.volatility.increment(self.sell_increment)
+
+    def next_buy_decrement(self):
+        if self.volatility is None:
+            return self.buy_decrement
+        return self.volatility.increment(self.buy_decrement)
+
+    def order_distance(self):
+        # How far the market is from the open order, in grid steps (sell increments for sells, buy decrements for
+        # buys, as far as the volatility says in adaptive mode, like the order was priced). None if it isn't known.
+        order_id = self.get_last_order()
+        if order_id is None or self.market_data is None:
+            return None
+        order = self.order_tracker.last_known(order_id)
+        price = self.market_data.price(self.symbol)
+        if order is None or price is None:
+            return None
+        step = self.next_sell_increment() if order['side'] == 'SELL' else self.next_buy_decrement()
+        if step <= 0:
+            return None
+        return abs(price - float(order['price'])) / step
+
+    def tick_interval(self):
+        # Seconds to the next tick: right away with an order to place, the longest with trading off, in between
+        # the closer the price is to the open order the sooner. Fills from the user data stream wake the loop up
+        # anyway, this is how long a fill can go unnoticed without it.
+        state = self.trading_state
+        if state in (self.INIT, self.WAITING):
+            return self.max_tick_interval
+        if state in (self.BOUGHT, self.SOLD):
+            return self.min_tick_interval
+        distance = self.order_distance()
+        if distance is None:
+            return self.default_tick_interval
+        # From the minimum at the order price to the maximum a whole step away
+        return self.min_tick_interval + (self.max_tick_interval - self.min_tick_interval) * min(1.0, distance)
+
+    async def call(self, function, *args, **kwargs):
+        # Exchange calls run on the loop thread pool, so that independent calls (and other strategies) go on at
+        # the same time. Exchanges that don't block (simulations) are called directly.
+        if not self.exchange.blocking:
+            return function(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    async def get_order(self, order_id):
+        # Served from the user data stream when possible, see OrderTracker
+        order = self.order_tracker.get_cached(order_id)
+        if order is None:
+            self.order_tracker.polls += 1
+            order = await self.call(self.exchange.get_order, symbol=self.symbol, orderId=str(order_id))
+            self.order_tracker.update(order)
+        return order
+
+    async def top_of_book(self):
+        # Best bid and ask from the market data stream. Without a fresh quote, the last price from a REST call is
+        # used for both.
+        quote = self.market_data.get(self.symbol) if self.market_data is not None else None
+        if quote is not None and quote.bid is not None:
+            return quote.bid, quote.ask
+        ticker = await self.call(self.exchange.get_symbol_ticker, symbol=self.symbol)
+        price = float(ticker['price'])
+        return price, price
+
+    async def get_free_balance(self, asset):
+        balance = await self.call(self.exchange.get_asset_balance, asset=asset)
+        return float(balance['free'])
+
+    def buy_quantity(self, quote_balance, price):
+        self.log("Current %s balance is: %s", self.quote_asset, quote_balance)
+        rounded_quote_balance = quote_balance - 1  # I'll leave 1 dollar on the balance just to have a little margin
+        if self.budget is not None:
+            rounded_quote_balance = min(rounded_quote_balance, self.budget)
+        self.log("I can spend: %s", rounded_quote_balance)
+        base_to_buy = rounded_quote_balance / price
+        self.log("I want to buy %s %s", base_to_buy, self.base_asset)
+        # Rounded to the lot size by build_order
+        return base_to_buy
+
+    def sell_quantity(self, base_to_sell, bought_order):
+        self.log("Current %s balance is: %s", self.base_asset, base_to_sell)
+        if self.budget is not None:
+            # Only what this strategy bought. If more strategies share the base asset, fees should be paid in
+            # BNB, otherwise they eat into each other's balance.
+            base_to_sell = min(base_to_sell, float(bought_order['executedQty']))
+        self.log("I want to sell %s %s", base_to_sell, self.base_asset)
+        # Rounded to the lot size by build_order
+        return base_to_sell
+
+    async def symbol_filters(self):
+        # Loaded from the exchange once every refresh interval
+        filters = self.order_builder.get(self.symbol)
+        if filters is None:
+            filters = await self.load_symbol_filters()
+        return filters
+
+    async def load_symbol_filters(self):
+        # If that fails the old ones are kept. Also called ahead of time by the main loop, so that placing an order
+        # doesn't wait for them.
+        try:
+            symbol_info = await self.call(self.exchange.get_symbol_info, symbol=self.symbol)
+            return self.order_builder.store(self.symbol, symbol_info)
+        except Exception as e:
+            filters = self.order_builder.get(self.symbol, fresh=False)
+            if filters is None:
+                raise
+            self.log("Couldn't refresh the %s trading rules, keeping the old ones: %s", self.symbol, e)
+            return filters
+
+    async def build_order(self, side, quantity, price):
+        # Quantity and price rounded to the trading rules of the symbol, as strings. Raises InvalidOrder instead of
+        # sending an order Binance would reject.
+        filters = await self.symbol_filters()
+        return filters.build(side, quantity, price)
+
+    async def replace_order(self, order, side, quantity, price):
+        # Moves a resting order to a new price and quantity in a single step, see Exchange.cancel_replace_order.
+        # Any order can be replaced (ladder levels too), the caller keeps track of the new orderId.
+        # Returns the new order and the time it took, end to end.
+        start = time.perf_counter()
+        canceled, new_order = await self.call(self.exchange.cancel_replace_order,
+                                              symbol=self.symbol,
+                                              orderId=order['orderId'],
+                                              side=side,
+                                              quantity=quantity,
+                                              price=price)
+        elapsed = time.perf_counter() - start
+        self.order_tracker.forget(canceled['orderId'])
+        self.order_placed(new_order)
+        if self.metrics is not None:
+            self.metrics.observe('cancel_replace_seconds', elapsed)
+        self.log("Order %s replaced in %.1f ms:\n\t%s", canceled['orderId'], elapsed * 1000, new_order,
+                 orderId=new_order['orderId'], replaced_orderId=canceled['orderId'], latency_ms=elapsed * 1000)
+        return new_order, elapsed
+
+    async def reprice_last_order(self, last_order):
+        # Replaces the open order with one at the price the current increments give from the penultimate order
+        # (in adaptive mode the volatility, like a new order), the state doesn't change. A buy spends the same
+        # amount of quote asset, a sell sells the same quantity.
+        penultimate_order = await self.get_order(self.get_penultimate_order())
+        if last_order['side'] == 'BUY':
+            price = float(penultimate_order['price']) - self.next_buy_decrement()
+            quote_quantity = float(last_order['origQty']) * float(last_order['price'])
+            quantity = quote_quantity / price
+        else:
+            price = float(penultimate_order['price']) + self.next_sell_increment()
+            quantity = last_order['origQty']
+        quantity, price = await self.build_order(last_order['side'], quantity, price)
+        self.log("New price: %s, quantity: %s", price, quantity)
+        new_order, elapsed = await self.replace_order(last_order, last_order['side'], quantity, price)
+        self.last_two_orders[1] = new_order['orderId']
+        return new_order, elapsed
+
+    async def replace_failed(self, order, previous_state):
+        # Without an atomic endpoint the cancel can go through and the new order fail: then it goes back in time
+        # of one step, the penultimate order becomes the last and the order is placed again at the next tick.
+        try:
+            order = await self.call(self.exchange.get_order, symbol=self.symbol, orderId=str(order['orderId']))
+            self.order_tracker.update(order)
+        except Exception as e:
+            self.log("Exception while checking the order after a failed replace: %s", e)
+            return
+        if order['status'] == 'CANCELED':
+            self.order_tracker.forget(order['orderId'])
+            self.last_two_orders[1] = self.last_two_orders[0]
+            self.last_two_orders[0] = None
+            self.trading_state = previous_state
+            self.log("The order was canceled, state changed back to %s", previous_state)
+
+    async def start_trading(self):
+        # Starts automated trading with a first buy order at market price
+        try:
+            self.log("I'm going to place a buy order")
+            (bid, ask), quote_balance = await asyncio.gather(self.top_of_book(),
+                                                             self.get_free_balance(self.quote_asset))
+            self.log("Current %s best ask is: %s", self.symbol, ask)
+            # At the best ask the order goes through at once
+            base_to_buy = self.buy_quantity(quote_balance, ask)
+            try:
+                base_to_buy, price = await self.build_order('BUY', base_to_buy, ask)
+                self.log("I will actually send a request for buying (rounded): %s at %s", base_to_buy, price)
+                last_placed_order = await self.call(self.exchange.order_limit_buy,
+                                                    symbol=self.symbol,
+                                                    quantity=base_to_buy,
+                                                    price=price)
+                self.set_last_order(last_placed_order['orderId'])
+                self.order_placed(last_placed_order)
+                self.log("The order went fine, here it is:\n\t%s", last_placed_order,
+                         orderId=last_placed_order['orderId'])
+                if last_placed_order['status'] == 'FILLED':
+                    self.trading_state = self.BOUGHT
+                    self.fill_detected(last_placed_order)
+                    self.log("State changed to BOUGHT")
+                    message = ("*Buy order successfully placed and filled*:\n"
+                               + self.order_info_to_str(last_placed_order))
+                    self.notify(message, fill=last_placed_order)
+                else:
+                    self.trading_state = self.BUY_PLACED
+                    self.log("State changed to BUY_PLACED")
+                    message = ("*Buy order sucessfully placed*:\n"
+                               + self.order_info_to_str(last_placed_order))
+                    self.notify(message)
+            except Exception as e:
+                self.log("Exception while placing order: %s", e)
+                self.exception_swallowed('start_trading')
+                message = ("*Error while placing order*!\nError message: " + str(e) +
+                           "\n\n*Automated trading stopped*.")
+                self.notify(message)
+                self.trading_state = self.WAITING
+
+        except Exception as e:
+            self.log("Exception from exchange: %s", e)
+            self.exception_swallowed('start_trading')
+            message = ("*Error from Binance*!\nError message: " + str(e) + "\n\n*Automated trading stopped*.")
+            self.notify(message)
+            self.trading_state = self.WAITING
+        self.checkpoint()
+
+    def stop_trading(self):
+        # Any open order is left on the exchange
+        self.trading_state = self.WAITING
+        self.checkpoint()
+
+    async def tick(self):
+        # One iteration of the main loop
+        state = self.trading_state
+
+        if state == self.INIT:
+            self.init_function()
+            self.buy_decrement_changed = False
+            self.sell_increment_changed = False
+
+        elif state == self.WAITING:
+            self.waiting_function()
+            self.buy_decrement_changed = False
+            self.sell_increment_changed = False
+
+        elif state == self.BUY_PLACED:
+            await self.buy_placed_function()
+            self.sell_increment_changed = False
+            # Here I don't reset buy_decrement because in this state I WANT to know if it is necessary to
+            # change an order
+
+        elif state == self.BOUGHT:
+            await self.bought_function()
+            self.buy_decrement_changed = False
+            self.sell_increment_changed = False
+
+        elif state == self.SELL_PLACED:
+            await self.sell_placed_function()
+            self.buy_decrement_changed = False
+            # Here I don't reset sell_increment because in this state I WANT to know if it is necessary to
+            # change an order
+
+        elif state == self.SOLD:
+            await self.sold_function()
+            self.buy_decrement_changed = False
+            self.sell_increment_changed = False
+
+        self.checkpoint()
+
+    # MAIN LOOP FUNCTIONS
+    #
+    # Orders possible states:
+    #     NEW
+    #     PARTIALLY_FILLED
+    #     FILLED
+    #     CANCELED
+    #     PENDING_CANCEL(currently unused)
+    #     REJECTED
+    #     EXPIRED
+
+    def init_function(self):
+        # Nothing to do here
+        pass
+
+    def waiting_function(self):
+        # Nothing to do here as well
+        pass
+
+    async def buy_placed_function(self):
+        # Gets last placed order and checks if it
+        try:
+            last_order = await self.get_order(self.get_last_order())
+            last_order_status = last_order['status']
+            if last_order_status == 'FILLED':
+                self.trading_state = self.BOUGHT
+                self.log("Order filled: %s", last_order, orderId=last_order['orderId'])
+                self.fill_detected(last_order)
+                self.log("State changed to BOUGHT")
+                message = ("*Buy order successfully filled*:\n" + self.order_info_to_str(last_order))
+                self.notify(message, fill=last_order)
+            elif last_order_status == 'NEW':
+                # The order is present, but yet to be filled
+                if self.buy_decrement_changed:
+                    try:
+                        if self.get_penultimate_order() is None:
+                            # First buy, placed at market price: nothing to re-price it from
+                            message = ("The buy decrement has been changed, it will be used from the next buy "
+                                       + "order (the current one was placed at market price).")
+                            self.notify(message)
+                        else:
+                            message = ("The buy decrement has been changed, so *I'll try to modify the current open buy order*.")
+                            self.notify(message)
+                            self.log("Buy decrement changed, I need to replace the current buy open order")
+                            new_order, elapsed = await self.reprice_last_order(last_order)
+                            message = ("*Buy order modified* in " + "{:.0f}".format(elapsed * 1000) + " ms:\n"
+                                       + self.order_info_to_str(new_order))
+                            self.notify(message)
+                    except Exception as e:
+                        self.log("Error while trying to change current open order: %s", e)
+                        self.exception_swallowed('buy_placed_function')
+                        message = ("Since you changed the buy decrement, I tried to modify the current open buy "
+                                   + " order, but *something went wrong and I couldn't do it*.")
+                        self.notify(message)
+                        await self.replace_failed(last_order, self.SOLD)
+                    finally:
+                        self.buy_decrement_changed = False
+            elif last_order_status == 'PARTIALLY_FILLED':
+                # The order is present, has been partially filled and I can only wait
+                pass
+            else:
+                # Any other state
+                self.trading_state = self.WAITING
+                self.log("Last order has a state not expected: %s", last_order, orderId=last_order['orderId'])
+                self.log("State changed to WAITING")
+                message = ("*Error!*\nThere's something wrong with my last order."
+                           + "Maybe you canceled the order from the Binance site? Maybe Binance rejected it?\n"
+                           + "Here's the order in question:\n" + self.order_info_to_str(last_order)
+                           + "\n\nYou should take a look at your Binance trading page and see what happend."
+                           + "\nSince I don't know what's going on, *I stopped the automated trading*")
+                self.notify(message)
+        except Exception as e:
+            self.log("Exception while checking last order: %s", e)
+            self.exception_swallowed('buy_placed_function')
+
+    async def bought_function(self):
+        try:
+            # Now I have to schedule a new sell order
+            self.log("I'm going to place the next sell order")
+            sell_increment = self.next_sell_increment()
+            last_order, base_balance = await asyncio.gather(self.get_order(self.get_last_order()),
+                                                            self.get_free_balance(self.base_asset))
+            last_bought_price = float(last_order['price'])
+            next_sell_price = last_bought_price + sell_increment
+            base_to_sell = self.sell_quantity(base_balance, last_order)
+            base_to_sell, next_sell_price = await self.build_order('SELL', base_to_sell, next_sell_price)
+            self.log("The price I want to sell at is: %s", next_sell_price, sell_increment=sell_increment)
+            self.log("I will actually send a request for selling (rounded): %s", base_to_sell)
+            last_placed_order = await self.call(self.exchange.order_limit_sell,
+                                                symbol=self.symbol,
+                                                quantity=base_to_sell,
+                                                price=next_sell_price)
+            self.set_last_order(last_placed_order['orderId'])
+            self.order_placed(last_placed_order)
+            self.log("The order went fine, here it is:\n\t%s", last_placed_order, orderId=last_placed_order['orderId'])
+            self.trading_state = self.SELL_PLACED
+            self.log("State changed to SELL_PLACED")
+            message = ("I'm going to sell again at $" + str(last_bought_price) + " + $" + str(sell_increment)
+                    + " = $" + next_sell_price + ".\n"
+                    + "*Sell order successfully placed*:\n" + self.order_info_to_str(last_placed_order))
+            self.notify(message)
+        except Exception as e:
+            self.log("Exception while placing next sell order: %s", e)
+            self.exception_swallowed('bought_function')
+
+    async def sell_placed_function(self):
+        # Get last placed order
+        try:
+            last_order = await self.get_order(self.get_last_order())
+            last_order_status = last_order['status']
+            if last_order_status == 'FILLED':
+                self.trading_state = self.SOLD
+                self.log("Order filled: %s", last_order, orderId=last_order['orderId'])
+                self.fill_detected(last_order)
+                self.log("State changed to SOLD")
+                message = ("*Sell order successfully filled*:\n" + self.order_info_to_str(last_order))
+                self.notify(message, fill=last_order)
+            elif last_order_status == 'NEW':
+                # The order is present, but yet to be filled
+                if self.sell_increment_changed:
+                    try:
+                        message = ("The sell increment has been changed, so *I'll try to modify the current open sell order*.")
+                        self.notify(message)
+                        self.log("Sell increment changed, I need to replace the current sell open order")
+                        new_order, elapsed = await self.reprice_last_order(last_order)
+                        message = ("*Sell order modified* in " + "{:.0f}".format(elapsed * 1000) + " ms:\n"
+                                   + self.order_info_to_str(new_order))
+                        self.notify(message)
+                    except Exception as e:
+                        self.log("Error while trying to change current open sell order: %s", e)
+                        self.exception_swallowed('sell_placed_function')
+                        message = ("I tried to modify the current open sell "
+                                   + " order, but *something went wrong and I couldn't do it*.")
+                        self.notify(message)
+                        await self.replace_failed(last_order, self.BOUGHT)
+                    finally:
+                        self.sell_increment_changed = False
+            elif last_order_status == 'PARTIALLY_FILLED':
+                # The order is present, has been partially filled and I can only wait
+                pass
+            else:
+                # Any other state
+                self.trading_state = self.WAITING
+                self.log("Last order has a state not expected: %s", last_order, orderId=last_order['orderId'])
+                self.log("State changed to WAITING")
+                message = ("*Error!*\nThere's something wrong with my last order."
+                           + "Maybe you canceled the order from the Binance site?  Maybe Binance rejected it?\n"
+                           + "Here's the order in question:\n" + self.order_info_to_str(last_order)
+                           + "\n\nYou should take a look at your Binance trading page and see what happend."
+                           + "\nSince I don't know what's going on, *I stopped the automated trading*.")
+                self.notify(message)
+        except Exception as e:
+            self.log("Exception while checking last order: %s", e)
+            self.exception_swallowed('sell_placed_function')
+
+    async def sold_function(self):
+        try:
+            # Now I have to schedule a new buy order
+
+            last_order, quote_balance = await asyncio.gather(self.get_order(self.get_last_order()),
+                                                             self.get_free_balance(self.quote_asset))
+            last_sold_price = float(last_order['price'])
+            buy_decrement = self.next_buy_decrement()
+            next_buy_price = last_sold_price - buy_decrement
+            self.log("I want to buy at: %s", next_buy_price, buy_decrement=buy_decrement)
+            base_to_buy = self.buy_quantity(quote_balance, next_buy_price)
+            base_to_buy, next_buy_price = await self.build_order('BUY', base_to_buy, next_buy_price)
+            self.log("I will actually send a request for buying (rounded): %s at %s", base_to_buy, next_buy_price)
+            last_placed_order = await self.call(self.exchange.order_limit_buy,
+                                                symbol=self.symbol,
+                                                quantity=base_to_buy,
+                                                price=next_buy_price)
+            self.set_last_order(last_placed_order['orderId'])
+            self.order_placed(last_placed_order)
+            self.log("The order went fine, here it is:\n\t%s", last_placed_order, orderId=last_placed_order['orderId'])
+            self.trading_state = self.BUY_PLACED
+            self.log("State changed to BUY_PLACED")
+            message = ("I'm going to buy again at $" + str(last_sold_price) + " - $" + str(buy_decrement)
+                    + " = $" + next_buy_price + ".\n"
+                    + "*Buy order successfully placed*:\n" + self.order_info_to_str(last_placed_order))
+            self.notify(message)
+        except Exception as e:
+            self.log("Exception while placing next buy order: %s", e)
+            self.exception_swallowed('sold_function')
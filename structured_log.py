@@ -0,0 +1,148 @@
+# Structured logging
+#
+# Every log line of the bot goes to the 'trader' logger (see get_logger) as a record with fields: the strategy,
+# its state, orderId, latency_ms... Once setup has been called, records are only put on a queue by the trading
+# code, a writer thread (logging.handlers.QueueListener) formats and writes them:
+#
+#   console     the usual "time:  message" lines
+#   log file    one JSON object per line, e.g.
+#                   {"time": "2021-03-01T10:00:00.123", "level": "INFO", "logger": "trader.strategy",
+#                    "message": "Order filled", "strategy": "LTCUSDT", "state": "BUY_PLACED", "orderId": 123}
+#               rotated every max_bytes, old files are compressed with gzip (bot.log.1.gz, bot.log.2.gz...) by the
+#               writer thread too, backup_count of them are kept.
+#
+# Messages are formatted lazily: log("Order placed: %s", order) builds the string only if the record is written,
+# in the writer thread. Values passed this way must not change afterwards (orders from the exchange never do).
+#
+# Until setup is called (scripts, backtests...) records are printed right away, like they used to.
+#
+# Months of activity can be searched with e.g.:
+#     zcat -f logs/bot.log* | jq -c 'select(.orderId == 123)'
+
+import atexit
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+from datetime import datetime
+
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 100
+
+
+class ConsoleFormatter(logging.Formatter):
+
+    def format(self, record):
+        text = str(datetime.fromtimestamp(record.created)) + ':  ' + record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            text += '\n' + record.exc_text
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        # Unlike QueueHandler, the message is left to the writer thread. Only tracebacks are formatted here, the
+        # frames they refer to will be gone.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def gzip_rotator(source, destination):
+    with open(source, 'rb') as source_file, gzip.open(destination, 'wb') as destination_file:
+        shutil.copyfileobj(source_file, destination_file)
+    os.remove(source)
+
+
+def compressed_file_handler(path, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                   encoding='utf-8')
+    handler.namer = lambda name: name + '.gz'
+    handler.rotator = gzip_rotator
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def console_handler():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(ConsoleFormatter())
+    return handler
+
+
+# Root of the loggers of the bot, printing right away until setup is called
+root_logger = logging.getLogger('trader')
+root_logger.setLevel(logging.INFO)
+root_logger.propagate = False
+root_logger.addHandler(console_handler())
+
+listener = None
+
+
+def get_logger(name):
+    return logging.getLogger('trader.' + name)
+
+
+def setup(path=None, level=logging.INFO, console=True, max_bytes=DEFAULT_MAX_BYTES,
+          backup_count=DEFAULT_BACKUP_COUNT):
+    # Moves the handlers to the writer thread: JSON lines in path, if any, and the console. Can be called again
+    # to change them.
+    global listener
+    stop()
+    handlers = []
+    if console:
+        handlers.append(console_handler())
+    if path is not None:
+        handlers.append(compressed_file_handler(path, max_bytes, backup_count))
+    records = queue.SimpleQueue()
+    replace_handler(LazyQueueHandler(records))
+    root_logger.setLevel(level)
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop():
+    # Writes what's still queued and closes the files, records are printed right away again
+    global listener
+    if listener is not None:
+        replace_handler(console_handler())
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+
+
+def replace_handler(handler):
+    for old_handler in list(root_logger.handlers):
+        root_logger.removeHandler(old_handler)
+    root_logger.addHandler(handler)
+
+
+atexit.register(stop)
@@ -0,0 +1,5 @@
+# The bot's modules sit next to bot.py, one directory up
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
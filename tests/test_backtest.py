@@ -0,0 +1,64 @@
+# Backtest: the grid cycle replayed on bars
+
+import numpy as np
+import pytest
+
+from backtest import Prices, find_fill, run_backtest
+
+
+def bars(*rows):
+    # (low, high, close) per bar, a minute apart
+    low, high, close = zip(*rows)
+    return Prices(np.arange(len(rows)) * 60000, low, high, close)
+
+
+def test_grid_cycle():
+    prices = bars((59.0, 61.0, 60.0),     # market buy at the close, 60
+                  (59.5, 60.5, 60.0),
+                  (60.0, 61.2, 61.0),     # sell at 61
+                  (60.5, 62.0, 61.0),
+                  (59.9, 61.0, 60.0),     # buy at 60
+                  (60.0, 60.5, 60.2))
+    result = run_backtest(prices, sell_increment=1.0, buy_decrement=1.0, initial_usdt=1000.0, fee=0.001)
+    # The sell placed on the first bar isn't filled by the first bar's high
+    assert result.fill_indexes == [0, 2, 4]
+    assert result.fill_sides == ['BUY', 'SELL', 'BUY']
+    assert result.fill_prices == [60.0, 61.0, 60.0]
+    assert result.open_order == ('SELL', 61.0)
+    assert result.round_trips == 1
+    # Held from bar 0 to 2, then from bar 4 to the end
+    assert result.time_in_position == 2 * 60000 + 1 * 60000
+    assert result.pnl > 0
+
+
+def test_first_buy_fills_on_a_rising_market():
+    prices = bars((60.0, 61.0, 60.5), (61.0, 62.0, 61.5), (62.0, 63.0, 62.5))
+    result = run_backtest(prices, sell_increment=10.0, buy_decrement=1.0)
+    assert result.fill_indexes == [0]
+    assert result.fill_prices == [60.5]
+    assert result.open_order == ('SELL', 70.5)
+
+
+def test_quantities_and_fees_like_the_bot():
+    prices = bars((60.0, 60.0, 60.0), (61.0, 61.0, 61.0))
+    result = run_backtest(prices, sell_increment=1.0, buy_decrement=1.0, initial_usdt=61.0, fee=0.001)
+    assert result.fill_sides == ['BUY', 'SELL']
+    # All the USDT minus 1$ and all the LTC, rounded down to 5 decimals, fees taken from what's received
+    bought = 0.99999
+    sold = 0.99898
+    assert result.ltc == pytest.approx(bought * 0.999 - sold)
+    assert result.usdt == pytest.approx(61.0 - bought * 60.0 + sold * 61.0 * 0.999)
+
+
+def test_no_money_no_trades():
+    result = run_backtest(bars((59.0, 61.0, 60.0), (59.0, 61.0, 60.0)), 1.0, 1.0, initial_usdt=0.5)
+    assert result.trades == 0
+    assert result.pnl == 0.0
+
+
+def test_find_fill_beyond_the_first_windows():
+    series = np.full(10000, 60.0)
+    series[7000] = 50.0
+    assert find_fill(series, 0, 55.0, above=False) == 7000
+    assert find_fill(series, 7001, 55.0, above=False) == -1
+    assert find_fill(series, 0, 60.0, above=True) == 0
@@ -0,0 +1,90 @@
+# Settings file: validation, diffs and reloads
+
+import os
+
+import pytest
+
+import config
+from config import ConfigError, ConfigWatcher, diff, parse_settings
+
+
+def test_defaults_are_filled_in():
+    settings = parse_settings({'sell_increment': '1.5', 'buy_decrement': ' 2 '})
+    assert settings['sell_increment'] == 1.5
+    assert settings['buy_decrement'] == 2.0
+    assert settings['adaptive'] is False
+    assert settings['paper'] is False
+    assert settings['token'] is None
+
+
+def test_every_problem_is_listed():
+    with pytest.raises(ConfigError) as error:
+        parse_settings({'sell_incremnet': '1.0', 'buy_decrement': '-1', 'adaptive': 'maybe'})
+    message = str(error.value)
+    assert 'sell_incremnet: unknown setting' in message
+    assert 'sell_increment: missing' in message
+    assert 'buy_decrement: -1 is not allowed (positive)' in message
+    assert 'adaptive: wrong format' in message
+
+
+def test_diff_lists_only_the_changes():
+    old = parse_settings({'sell_increment': '1.0', 'buy_decrement': '1.0'})
+    new = parse_settings({'sell_increment': '1.0', 'buy_decrement': '2.0', 'adaptive': 'yes'})
+    assert diff(old, new) == {'buy_decrement': (1.0, 2.0), 'adaptive': (False, True)}
+    assert diff(new, new) == {}
+
+
+def test_saved_settings_load_back(tmp_path):
+    path = str(tmp_path / 'settings')
+    settings = parse_settings({'sell_increment': '1.0', 'buy_decrement': '1.0', 'paper': 'true',
+                               'admin_id': '42'})
+    config.save_settings(path, settings)
+    assert config.load_settings(path) == settings
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_missing_file_is_a_config_error(tmp_path):
+    with pytest.raises(ConfigError):
+        config.load_settings(str(tmp_path / 'settings'))
+
+
+def write(path, text):
+    with open(path, 'w') as settings_file:
+        settings_file.write("[SETTINGS]\n" + text)
+    # A new modification time even on coarse clocks
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_watcher_reports_changes_once(tmp_path):
+    path = str(tmp_path / 'settings')
+    write(path, "sell_increment = 1.0\nbuy_decrement = 1.0\n")
+    watcher = ConfigWatcher(path)
+    assert watcher.check() == {}
+    write(path, "sell_increment = 2.0\nbuy_decrement = 1.0\n")
+    assert watcher.check() == {'sell_increment': (1.0, 2.0)}
+    assert watcher.check() == {}
+
+
+def test_watcher_keeps_the_running_settings_on_a_bad_file(tmp_path):
+    path = str(tmp_path / 'settings')
+    write(path, "sell_increment = 1.0\nbuy_decrement = 1.0\n")
+    watcher = ConfigWatcher(path)
+    write(path, "sell_increment = zero\nbuy_decrement = 1.0\n")
+    with pytest.raises(ConfigError):
+        watcher.check()
+    assert watcher.check() == {}
+    assert watcher.settings['sell_increment'] == 1.0
+
+
+def test_watcher_save_validates_before_writing(tmp_path):
+    path = str(tmp_path / 'settings')
+    write(path, "sell_increment = 1.0\nbuy_decrement = 1.0\n")
+    watcher = ConfigWatcher(path)
+    with pytest.raises(ConfigError):
+        watcher.save(sell_increment=-1.0)
+    assert config.load_settings(path)['sell_increment'] == 1.0
+    assert watcher.save(sell_increment=3.0) == {'sell_increment': (1.0, 3.0)}
+    assert config.load_settings(path)['sell_increment'] == 3.0
+    # The watcher's own writes aren't reported as changes
+    assert watcher.check() == {}
@@ -0,0 +1,72 @@
+# SimulatedExchange: fills, fees, locked balances and filters
+
+import pytest
+
+from exchange import PriceFeed, SimulatedExchange, SimulatedExchangeError, ThroughFillModel
+
+
+def balance(exchange, asset):
+    result = exchange.get_asset_balance(asset)
+    return float(result['free']), float(result['locked'])
+
+
+def test_resting_buy_is_filled_at_its_price():
+    exchange = SimulatedExchange(PriceFeed([60.0, 55.0, 49.0]), balances={'USDT': 100.0}, fee=0.001)
+    order = exchange.order_limit_buy('LTCUSDT', '1.00000', '50.00')
+    assert order['status'] == 'NEW'
+    assert balance(exchange, 'USDT') == (50.0, 50.0)
+    exchange.advance()
+    assert exchange.get_order('LTCUSDT', order['orderId'])['status'] == 'NEW'
+    exchange.advance()
+    order = exchange.get_order('LTCUSDT', order['orderId'])
+    assert order['status'] == 'FILLED'
+    assert float(order['cummulativeQuoteQty']) == 50.0
+    assert balance(exchange, 'USDT') == (50.0, 0.0)
+    # The fee is taken from the received asset
+    assert balance(exchange, 'LTC') == pytest.approx((0.999, 0.0))
+
+
+def test_marketable_order_is_filled_at_the_market_price():
+    exchange = SimulatedExchange(PriceFeed([60.0]), balances={'LTC': 1.0}, fee=0.0)
+    order = exchange.order_limit_sell('LTCUSDT', '1.00000', '55.00')
+    assert order['status'] == 'FILLED'
+    assert float(order['cummulativeQuoteQty']) == 60.0
+    assert balance(exchange, 'USDT') == (60.0, 0.0)
+    assert balance(exchange, 'LTC') == (0.0, 0.0)
+
+
+def test_cancel_releases_the_balance():
+    exchange = SimulatedExchange(PriceFeed([60.0]), balances={'USDT': 100.0})
+    order = exchange.order_limit_buy('LTCUSDT', '1.00000', '50.00')
+    canceled = exchange.cancel_order('LTCUSDT', order['orderId'])
+    assert canceled['status'] == 'CANCELED'
+    assert balance(exchange, 'USDT') == (100.0, 0.0)
+    assert exchange.get_open_orders() == []
+    with pytest.raises(SimulatedExchangeError):
+        exchange.cancel_order('LTCUSDT', order['orderId'])
+
+
+def test_insufficient_balance_is_rejected():
+    exchange = SimulatedExchange(PriceFeed([60.0]), balances={'USDT': 10.0})
+    with pytest.raises(SimulatedExchangeError) as error:
+        exchange.order_limit_buy('LTCUSDT', '1.00000', '50.00')
+    assert error.value.code == -2010
+
+
+def test_filters_are_checked_like_binance():
+    exchange = SimulatedExchange(PriceFeed([60.0]))
+    # Price off the tick, quantity off the step, value below the minimum
+    for quantity, price in (('1.00000', '50.005'), ('1.000001', '50.00'), ('0.10000', '50.00')):
+        with pytest.raises(SimulatedExchangeError) as error:
+            exchange.order_limit_buy('LTCUSDT', quantity, price)
+        assert error.value.code == -1013
+
+
+def test_through_fill_model_needs_the_price_beyond_the_order():
+    exchange = SimulatedExchange(PriceFeed([60.0, 50.0, 49.5]), fill_model=ThroughFillModel(0.5))
+    order = exchange.order_limit_buy('LTCUSDT', '1.00000', '50.00')
+    exchange.advance()
+    assert exchange.get_order('LTCUSDT', order['orderId'])['status'] == 'NEW'
+    exchange.advance()
+    assert exchange.get_order('LTCUSDT', order['orderId'])['status'] == 'FILLED'
+    assert not exchange.advance()
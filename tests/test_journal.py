@@ -0,0 +1,137 @@
+# Journal: write-ahead log, snapshots and recovery after a crash
+
+import asyncio
+import json
+
+from exchange import PriceFeed, SimulatedExchange
+from journal import Journal
+from order_stream import OrderTracker
+from strategy import GridStrategy
+
+
+def journal_at(tmp_path, **kwargs):
+    # Written only by flush and close, as if the writer thread were slow
+    return Journal(str(tmp_path / 'journal'), sync_interval=3600, **kwargs)
+
+
+def test_latest_record_of_every_strategy_is_recovered(tmp_path):
+    journal = journal_at(tmp_path)
+    journal.recover()
+    journal.start()
+    journal.record('a', {'state': 2, 'orders': [None, 1]})
+    journal.record('b', {'state': 2, 'orders': [None, 2]})
+    journal.record('a', {'state': 4, 'orders': [1, 3]})
+    journal.close()
+    recovered = journal_at(tmp_path).recover()
+    assert recovered['a']['state'] == 4
+    assert recovered['a']['orders'] == [1, 3]
+    assert recovered['b']['orders'] == [None, 2]
+
+
+def test_records_not_written_yet_are_lost(tmp_path):
+    journal = journal_at(tmp_path)
+    journal.start()
+    journal.record('a', {'state': 2, 'orders': [None, 1]})
+    journal.flush()
+    # Crash: never closed
+    journal.record('a', {'state': 4, 'orders': [1, 3]})
+    assert journal_at(tmp_path).recover()['a']['state'] == 2
+    journal.close()
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    journal = journal_at(tmp_path)
+    journal.start()
+    journal.record('a', {'state': 2, 'orders': [None, 1]})
+    journal.close()
+    with open(str(tmp_path / 'journal.wal'), 'a') as wal_file:
+        wal_file.write('{"seq": 2, "name": "a", "sta')
+    recovered = journal_at(tmp_path).recover()
+    assert recovered['a']['state'] == 2
+
+
+def test_snapshot_starts_the_log_over(tmp_path):
+    journal = journal_at(tmp_path, snapshot_every=3)
+    journal.start()
+    for order_id in range(1, 5):
+        journal.record('a', {'state': 2, 'orders': [None, order_id]})
+    journal.flush()
+    with open(str(tmp_path / 'journal.wal')) as wal_file:
+        assert wal_file.read() == ''
+    journal.record('b', {'state': 2, 'orders': [None, 5]})
+    journal.close()
+    recovered = journal_at(tmp_path).recover()
+    assert recovered['a']['orders'] == [None, 4]
+    assert recovered['b']['orders'] == [None, 5]
+
+
+def test_log_records_already_in_the_snapshot_are_skipped(tmp_path):
+    # Crash between the snapshot and the log truncation
+    with open(str(tmp_path / 'journal.snapshot'), 'w') as snapshot_file:
+        json.dump({'seq': 2, 'strategies': {'a': {'name': 'a', 'seq': 2, 'state': 4, 'orders': [1, 2]}}},
+                  snapshot_file)
+    with open(str(tmp_path / 'journal.wal'), 'w') as wal_file:
+        for seq, state in ((1, 2), (2, 4), (3, 5)):
+            wal_file.write(json.dumps({'name': 'a', 'seq': seq, 'state': state, 'orders': [1, 2]}) + '\n')
+    journal = journal_at(tmp_path)
+    assert journal.recover()['a']['state'] == 5
+    # Numbering goes on from the last record
+    journal.start()
+    journal.record('a', {'state': 2, 'orders': [2, 3]})
+    journal.close()
+    assert journal_at(tmp_path).recover()['a']['seq'] == 4
+
+
+def strategy(exchange, journal):
+    # Every order check goes to the exchange
+    grid = GridStrategy(exchange=exchange, journal=journal, budget=100, order_tracker=OrderTracker(poll_interval=0.0))
+    grid.debug = False
+    return grid
+
+
+def test_strategy_picks_up_its_open_order_after_a_crash(tmp_path):
+    exchange = SimulatedExchange(PriceFeed([60.0, 60.5, 61.5]), balances={'USDT': 1000.0})
+    journal = journal_at(tmp_path)
+    journal.recover()
+    journal.start()
+    grid = strategy(exchange, journal)
+    asyncio.run(grid.start_trading())
+    asyncio.run(grid.tick())
+    assert grid.trading_state == GridStrategy.SELL_PLACED
+    sell_id = grid.get_last_order()
+    journal.flush()
+
+    # Restart: the open sell is managed again and its fill is noticed
+    restarted_journal = journal_at(tmp_path)
+    restarted = strategy(exchange, restarted_journal)
+    restarted.restore(restarted_journal.recover()['LTCUSDT'])
+    assert asyncio.run(restarted.resume())
+    assert restarted.trading_state == GridStrategy.SELL_PLACED
+    assert restarted.get_last_order() == sell_id
+    exchange.advance(2)
+    asyncio.run(restarted.tick())
+    assert restarted.trading_state == GridStrategy.SOLD
+    journal.close()
+
+
+def test_strategy_adopts_an_order_placed_before_it_was_journaled(tmp_path):
+    exchange = SimulatedExchange(PriceFeed([60.0]), balances={'USDT': 1000.0})
+    journal = journal_at(tmp_path)
+    journal.start()
+    grid = strategy(exchange, journal)
+    asyncio.run(grid.start_trading())
+    buy_id = grid.get_last_order()
+    journal.flush()
+    # The sell goes out, the crash comes before the journal is written
+    asyncio.run(grid.tick())
+    sell_id = grid.get_last_order()
+
+    restarted = strategy(exchange, None)
+    restarted.restore(journal_at(tmp_path).recover()['LTCUSDT'])
+    assert restarted.recovered['orders'] == [None, buy_id]
+    assert asyncio.run(restarted.resume())
+    assert restarted.trading_state == GridStrategy.SELL_PLACED
+    assert restarted.get_last_order() == sell_id
+    # No second sell
+    assert len(exchange.get_open_orders()) == 1
+    journal.close()
@@ -0,0 +1,123 @@
+# Ladder mode: placement around the price and refill after fills
+
+import asyncio
+
+from exchange import PriceFeed, SimulatedExchange
+from ladder import Ladder, LadderStrategy
+from order_stream import OrderTracker
+
+
+def ladder_strategy(exchange, levels=3, level_budget=100.0, tracker=None):
+    # Without a stream every order check goes to the exchange
+    strategy = LadderStrategy(exchange=exchange, levels=levels, level_budget=level_budget, sell_increment=1.0,
+                              buy_decrement=1.0, order_tracker=tracker or OrderTracker(poll_interval=0.0))
+    strategy.debug = False
+    return strategy
+
+
+def levels(strategy):
+    return sorted((side, price) for side, price, quantity in strategy.ladder.orders.values())
+
+
+def test_ladder_is_placed_below_the_price():
+    exchange = SimulatedExchange(PriceFeed([60.0]), balances={'USDT': 1000.0})
+    strategy = ladder_strategy(exchange)
+    asyncio.run(strategy.start_trading())
+    assert strategy.trading_state == LadderStrategy.LADDER
+    assert levels(strategy) == [('BUY', 57.0), ('BUY', 58.0), ('BUY', 59.0)]
+    # A level budget leaves the base asset alone, no sells
+    assert strategy.ladder.lowest_sell() is None
+    assert strategy.ladder.highest_buy() == 59.0
+    assert len(exchange.get_open_orders()) == 3
+
+
+def test_sells_with_the_whole_account():
+    exchange = SimulatedExchange(PriceFeed([60.0]), balances={'USDT': 1000.0, 'LTC': 3.0})
+    strategy = ladder_strategy(exchange, level_budget=None)
+    asyncio.run(strategy.start_trading())
+    assert levels(strategy) == [('BUY', 57.0), ('BUY', 58.0), ('BUY', 59.0),
+                                ('SELL', 61.0), ('SELL', 62.0), ('SELL', 63.0)]
+
+
+def test_filled_levels_are_refilled_on_the_other_side():
+    exchange = SimulatedExchange(PriceFeed([60.0, 58.5, 61.0]), balances={'USDT': 1000.0}, fee=0.001)
+    strategy = ladder_strategy(exchange)
+    asyncio.run(strategy.start_trading())
+
+    # The buy at 59 is filled, a sell goes one increment above it with what was bought
+    exchange.advance()
+    asyncio.run(strategy.tick())
+    assert levels(strategy) == [('BUY', 57.0), ('BUY', 58.0), ('SELL', 60.0)]
+    sell_quantity = [quantity for side, price, quantity in strategy.ladder.orders.values() if side == 'SELL'][0]
+    # 100$ at 59 is 1.69491 LTC, 1.69321 once the fee is paid, both rounded down to the lot size
+    assert sell_quantity == '1.69321'
+
+    # The sell is filled, the buy at 59 is back
+    exchange.advance()
+    asyncio.run(strategy.tick())
+    assert levels(strategy) == [('BUY', 57.0), ('BUY', 58.0), ('BUY', 59.0)]
+    assert strategy.ladder.counts == {'BUY': 3, 'SELL': 0}
+    assert len(exchange.get_open_orders()) == 3
+
+
+def test_nothing_to_do_without_fills():
+    exchange = SimulatedExchange(PriceFeed([60.0, 59.5]), balances={'USDT': 1000.0})
+    strategy = ladder_strategy(exchange)
+    asyncio.run(strategy.start_trading())
+    before = levels(strategy)
+    exchange.advance()
+    asyncio.run(strategy.tick())
+    assert levels(strategy) == before
+
+
+def test_fill_from_the_stream_is_replaced_without_polling():
+    exchange = SimulatedExchange(PriceFeed([60.0, 58.5]), balances={'USDT': 1000.0})
+    tracker = OrderTracker(stale_after=60.0)
+    exchange.order_stream(tracker).start()
+    strategy = ladder_strategy(exchange, tracker=tracker)
+    asyncio.run(strategy.start_trading())
+    exchange.advance()
+    calls = exchange.calls
+    asyncio.run(strategy.tick())
+    assert ('SELL', 60.0) in levels(strategy)
+    # Only the new sell order, no order check
+    assert exchange.calls - calls == 1
+
+
+def test_canceled_level_is_not_replaced():
+    exchange = SimulatedExchange(PriceFeed([60.0]), balances={'USDT': 1000.0})
+    strategy = ladder_strategy(exchange)
+    messages = []
+    strategy.notifier = lambda strategy, message, fill: messages.append(message)
+    asyncio.run(strategy.start_trading())
+    order_id = [order_id for order_id, (side, price, quantity) in strategy.ladder.orders.items() if price == 59.0][0]
+    exchange.cancel_order('LTCUSDT', order_id)
+    asyncio.run(strategy.tick())
+    assert levels(strategy) == [('BUY', 57.0), ('BUY', 58.0)]
+    assert 'A ladder order is gone' in messages[-1]
+
+
+def test_levels_filled_while_down_are_replaced_after_a_restart():
+    exchange = SimulatedExchange(PriceFeed([60.0, 58.5]), balances={'USDT': 1000.0})
+    strategy = ladder_strategy(exchange)
+    asyncio.run(strategy.start_trading())
+    record = strategy.journal_state()
+    exchange.advance()
+
+    restarted = ladder_strategy(exchange)
+    restarted.restore(record)
+    assert asyncio.run(restarted.resume())
+    asyncio.run(restarted.tick())
+    assert levels(restarted) == [('BUY', 57.0), ('BUY', 58.0), ('SELL', 60.0)]
+
+
+def test_closest_levels_follow_the_changes():
+    ladder = Ladder()
+    ladder.add(1, 'BUY', 59.0, '1')
+    ladder.add(2, 'BUY', 58.0, '1')
+    ladder.add(3, 'SELL', 61.0, '1')
+    assert (ladder.highest_buy(), ladder.lowest_sell()) == (59.0, 61.0)
+    assert ladder.remove(1) == ('BUY', 59.0, '1')
+    ladder.remove(3)
+    assert (ladder.highest_buy(), ladder.lowest_sell()) == (58.0, None)
+    assert 2 in ladder and 1 not in ladder
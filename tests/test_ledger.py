@@ -0,0 +1,118 @@
+# Trade ledger: columns on disk, PnL summaries by period, strategy and symbol
+
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from exchange import PriceFeed, SimulatedExchange
+from ledger import FILL, ORDER, TradeLedger, format_summary, parse_period, split_symbol
+from order_stream import OrderTracker
+from strategy import GridStrategy
+
+
+def order(order_id, symbol, side, price, quantity):
+    return {'symbol': symbol, 'orderId': order_id, 'side': side, 'price': str(price), 'origQty': str(quantity),
+            'executedQty': str(quantity), 'cummulativeQuoteQty': str(price * quantity), 'status': 'FILLED'}
+
+
+def test_round_trip_by_symbol(tmp_path):
+    ledger = TradeLedger(str(tmp_path / 'ledger'), fee_rate=0.0)
+    ledger.append('ltc', ORDER, order(1, 'LTCUSDT', 'BUY', 60.0, 2.0), event_time=1000)
+    ledger.append('ltc', FILL, order(1, 'LTCUSDT', 'BUY', 60.0, 2.0), event_time=1000)
+    ledger.append('ltc', FILL, order(2, 'LTCUSDT', 'SELL', 62.0, 1.0), event_time=2000)
+    ledger.append('btc', FILL, order(3, 'BTCUSDT', 'BUY', 30000.0, 0.01), event_time=3000)
+    ledger.close()
+
+    # Read back from disk
+    ledger = TradeLedger(str(tmp_path / 'ledger'), fee_rate=0.0)
+    assert ledger.rows() == 4
+    summaries = ledger.summaries()
+    assert sorted(summaries) == ['BTCUSDT', 'LTCUSDT']
+    ltc = summaries['LTCUSDT']
+    assert (ltc['fills'], ltc['buys'], ltc['sells']) == (2, 1, 1)
+    assert ltc['average_buy'] == 60.0
+    assert ltc['average_sell'] == 62.0
+    assert ltc['realized_pnl'] == 2.0
+    assert ltc['net_position'] == 1.0
+    assert ledger.summary(symbol='LTCUSDT') == ltc
+    assert summaries['BTCUSDT']['spent'] == pytest.approx(300.0)
+    assert ledger.summary(symbol='ETHUSDT')['fills'] == 0
+
+
+def test_period_and_strategy_filters(tmp_path):
+    ledger = TradeLedger(str(tmp_path / 'ledger'))
+    ledger.append('a', FILL, order(1, 'LTCUSDT', 'BUY', 60.0, 1.0), event_time=1000)
+    ledger.append('b', FILL, order(2, 'LTCUSDT', 'BUY', 50.0, 1.0), event_time=5000)
+    ledger.append('a', FILL, order(3, 'LTCUSDT', 'SELL', 70.0, 1.0), event_time=9000)
+    assert ledger.summary(period=5000, now=10000)['fills'] == 2
+    assert ledger.summary(period=1000, now=10000)['fills'] == 1
+    summary = ledger.summary(strategy='a')
+    assert summary['realized_pnl'] == pytest.approx(10.0 - (60.0 + 70.0) * 0.001)
+    assert ledger.summary(strategy='nobody')['fills'] == 0
+    # Fees are estimated on the quote quantity of the fills
+    assert ledger.summary()['fees'] == pytest.approx(180.0 * 0.001)
+
+
+def test_torn_append_is_cut_back(tmp_path):
+    ledger = TradeLedger(str(tmp_path / 'ledger'))
+    ledger.append('a', FILL, order(1, 'LTCUSDT', 'BUY', 60.0, 1.0), event_time=1000)
+    ledger.close()
+    # Crash in the middle of the next append: only the first column got its row
+    with open(os.path.join(str(tmp_path / 'ledger'), 'time.bin'), 'ab') as time_file:
+        time_file.write(np.array(2000, dtype=np.int64).tobytes())
+    ledger = TradeLedger(str(tmp_path / 'ledger'))
+    assert ledger.rows() == 1
+    ledger.append('a', FILL, order(2, 'LTCUSDT', 'SELL', 61.0, 1.0), event_time=3000)
+    assert ledger.rows() == 2
+    assert ledger.summary()['sells'] == 1
+
+
+def test_ledgers_without_the_symbol_column_still_open(tmp_path):
+    ledger = TradeLedger(str(tmp_path / 'ledger'))
+    ledger.append('a', FILL, order(1, 'LTCUSDT', 'BUY', 60.0, 1.0), event_time=1000)
+    ledger.close()
+    os.remove(os.path.join(str(tmp_path / 'ledger'), 'symbol.bin'))
+    ledger = TradeLedger(str(tmp_path / 'ledger'))
+    assert ledger.rows() == 1
+    assert list(ledger.summaries()) == [None]
+    ledger.append('a', FILL, order(2, 'LTCUSDT', 'SELL', 61.0, 1.0), event_time=2000)
+    assert ledger.summary(symbol='LTCUSDT')['fills'] == 1
+
+
+def test_strategy_records_its_orders_and_fills(tmp_path):
+    ledger = TradeLedger(str(tmp_path / 'ledger'))
+    exchange = SimulatedExchange(PriceFeed([60.0, 61.5]), balances={'USDT': 1000.0})
+    grid = GridStrategy(exchange=exchange, ledger=ledger, budget=100, order_tracker=OrderTracker(poll_interval=0.0))
+    grid.debug = False
+    asyncio.run(grid.start_trading())
+    asyncio.run(grid.tick())
+    exchange.advance()
+    asyncio.run(grid.tick())
+    assert grid.trading_state == GridStrategy.SOLD
+    summary = ledger.summary(symbol='LTCUSDT', strategy='LTCUSDT')
+    assert (summary['buys'], summary['sells']) == (1, 1)
+    assert summary['average_sell'] - summary['average_buy'] == pytest.approx(1.0)
+    # Two orders and two fills
+    assert ledger.rows() == 4
+
+
+def test_periods():
+    assert parse_period('all') is None
+    assert parse_period(None) is None
+    assert parse_period('24h') == parse_period('day') == 24 * 3600 * 1000
+    assert parse_period('2w') == 14 * 24 * 3600 * 1000
+    for text in ('7', 'd', '7x', '-1d'):
+        with pytest.raises(ValueError):
+            parse_period(text)
+
+
+def test_format_by_symbol():
+    assert split_symbol('LTCUSDT') == ('LTC', 'USDT')
+    assert split_symbol('ETHBTC') == ('ETH', 'BTC')
+    summary = {'fills': 2, 'buys': 1, 'sells': 1, 'bought': 1.0, 'sold': 1.0, 'spent': 60.0, 'received': 62.0,
+               'average_buy': 60.0, 'average_sell': 62.0, 'fees': 0.122, 'realized_pnl': 1.878, 'net_position': 0.0}
+    text = format_summary(summary, *split_symbol('LTCUSDT'))
+    assert 'Bought: 1.00000 LTC at avg 60.0000' in text
+    assert 'Realized PnL: +1.8780 USDT' in text
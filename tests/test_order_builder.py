@@ -0,0 +1,64 @@
+# SymbolFilters: rounding in favour of the account and checks against the trading rules
+
+from decimal import Decimal
+
+import pytest
+
+from exchange import DEFAULT_SYMBOL_FILTERS
+from order_builder import InvalidOrder, SymbolFilters
+
+
+def filters(tick_size='0.01000000', step_size='0.00001000', min_notional='10.00000000'):
+    return SymbolFilters({'symbol': 'LTCUSDT',
+                          'filters': [{'filterType': 'PRICE_FILTER', 'minPrice': '0.01000000',
+                                       'maxPrice': '100000.00000000', 'tickSize': tick_size},
+                                      {'filterType': 'LOT_SIZE', 'minQty': '0.00001000', 'maxQty': '90000.00000000',
+                                       'stepSize': step_size},
+                                      {'filterType': 'NOTIONAL', 'minNotional': min_notional}]})
+
+
+def test_buy_prices_round_down_and_sell_prices_up():
+    symbol_filters = filters()
+    assert symbol_filters.round_price(60.019, 'BUY') == Decimal('60.01')
+    assert symbol_filters.round_price(60.011, 'SELL') == Decimal('60.02')
+    # Float noise doesn't move a price to the next tick
+    assert symbol_filters.round_price(60 + 0.3, 'SELL') == Decimal('60.30')
+
+
+def test_quantities_round_down():
+    symbol_filters = filters()
+    assert symbol_filters.round_quantity(1.234569) == Decimal('1.23456')
+    assert symbol_filters.round_quantity('0.000019') == Decimal('0.00001')
+
+
+def test_build_returns_strings_ready_to_send():
+    assert filters().build('BUY', 1.234569, 60.019) == ('1.23456', '60.01')
+    assert filters(tick_size='1.00000000', step_size='1.00000000').build('SELL', 2.9, 60.2) == ('2', '61')
+
+
+def test_build_rejects_orders_below_the_minimum_value():
+    with pytest.raises(InvalidOrder) as error:
+        filters().build('BUY', 0.1, 60.0)
+    assert error.value.filter_type == 'MIN_NOTIONAL'
+
+
+def test_build_rejects_quantities_rounded_to_zero():
+    with pytest.raises(InvalidOrder) as error:
+        filters().build('BUY', 0.000001, 60.0)
+    assert error.value.filter_type == 'LOT_SIZE'
+
+
+def test_validate_rejects_unrounded_values():
+    symbol_filters = SymbolFilters({'symbol': 'LTCUSDT', 'filters': DEFAULT_SYMBOL_FILTERS})
+    symbol_filters.validate('1.00000', '60.01')
+    with pytest.raises(InvalidOrder) as error:
+        symbol_filters.validate('1.00000', '60.015')
+    assert error.value.filter_type == 'PRICE_FILTER'
+    with pytest.raises(InvalidOrder) as error:
+        symbol_filters.validate('1.000001', '60.01')
+    assert error.value.filter_type == 'LOT_SIZE'
+
+
+def test_missing_filters_leave_values_as_they_are():
+    symbol_filters = SymbolFilters({'symbol': 'LTCUSDT', 'filters': []})
+    assert symbol_filters.build('BUY', 0.123456789, 60.123456789) == ('0.123456789', '60.123456789')
@@ -0,0 +1,102 @@
+# OrderTracker: which order copies can be trusted without asking Binance
+
+from exchange import PriceFeed, SimulatedExchange
+from order_stream import LocalOrderFeed, OrderTracker, execution_report_to_order, order_to_execution_report
+
+
+def order(order_id, status='NEW'):
+    return {'symbol': 'LTCUSDT', 'orderId': order_id, 'side': 'BUY', 'price': '50.00000000',
+            'origQty': '1.00000000', 'executedQty': '0.00000000', 'cummulativeQuoteQty': '0.00000000',
+            'status': status, 'type': 'LIMIT', 'time': 0, 'updateTime': 0}
+
+
+def test_unknown_order_is_stale():
+    tracker = OrderTracker()
+    assert tracker.is_stale(1)
+    assert tracker.get_cached(1) is None
+
+
+def test_poll_interval_without_stream():
+    tracker = OrderTracker(poll_interval=0.0)
+    tracker.update(order(1))
+    assert tracker.is_stale(1)
+    tracker = OrderTracker(poll_interval=60.0)
+    tracker.update(order(1))
+    assert not tracker.is_stale(1)
+    assert tracker.get_cached(1)['status'] == 'NEW'
+
+
+def test_stream_trusts_copies_longer():
+    tracker = OrderTracker(stale_after=60.0, poll_interval=0.0)
+    tracker.update(order(1))
+    assert tracker.is_stale(1)
+    tracker.on_connect()
+    assert not tracker.is_stale(1)
+    tracker.on_disconnect()
+    assert tracker.is_stale(1)
+
+
+def test_final_orders_are_never_stale():
+    tracker = OrderTracker(stale_after=0.0, poll_interval=0.0)
+    tracker.update(order(1, status='FILLED'))
+    assert not tracker.is_stale(1)
+
+
+def test_stream_fill_wakes_up_listeners():
+    tracker = OrderTracker(poll_interval=0.0)
+    woken = []
+    tracker.add_listener(lambda: woken.append(True))
+    feed = LocalOrderFeed(tracker)
+    feed.start()
+    feed.fill(order(1))
+    assert woken
+    assert tracker.get_cached(1)['status'] == 'FILLED'
+
+
+def test_sync_open_orders_polls_only_the_missing_ones():
+    exchange = SimulatedExchange(PriceFeed([60.0, 40.0]))
+    resting = exchange.order_limit_buy('LTCUSDT', '1.00000', '50.00')
+    filled = exchange.order_limit_buy('LTCUSDT', '1.00000', '45.00')
+    tracker = OrderTracker(poll_interval=60.0)
+    tracker.update(resting)
+    tracker.update(filled)
+    exchange.cancel_order('LTCUSDT', filled['orderId'])
+    calls = exchange.calls
+    tracker.sync_open_orders(exchange, [resting['orderId'], filled['orderId']])
+    # One open orders call, one get_order for the order that's gone
+    assert exchange.calls - calls == 2
+    assert tracker.polls == 1
+    assert tracker.get_cached(resting['orderId'])['status'] == 'NEW'
+    assert tracker.get_cached(filled['orderId'])['status'] == 'CANCELED'
+
+
+def test_late_placement_response_does_not_undo_a_fill():
+    tracker = OrderTracker(stale_after=60.0)
+    feed = LocalOrderFeed(tracker)
+    feed.start()
+    placed = order(1)
+    # The stream reports the fill before the REST response of the placement comes back
+    feed.push(order_to_execution_report(placed, status='FILLED', event_time=2000))
+    tracker.update(dict(placed, updateTime=1000))
+    assert tracker.get_cached(1)['status'] == 'FILLED'
+    assert not tracker.is_stale(1)
+
+
+def test_copies_with_less_executed_or_earlier_are_kept_out():
+    tracker = OrderTracker()
+    tracker.update(dict(order(1, status='PARTIALLY_FILLED'), executedQty='0.50000000', updateTime=2000))
+    tracker.update(dict(order(1), updateTime=3000))
+    assert tracker.last_known(1)['executedQty'] == '0.50000000'
+    tracker.update(dict(order(1, status='PARTIALLY_FILLED'), executedQty='0.50000000', updateTime=1000))
+    assert tracker.last_known(1)['updateTime'] == 2000
+    tracker.update(dict(order(1, status='PARTIALLY_FILLED'), executedQty='0.70000000', updateTime=1500))
+    assert tracker.last_known(1)['executedQty'] == '0.70000000'
+    # A cancel is final whatever its time
+    tracker.update(dict(order(1, status='CANCELED'), executedQty='0.70000000', updateTime=1200))
+    assert tracker.last_known(1)['status'] == 'CANCELED'
+
+
+def test_stream_copies_have_the_transaction_time():
+    event = order_to_execution_report(order(1), event_time=1000)
+    event['E'] = 1005
+    assert execution_report_to_order(event)['updateTime'] == 1000
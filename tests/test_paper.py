@@ -0,0 +1,122 @@
+# Paper trading: matching on the shared market, accounts, events
+
+import pytest
+
+from exchange import PriceFeed, SimulatedExchange, SimulatedExchangeError
+from order_stream import OrderTracker
+from paper import PaperMarket
+
+
+def market_at(price, margin=0.0, fee=0.001):
+    market = PaperMarket(fee=fee, margin=margin)
+    market.replay('LTCUSDT', price)
+    return market
+
+
+def status(account, order):
+    return account.get_order('LTCUSDT', order['orderId'])['status']
+
+
+def test_trades_fill_the_orders_they_cross():
+    market = market_at(60.0)
+    account = market.account({'USDT': 1000.0})
+    buy = account.order_limit_buy('LTCUSDT', '1.00000', '55.00')
+    deep_buy = account.order_limit_buy('LTCUSDT', '1.00000', '50.00')
+    market.replay('LTCUSDT', 56.0)
+    assert status(account, buy) == 'NEW'
+    market.replay('LTCUSDT', 54.0)
+    assert status(account, buy) == 'FILLED'
+    assert status(account, deep_buy) == 'NEW'
+    # Filled at its own price, not the trade's
+    order = account.get_order('LTCUSDT', buy['orderId'])
+    assert float(order['cummulativeQuoteQty']) == 55.0
+    assert account.get_asset_balance('LTC')['free'] == '0.99900000'
+    assert [order['orderId'] for order in market.get_open_orders()] == [deep_buy['orderId']]
+
+
+def test_marketable_orders_fill_at_the_last_price():
+    market = market_at(60.0, fee=0.0)
+    account = market.account({'LTC': 1.0})
+    sell = account.order_limit_sell('LTCUSDT', '1.00000', '55.00')
+    assert sell['status'] == 'FILLED'
+    assert float(sell['cummulativeQuoteQty']) == 60.0
+
+
+def test_margin_needs_the_price_beyond_the_order():
+    market = market_at(60.0, margin=0.5)
+    account = market.account({'LTC': 1.0})
+    sell = account.order_limit_sell('LTCUSDT', '1.00000', '65.00')
+    market.replay('LTCUSDT', 65.0)
+    assert status(account, sell) == 'NEW'
+    market.replay('LTCUSDT', 65.5)
+    assert status(account, sell) == 'FILLED'
+
+
+def test_canceled_orders_are_not_filled():
+    market = market_at(60.0)
+    account = market.account({'USDT': 1000.0})
+    buy = account.order_limit_buy('LTCUSDT', '1.00000', '55.00')
+    account.cancel_order('LTCUSDT', buy['orderId'])
+    market.replay('LTCUSDT', 50.0)
+    assert status(account, buy) == 'CANCELED'
+    assert account.get_asset_balance('USDT')['free'] == '1000.00000000'
+    assert market.fills == 0
+
+
+def test_accounts_share_the_market_but_not_the_balances():
+    market = market_at(60.0)
+    first = market.account({'USDT': 100.0})
+    second = market.account({'USDT': 100.0})
+    first_buy = first.order_limit_buy('LTCUSDT', '1.00000', '55.00')
+    second_buy = second.order_limit_buy('LTCUSDT', '1.00000', '50.00')
+    # Order IDs are unique across the accounts, the market finds every order
+    assert first_buy['orderId'] != second_buy['orderId']
+    assert market.get_order('LTCUSDT', second_buy['orderId'])['price'] == '50.00000000'
+    with pytest.raises(SimulatedExchangeError):
+        first.get_order('LTCUSDT', second_buy['orderId'])
+    market.replay('LTCUSDT', 52.0)
+    assert status(first, first_buy) == 'FILLED'
+    assert status(second, second_buy) == 'NEW'
+    assert second.get_asset_balance('USDT')['free'] == '50.00000000'
+    assert first.value() == pytest.approx(45.0 + 0.999 * 52.0)
+
+
+def test_fills_reach_every_order_tracker():
+    market = market_at(60.0)
+    account = market.account({'USDT': 100.0})
+    tracker = OrderTracker()
+    market.order_stream(tracker).start()
+    buy = account.order_limit_buy('LTCUSDT', '1.00000', '55.00')
+    market.replay('LTCUSDT', 55.0)
+    assert tracker.get_cached(buy['orderId'])['status'] == 'FILLED'
+
+
+def test_no_price_yet_without_a_source():
+    account = PaperMarket().account({'USDT': 100.0})
+    with pytest.raises(SimulatedExchangeError):
+        account.get_symbol_ticker('LTCUSDT')
+
+
+def test_public_data_comes_from_the_source():
+    source = SimulatedExchange(PriceFeed([60.0]))
+    market = PaperMarket(source)
+    account = market.account({'USDT': 100.0})
+    # Asked over the network, account calls block like the market's
+    assert market.blocking and account.blocking
+    assert not PaperMarket().account().blocking
+    assert account.get_symbol_ticker('LTCUSDT')['price'] == '60.00000000'
+    account.get_symbol_info('LTCUSDT')
+    account.get_symbol_info('LTCUSDT')
+    # Trading rules are asked once
+    assert source.calls == 2
+
+
+def test_runner_only_takes_accounts_of_its_market():
+    # Needs python-telegram-bot, through engine.py
+    runner = pytest.importorskip('runner', exc_type=ImportError)
+    market = market_at(60.0)
+    grid_runner = runner.GridRunner(market)
+    grid_runner.add_strategy('LTCUSDT', 1.0, 1.0, exchange=market.account({'USDT': 100.0}))
+    with pytest.raises(ValueError):
+        grid_runner.add_strategy('LTCUSDT', 1.0, 1.0, name='elsewhere',
+                                 exchange=PaperMarket().account({'USDT': 100.0}))
@@ -0,0 +1,76 @@
+# Cancel-replace of the open order when the increments change
+
+import asyncio
+
+from exchange import DEFAULT_SYMBOL_FILTERS, PriceFeed, SimulatedExchange
+from order_stream import OrderTracker
+from strategy import GridStrategy
+
+
+def selling(prices, poll_interval=0.0):
+    # A strategy with its sell order open at 61, one increment above the market buy at 60
+    exchange = SimulatedExchange(PriceFeed(prices), balances={'USDT': 1000.0})
+    grid = GridStrategy(exchange=exchange, budget=100, order_tracker=OrderTracker(poll_interval=poll_interval))
+    grid.debug = False
+    messages = []
+    grid.notifier = lambda strategy, message, fill: messages.append(message)
+    asyncio.run(grid.start_trading())
+    asyncio.run(grid.tick())
+    assert grid.trading_state == GridStrategy.SELL_PLACED
+    return exchange, grid, messages
+
+
+def test_open_order_is_moved_to_the_new_increment():
+    exchange, grid, messages = selling([60.0])
+    buy_id, sell_id = grid.last_two_orders
+    grid.set_increments(sell_increment=2.0)
+    asyncio.run(grid.tick())
+    assert grid.trading_state == GridStrategy.SELL_PLACED
+    assert grid.last_two_orders[0] == buy_id
+    new_sell = exchange.get_order('LTCUSDT', grid.get_last_order())
+    assert new_sell['price'] == '62.00000000'
+    assert exchange.get_order('LTCUSDT', sell_id)['status'] == 'CANCELED'
+    assert [order['orderId'] for order in exchange.get_open_orders()] == [new_sell['orderId']]
+    assert messages[-1].startswith('*Sell order modified*')
+
+
+def test_unrelated_change_leaves_the_order_alone():
+    exchange, grid, messages = selling([60.0])
+    sell_id = grid.get_last_order()
+    grid.set_increments(buy_decrement=2.0)
+    asyncio.run(grid.tick())
+    assert grid.get_last_order() == sell_id
+    assert exchange.get_order('LTCUSDT', sell_id)['status'] == 'NEW'
+
+
+def test_canceled_without_a_new_order_goes_back_one_step():
+    exchange, grid, messages = selling([60.0])
+    buy_id, sell_id = grid.last_two_orders
+    # The exchange rules changed after they were loaded: the cancel goes through, the new order is rejected
+    exchange.symbol_filters = [dict(DEFAULT_SYMBOL_FILTERS[0], tickSize='1.00000000')] + DEFAULT_SYMBOL_FILTERS[1:]
+    grid.set_increments(sell_increment=2.5)
+    asyncio.run(grid.tick())
+    assert exchange.get_order('LTCUSDT', sell_id)['status'] == 'CANCELED'
+    assert grid.trading_state == GridStrategy.BOUGHT
+    assert grid.last_two_orders == [None, buy_id]
+    assert "couldn't do it" in messages[-1]
+
+    # The sell is placed again at the next tick, at the new increment
+    exchange.symbol_filters = DEFAULT_SYMBOL_FILTERS
+    asyncio.run(grid.tick())
+    assert grid.trading_state == GridStrategy.SELL_PLACED
+    assert exchange.get_order('LTCUSDT', grid.get_last_order())['price'] == '62.50000000'
+    assert len(exchange.get_open_orders()) == 1
+
+
+def test_order_filled_before_the_replace_is_not_lost():
+    # The copy of the sell is trusted for a while, the fill isn't known when the replace is tried
+    exchange, grid, messages = selling([60.0, 61.0], poll_interval=60.0)
+    sell_id = grid.get_last_order()
+    exchange.advance()
+    grid.set_increments(sell_increment=2.0)
+    asyncio.run(grid.tick())
+    assert grid.trading_state == GridStrategy.SELL_PLACED
+    assert grid.get_last_order() == sell_id
+    asyncio.run(grid.tick())
+    assert grid.trading_state == GridStrategy.SOLD
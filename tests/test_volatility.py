@@ -0,0 +1,72 @@
+# Adaptive mode: ATR bars and the increments that follow them
+
+import asyncio
+
+import pytest
+
+from exchange import PriceFeed, SimulatedExchange
+from market_data import PriceCache
+from order_stream import OrderTracker
+from strategy import GridStrategy
+from volatility import VolatilityTracker
+
+
+def tracker_with_atr(atr, period=2):
+    # Bars of one second, each with a true range of atr
+    volatility = VolatilityTracker('LTCUSDT', bar_seconds=1.0, period=period)
+    for second in range(period + 1):
+        volatility.update(60.0, now=second)
+        volatility.update(60.0 + atr, now=second + 0.5)
+    return volatility
+
+
+def test_increment_between_floor_and_cap():
+    assert VolatilityTracker('LTCUSDT').increment(1.0) == 1.0
+    assert tracker_with_atr(2.0).atr() == 2.0
+    assert tracker_with_atr(2.0).increment(1.0) == 2.0
+    assert tracker_with_atr(0.5).increment(1.0) == 1.0
+    assert tracker_with_atr(5.0).increment(1.0) == 3.0
+
+
+def test_order_distance_in_adaptive_steps():
+    market_data = PriceCache()
+    market_data.on_connect()
+    exchange = SimulatedExchange(PriceFeed([60.0]), balances={'USDT': 1000.0})
+    grid = GridStrategy(exchange=exchange, budget=100, market_data=market_data,
+                        order_tracker=OrderTracker(poll_interval=0.0), volatility=tracker_with_atr(2.0))
+    grid.debug = False
+    asyncio.run(grid.start_trading())
+    asyncio.run(grid.tick())
+    # The sell went 2 away from the buy, as the volatility says
+    assert exchange.get_order('LTCUSDT', grid.get_last_order())['price'] == '62.00000000'
+    market_data.on_trade('LTCUSDT', 61.0)
+    # Half a step away, not a whole sell increment
+    assert grid.order_distance() == 0.5
+
+
+def test_bars_follow_the_given_clock():
+    now = [0.0]
+    volatility = VolatilityTracker('LTCUSDT', bar_seconds=60.0, period=2, clock=lambda: now[0])
+    # Replayed trades, a minute apart whatever the wall clock says
+    for minute, (low, high) in enumerate(((59.0, 61.0), (60.0, 62.0), (60.0, 61.0))):
+        now[0] = minute * 60.0
+        volatility.on_trade('LTCUSDT', low)
+        volatility.on_trade('LTCUSDT', high)
+        volatility.on_trade('BTCUSDT', 30000.0)
+    assert volatility.atr() == 2.0
+
+
+def test_paper_replay_builds_bars():
+    from paper import PaperMarket
+    runner = pytest.importorskip('runner', exc_type=ImportError)
+    market = PaperMarket()
+    grid_runner = runner.GridRunner(market)
+    grid_runner.debug = False
+    strategy = grid_runner.add_strategy('LTCUSDT', 1.0, 1.0, exchange=market.account({'USDT': 1000.0}),
+                                        adaptive=True)
+    grid_runner.start_market_stream()
+    for minute in range(20):
+        market.replay('LTCUSDT', 60.0, minute * 60000)
+        market.replay('LTCUSDT', 62.5, minute * 60000 + 30000)
+    assert strategy.volatility.atr() == 2.5
+    assert strategy.next_sell_increment() == 2.5
@@ -0,0 +1,57 @@
+# Exchange clock
+#
+# Signed Binance calls carry a timestamp, and Binance rejects them (-1021, "Timestamp for this request is outside
+# of the recvWindow") when it's more than a second ahead of its clock or more than recvWindow (5 s) behind it. A
+# local clock that drifts, or that NTP steps, makes every signed call fail until it's fixed.
+#
+# TimeSync asks the exchange for its time (GET /api/v3/time) and keeps an estimate of it: the server time at the
+# middle of the request, moved forward with time.monotonic(), so that steps of the local clock don't affect it.
+# It's synced again every resync_interval seconds (see BinanceExchange.keep_alive, the request keeps the
+# connection warm too) and right away when a timestamp is rejected anyway (see BinanceClient._request).
+#
+# server_time is any function returning the exchange time in ms, e.g. a fake clock in tests.
+
+import threading
+import time
+
+
+class TimeSync:
+    DEFAULT_RESYNC_INTERVAL = 300.0
+
+    def __init__(self, server_time, resync_interval=DEFAULT_RESYNC_INTERVAL, metrics=None):
+        self.server_time = server_time
+        self.resync_interval = resync_interval
+        self.lock = threading.Lock()
+        # Exchange time in ms at base_monotonic, None until the first sync
+        self.base = None
+        self.base_monotonic = None
+        self.offset = 0             # exchange time - local time at the last sync, ms
+        self.round_trip = None      # of the last sync, s
+        self.syncs = 0
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.add_collector(self.collect)
+
+    def collect(self):
+        return [('exchange_clock_offset_ms', {}, self.offset)]
+
+    def sync(self):
+        start = time.monotonic()
+        server_time = self.server_time()
+        end = time.monotonic()
+        with self.lock:
+            self.base = server_time
+            self.base_monotonic = (start + end) / 2
+            self.offset = server_time - int(time.time() * 1000 - (end - self.base_monotonic) * 1000)
+            self.round_trip = end - start
+            self.syncs += 1
+
+    def due(self):
+        return self.base_monotonic is None or time.monotonic() - self.base_monotonic > self.resync_interval
+
+    def now(self):
+        # Exchange time in ms, the local clock until the first sync
+        with self.lock:
+            if self.base is None:
+                return int(time.time() * 1000)
+            return self.base + int((time.monotonic() - self.base_monotonic) * 1000)
@@ -0,0 +1,98 @@
+# Volatility of the live price
+#
+# In adaptive mode (see GridStrategy.next_sell_increment) the next sell and buy prices are placed multiplier
+# times the average true range (ATR) away from the last fill, instead of the fixed sell increment and buy
+# decrement: wider when the market moves a lot, tighter when it's quiet. The fixed values are the floors, cap
+# times them the caps.
+#
+# VolatilityTracker is fed by every trade of the market data stream (see market_data.PriceCache.add_trade_listener)
+# and builds bars of bar_seconds: at the end of each bar its true range goes into a ring buffer of the last period
+# bars, and a running sum gives the ATR. Every trade costs a few comparisons, every bar a few additions.
+#
+# Bars follow clock, the exchange clock of the strategy (see GridStrategy.exchange_clock): on recorded prices (paper
+# trading replays, simulations) that's the time of the replayed trades, not the wall clock.
+#
+# Until period bars have been seen the ATR isn't known and the fixed values are used.
+
+import threading
+import time
+
+
+class VolatilityTracker:
+    DEFAULT_BAR_SECONDS = 60.0
+    DEFAULT_PERIOD = 14
+    DEFAULT_MULTIPLIER = 1.0
+    DEFAULT_CAP = 3.0
+
+    def __init__(self, symbol, bar_seconds=DEFAULT_BAR_SECONDS, period=DEFAULT_PERIOD,
+                 multiplier=DEFAULT_MULTIPLIER, cap=DEFAULT_CAP, clock=time.time):
+        self.symbol = symbol
+        # Seconds now, called at every trade
+        self.clock = clock
+        self.bar_seconds = bar_seconds
+        self.period = period
+        self.multiplier = multiplier
+        self.cap = cap
+        self.lock = threading.Lock()
+
+        # Bar being built
+        self.bar = None             # index of the bar, time / bar_seconds
+        self.high = None
+        self.low = None
+        self.close = None
+        self.previous_close = None
+
+        # True ranges of the last period bars
+        self.ranges = [0.0] * period
+        self.index = 0              # where the next one goes
+        self.count = 0
+        self.total = 0.0
+
+    def on_trade(self, symbol, price):
+        # PriceCache trade listener, called by the stream thread
+        if symbol == self.symbol:
+            self.update(price)
+
+    def update(self, price, now=None):
+        if now is None:
+            now = self.clock()
+        bar = int(now // self.bar_seconds)
+        with self.lock:
+            if bar != self.bar:
+                if self.bar is not None:
+                    self.close_bar()
+                self.bar = bar
+                self.high = self.low = price
+            elif price > self.high:
+                self.high = price
+            elif price < self.low:
+                self.low = price
+            self.close = price
+
+    def close_bar(self):
+        if self.previous_close is None:
+            true_range = self.high - self.low
+        else:
+            true_range = max(self.high, self.previous_close) - min(self.low, self.previous_close)
+        self.previous_close = self.close
+        self.total += true_range - self.ranges[self.index]
+        self.ranges[self.index] = true_range
+        self.index = (self.index + 1) % self.period
+        self.count = min(self.count + 1, self.period)
+        if self.index == 0:
+            # Once per round, so that the rounding errors of the running sum don't add up
+            self.total = sum(self.ranges)
+
+    def atr(self):
+        # None until period bars have been seen
+        with self.lock:
+            if self.count < self.period:
+                return None
+            return self.total / self.period
+
+    def increment(self, floor):
+        # multiplier * ATR between floor and cap * floor, floor while the ATR isn't known
+        atr = self.atr()
+        if atr is None:
+            return floor
+        return round(min(max(atr * self.multiplier, floor), floor * self.cap), 8)